@@ -0,0 +1,486 @@
+import sqlite3
+import os
+import glob
+import json
+import time
+import queue
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Container, Dict, Iterable, Iterator, List, Optional, Any, Sequence, Tuple
+
+from sharding import DEFAULT_SHARD_DIR
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+BUSY_TIMEOUT_SECONDS = 30
+
+DOUBLE_ENTRY = 'double_entry'
+EXIT_WITHOUT_ENTRY = 'exit_without_entry'
+IMPOSSIBLE_TRANSIT = 'impossible_transit'
+DISTANT_REUSE = 'distant_reuse'
+ALERT_TYPES = (DOUBLE_ENTRY, EXIT_WITHOUT_ENTRY, IMPOSSIBLE_TRANSIT, DISTANT_REUSE)
+
+# Faster than any train between two stations, so only physically impossible timings are flagged
+DEFAULT_MAX_SPEED_KMH = 90.0
+# Trips scanned per chunk by the backfill; a card's history may span several chunks
+DEFAULT_CHUNK_ROWS = 5000
+# Trips read back to rebuild a card's state on a cache miss
+STATE_HISTORY_ROWS = 20
+
+ALERT_TABLE = """
+CREATE TABLE IF NOT EXISTS TripAlert (
+    AlertID INTEGER PRIMARY KEY AUTOINCREMENT,
+    AlertType TEXT NOT NULL,
+    CardID INTEGER NOT NULL,
+    TripID INTEGER NOT NULL,
+    RelatedTripID INTEGER,
+    StationID INTEGER,
+    OccurredAt TEXT NOT NULL,
+    Details TEXT,
+    DetectedAt TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+    UNIQUE (TripID, AlertType)
+)"""
+
+ALERT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_trip_alert_card ON TripAlert (CardID, OccurredAt)",
+    "CREATE INDEX IF NOT EXISTS idx_trip_alert_type ON TripAlert (AlertType, OccurredAt)",
+    "CREATE INDEX IF NOT EXISTS idx_trip_alert_time ON TripAlert (OccurredAt)"
+]
+
+# One alert per trip and type, so the tap path and the nightly backfill never duplicate each other
+INSERT_ALERT = """
+    INSERT OR IGNORE INTO TripAlert
+        (AlertType, CardID, TripID, RelatedTripID, StationID, OccurredAt, Details)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# The idx_trip_card index on (CardID, EntryTime) with its trailing rowid yields this order
+# without a sort; each row is one journey, closed in place by its exit tap
+BACKFILL_QUERY = """
+    SELECT CardID, TripID, EntryTime, ExitTime, EntryStationID, ExitStationID
+    FROM Trip
+    WHERE EntryTime >= ?
+    ORDER BY CardID, EntryTime, TripID
+"""
+
+CARD_HISTORY_QUERY = """
+    SELECT TripID, EntryTime, ExitTime, EntryStationID, ExitStationID
+    FROM Trip
+    WHERE CardID = ? AND TripID < ?
+    ORDER BY EntryTime DESC, TripID DESC
+    LIMIT ?
+"""
+
+# (TripID, EntryTime, ExitTime, EntryStationID, ExitStationID)
+TripRow = Tuple[int, Optional[str], Optional[str], int, Optional[int]]
+# (AlertType, CardID, TripID, RelatedTripID, StationID, OccurredAt, Details)
+Alert = Tuple[str, int, int, Optional[int], Optional[int], str, str]
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the TripAlert table and its indexes."""
+    conn.execute(ALERT_TABLE)
+    for create_sql in ALERT_INDEXES:
+        conn.execute(create_sql)
+    conn.commit()
+
+
+def write_alerts(conn: sqlite3.Connection, alerts: Sequence[Alert]) -> int:
+    """Insert alerts in one transaction; returns how many were new."""
+    if not alerts:
+        return 0
+    before = conn.total_changes
+    with conn:
+        conn.executemany(INSERT_ALERT, alerts)
+    return conn.total_changes - before
+
+
+def _epoch(value: Optional[str]) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class CardState:
+    """Where a card was last seen and the entry it has not exited from yet."""
+
+    __slots__ = ('pending', 'last')
+
+    def __init__(self):
+        # (TripID, entry epoch, EntryStationID, epoch the sweeper closed it or None)
+        self.pending: Optional[Tuple[int, float, int, Optional[float]]] = None
+        # (TripID, epoch, StationID) of the latest tap
+        self.last: Optional[Tuple[int, float, int]] = None
+
+
+class TripScanner:
+    """
+    The anomaly rules, applied to one card's trips in time order.
+
+    Each Trip row is one journey: an entry tap inserts it open and the exit
+    tap closes it in place. A journey that starts while the card's previous
+    one is still open is a double entry. An exit tap that found no open trip
+    is written as a complete journey of its own, which looks like any other
+    in the table, so exits without an entry are only flagged for TripIDs
+    the write path reports as such. Travel times are checked against the
+    shortest network distance at max_speed_kmh: a trip faster than that, or
+    a tap too soon after the card was seen at another station, cannot have
+    been made by one card.
+    """
+
+    def __init__(self, distance: Callable[[int, int], Optional[float]],
+                 max_speed_kmh: float = DEFAULT_MAX_SPEED_KMH):
+        self.distance = distance
+        self.max_speed_kmh = max_speed_kmh
+
+    def min_seconds(self, from_id: int, to_id: int) -> Optional[float]:
+        """Least possible travel time between two stations, or None if it is unknown."""
+        distance = self.distance(from_id, to_id)
+        return distance / self.max_speed_kmh * 3600 if distance else None
+
+    def _too_fast(self, from_id: int, to_id: int, seconds: float) -> Optional[float]:
+        """The minimum travel time if seconds undercuts it, else None."""
+        if from_id == to_id:
+            return None
+        least = self.min_seconds(from_id, to_id)
+        return least if least is not None and seconds < least else None
+
+    def scan(self, card_id: int, rows: Sequence[TripRow], state: CardState, emit: bool = True,
+             unmatched_exits: Container[int] = ()) -> List[Alert]:
+        """
+        Run the rules over a chunk of one card's trips
+        :param card_id: card the rows belong to
+        :param rows: trips in (EntryTime, TripID) order, continuing from state; a row repeating
+                     the pending entry's TripID is that journey closed by its exit tap
+        :param state: the card's state before the chunk; updated in place
+        :param emit: False only replays rows to rebuild state
+        :param unmatched_exits: TripIDs written by an exit tap that found no open trip
+        :return: alerts raised by the chunk
+        """
+        if not rows:
+            return []
+        # Columns of the chunk; times are parsed once per chunk, not per rule
+        trip_ids, entry_times, exit_times, entry_stations, exit_stations = zip(*rows)
+        entries = [_epoch(value) for value in entry_times]
+        exits = [_epoch(value) for value in exit_times]
+
+        alerts: List[Alert] = []
+
+        def alert(alert_type: str, index: int, related: Optional[int], station: Optional[int],
+                  occurred: Optional[str], **details: Any) -> None:
+            if emit:
+                alerts.append((alert_type, card_id, trip_ids[index], related, station,
+                               occurred or entry_times[index], json.dumps(details, sort_keys=True)))
+
+        for i, entered in enumerate(entries):
+            if entered is None:
+                continue
+            trip_id, entry_station, exit_station, exited = trip_ids[i], entry_stations[i], exit_stations[i], exits[i]
+            pending = state.pending
+
+            if pending is not None and pending[0] == trip_id and exit_station is not None:
+                # The exit tap closing the pending entry; the entry itself was checked when it was seen
+                state.pending = None
+            else:
+                # A journey starting here, while the card should be outside the network
+                if pending is not None and (pending[3] is None or entered < pending[3]):
+                    alert(DOUBLE_ENTRY, i, pending[0], entry_station, entry_times[i],
+                          previousStationId=pending[2], secondsSincePreviousEntry=round(entered - pending[1]))
+                last = state.last
+                if last is not None:
+                    least = self._too_fast(last[2], entry_station, entered - last[1])
+                    if least is not None:
+                        alert(DISTANT_REUSE, i, last[0], entry_station, entry_times[i],
+                              previousStationId=last[2], seconds=round(entered - last[1]),
+                              minimumSeconds=round(least))
+                if exit_station is None:
+                    # Still open; ExitTime is only set if the sweeper closed the trip unexited
+                    state.pending = (trip_id, entered, entry_station, exited)
+                    state.last = (trip_id, entered, entry_station)
+                    continue
+                # A complete journey: the card has left the network, whatever was open before
+                state.pending = None
+
+            if exited is None:
+                continue
+            if trip_id in unmatched_exits:
+                # A swept entry here means the card exited after the sweeper gave up on it
+                alert(EXIT_WITHOUT_ENTRY, i, pending[0] if pending else None, exit_station, exit_times[i],
+                      entryStationId=entry_station, pendingStationId=pending[2] if pending else None)
+            if exited < entered:
+                alert(IMPOSSIBLE_TRANSIT, i, None, exit_station, exit_times[i],
+                      entryStationId=entry_station, seconds=round(exited - entered), minimumSeconds=0)
+            else:
+                least = self._too_fast(entry_station, exit_station, exited - entered)
+                if least is not None:
+                    alert(IMPOSSIBLE_TRANSIT, i, None, exit_station, exit_times[i],
+                          entryStationId=entry_station, seconds=round(exited - entered),
+                          minimumSeconds=round(least))
+            state.last = (trip_id, exited, exit_station)
+        return alerts
+
+
+def card_chunks(rows: Iterable[Tuple], chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[Tuple[int, List[TripRow]]]:
+    """Split (CardID, ...trip columns) rows ordered by card into per-card chunks of at most chunk_rows."""
+    for card_id, card_rows in groupby(rows, key=itemgetter(0)):
+        chunk: List[TripRow] = []
+        for row in card_rows:
+            chunk.append(row[1:])
+            if len(chunk) >= chunk_rows:
+                yield card_id, chunk
+                chunk = []
+        if chunk:
+            yield card_id, chunk
+
+
+def _fetch(cursor: sqlite3.Cursor, size: int) -> Iterator[Tuple]:
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return
+        yield from batch
+
+
+def backfill(db_path: str, scanner: TripScanner, alert_db_path: Optional[str] = None, since: str = '0000',
+             chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Dict[str, Any]:
+    """
+    Scan every trip of one database card by card and record the alerts
+    :param db_path: database (or shard) whose Trip table is scanned
+    :param scanner: rules and travel times
+    :param alert_db_path: database holding TripAlert (defaults to db_path)
+    :param since: only trips entered at or after this time (the card state starts empty there)
+    :param chunk_rows: trips per chunk; also the fetch and alert batch size
+    :return: counts and timing
+    """
+    started = datetime.now()
+    source = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_SECONDS)
+    target = sqlite3.connect(alert_db_path or db_path, timeout=BUSY_TIMEOUT_SECONDS)
+    trips = cards = found = written = 0
+    try:
+        ensure_schema(target)
+        pending: List[Alert] = []
+        state, state_card = CardState(), None
+        for card_id, chunk in card_chunks(_fetch(source.execute(BACKFILL_QUERY, (since,)), chunk_rows), chunk_rows):
+            if card_id != state_card:
+                state, state_card = CardState(), card_id
+                cards += 1
+            trips += len(chunk)
+            pending += scanner.scan(card_id, chunk, state)
+            if len(pending) >= chunk_rows:
+                found += len(pending)
+                written += write_alerts(target, pending)
+                pending = []
+        found += len(pending)
+        written += write_alerts(target, pending)
+    finally:
+        source.close()
+        target.close()
+    elapsed = round((datetime.now() - started).total_seconds(), 3)
+    logger.info(f"Scanned {trips} trip(s) of {cards} card(s) in {db_path}: "
+                f"{found} anomaly(ies), {written} new, in {elapsed}s")
+    return {'trips': trips, 'cards': cards, 'alerts': found, 'new_alerts': written, 'elapsed_seconds': elapsed}
+
+
+class AnomalyDetector:
+    """
+    Incremental anomaly checks for trips written on the tap path.
+
+    The tap path only enqueues the written trip; a background thread runs
+    the rules against each card's state, kept in an LRU map and rebuilt from
+    the card's latest trips on a miss, and writes alerts in batches. A full
+    queue drops the trip rather than slow a gate, and the nightly backfill
+    covers whatever was dropped.
+    """
+
+    def __init__(self, db_path: str, scanner: TripScanner,
+                 connect: Optional[Callable[[int], sqlite3.Connection]] = None,
+                 refresh_graph: Optional[Callable[[sqlite3.Connection], Any]] = None,
+                 refresh_interval: float = 60.0, max_cards: int = 100000, queue_size: int = 10000,
+                 batch_size: int = 500):
+        self.db_path = db_path
+        self.scanner = scanner
+        self.refresh_graph = refresh_graph
+        self.refresh_interval = refresh_interval
+        self._refreshed = 0.0
+        self.max_cards = max_cards
+        self.batch_size = batch_size
+        self._connect = connect or (lambda card_id: sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS))
+        self._queue: 'queue.Queue[Tuple[str, int, Any]]' = queue.Queue(maxsize=queue_size)
+        self._states: 'OrderedDict[int, CardState]' = OrderedDict()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {'observed': 0, 'dropped': 0, 'state_loads': 0, 'alerts': 0, 'errors': 0}
+        self._by_type = {alert_type: 0 for alert_type in ALERT_TYPES}
+
+    # ==================== Tap path ====================
+
+    def _offer(self, item: Tuple[str, int, Any]) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def observe(self, trip_id: int, card_id: int, entry_time: Optional[str], exit_time: Optional[str],
+                entry_station_id: int, exit_station_id: Optional[int], unmatched_exit: bool = False) -> None:
+        """
+        Queue a trip that was just written for checking; never blocks
+        :param trip_id: TripID the tap wrote or closed
+        :param card_id: card of the trip
+        :param entry_time: entry time as stored (for a closing exit, that of the trip it closed)
+        :param exit_time: exit time, None for an entry tap
+        :param entry_station_id: entry station as stored
+        :param exit_station_id: exit station, None for an entry tap
+        :param unmatched_exit: an exit tap that found no open trip and was written as a trip of its own
+        """
+        self._offer(('trip', card_id, ((trip_id, entry_time, exit_time, entry_station_id, exit_station_id),
+                                       unmatched_exit)))
+
+    def mark_closed(self, card_id: int) -> None:
+        """Note that the sweeper closed the card's unexited entry."""
+        self._offer(('closed', card_id, datetime.now().timestamp()))
+
+    # ==================== Checking ====================
+
+    def _state(self, card_id: int, before_trip_id: int) -> CardState:
+        """The card's state from the cache, or replayed from its trips before before_trip_id."""
+        state = self._states.get(card_id)
+        if state is not None:
+            self._states.move_to_end(card_id)
+            return state
+        state = CardState()
+        conn = self._connect(card_id)
+        try:
+            rows = conn.execute(CARD_HISTORY_QUERY, (card_id, before_trip_id, STATE_HISTORY_ROWS)).fetchall()
+        finally:
+            conn.close()
+        self.scanner.scan(card_id, [tuple(row) for row in reversed(rows)], state, emit=False)
+        with self._lock:
+            self._stats['state_loads'] += 1
+        self._states[card_id] = state
+        while len(self._states) > self.max_cards:
+            self._states.popitem(last=False)
+        return state
+
+    def process(self, items: Sequence[Tuple[str, int, Any]]) -> List[Alert]:
+        """Run queued trips and sweeper closes through the rules (background thread only)."""
+        alerts: List[Alert] = []
+        for kind, card_id, payload in items:
+            if kind == 'closed':
+                state = self._states.get(card_id)
+                if state is not None and state.pending is not None:
+                    state.pending = state.pending[:3] + (payload,)
+                continue
+            row, unmatched_exit = payload
+            alerts += self.scanner.scan(card_id, [row], self._state(card_id, row[0]),
+                                        unmatched_exits=(row[0],) if unmatched_exit else ())
+        return alerts
+
+    def _record(self, alerts: Sequence[Alert]) -> None:
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS)
+        try:
+            write_alerts(conn, alerts)
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats['alerts'] += len(alerts)
+            for alert in alerts:
+                self._by_type[alert[0]] += 1
+        for alert_type, card_id, trip_id, *_ in alerts:
+            logger.warning(f"Trip anomaly {alert_type} on card {card_id} (trip {trip_id})")
+
+    def _refresh(self) -> None:
+        """Pick up station network changes for the travel-time rules, at most every refresh_interval."""
+        if self.refresh_graph is None or time.monotonic() - self._refreshed < self.refresh_interval:
+            return
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS)
+        try:
+            self.refresh_graph(conn)
+        finally:
+            conn.close()
+        self._refreshed = time.monotonic()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                items = [self._queue.get(timeout=1.0)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._refresh()
+                alerts = self.process(items)
+                with self._lock:
+                    self._stats['observed'] += sum(1 for kind, _, _ in items if kind == 'trip')
+                if alerts:
+                    self._record(alerts)
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                logger.error(f"Error checking trips for anomalies: {e}")
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='anomaly-detector', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['alerts_by_type'] = dict(self._by_type)
+        stats['queued'] = self._queue.qsize()
+        stats['cached_cards'] = len(self._states)
+        stats['max_speed_kmh'] = self.scanner.max_speed_kmh
+        stats['running'] = bool(self._thread and self._thread.is_alive())
+        return stats
+
+
+if __name__ == '__main__':
+    from station_graph import StationGraph
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Scan trips for impossible journeys and card misuse')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the SQLite database (alerts are written here)')
+    parser.add_argument('--since', default='0000', help='only scan trips entered at or after this time')
+    parser.add_argument('--max-kmh', type=float, default=DEFAULT_MAX_SPEED_KMH,
+                        help='fastest plausible travel speed between stations')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help='trips per chunk')
+    parser.add_argument('--shard-dir', default=None,
+                        help=f"also scan the card shards in this directory (e.g. {DEFAULT_SHARD_DIR})")
+    args = parser.parse_args()
+
+    graph = StationGraph()
+    conn = sqlite3.connect(args.db)
+    try:
+        graph.refresh(conn)
+    finally:
+        conn.close()
+    trip_scanner = TripScanner(graph.distance, args.max_kmh)
+    sources = [args.db]
+    if args.shard_dir:
+        sources += sorted(glob.glob(os.path.join(args.shard_dir, 'metro_shard_*.db')))
+    for path in sources:
+        result = backfill(path, trip_scanner, args.db, args.since, args.chunk_rows)
+        print(f"{path}: {result['trips']} trip(s) of {result['cards']} card(s), "
+              f"{result['alerts']} anomaly(ies), {result['new_alerts']} new, in {result['elapsed_seconds']}s")
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context, make_response, Response
 from flask_cors import CORS
 import sqlite3
 import os
@@ -6,7 +6,40 @@ import logging
 import sys
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Union, Any
+from typing import Dict, List, Optional, Sequence, Union, Any
+from urllib.parse import urlencode
+import atexit
+import time
+import json
+import io
+import csv
+import heapq
+from functools import wraps
+
+from card_store import CardStateStore
+from archive import PartitionRouter
+from replica import ReplicaManager
+from tap_filter import TapFilter, DUPLICATE, PASSBACK, PENDING
+from tap_journal import TapJournal, JournalFull, JournalTimeout, write_tap
+from idempotency import IdempotencyStore, KeyConflict, KeyInFlight, fingerprint
+from station_graph import StationGraph, ensure_schema as ensure_graph_schema
+from fare_windows import FareWindowResolver
+from trip_sweeper import TripSweeper
+from change_feed import ChangeFeed
+from card_history import CardHistory, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from station_live import StationLiveCounters, OPEN_BY_STATION_QUERY
+from compression import GzipCompressor
+from maintenance import MaintenanceScheduler
+from profiling import RequestProfiler, PROFILE_HEADER
+from sharding import ShardedStore, DEFAULT_SHARD_DIR
+from onboarding import OnboardingImport, read_rows
+from passenger_summary import (SUMMARY_SELECT, ensure_schema as ensure_passenger_summary,
+                               rebuild as rebuild_passenger_summaries)
+from anomaly import AnomalyDetector, TripScanner, ensure_schema as ensure_alert_schema, DEFAULT_MAX_SPEED_KMH
+from memory_guard import MemoryGuard
+from reconciliation import ISSUE_INSERT
+from list_filters import (ListQuery, FilterError, wants_count, wants_stream,
+                          TRIP_QUERY, TRANSACTION_QUERY, CARD_QUERY, PASSENGER_QUERY, ALERT_QUERY)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -36,11 +69,160 @@ def root():
 
 # Database configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+# METRO_DB_PATH moves the database; the card snapshot, tap journal and archives live next to it
+DB_PATH = os.environ.get('METRO_DB_PATH') or os.path.join(BASE_DIR, '..', 'project.db')
+CARD_STATE_PATH = os.path.join(os.path.dirname(DB_PATH), 'card_state.snapshot')
+TAP_JOURNAL_PATH = os.path.join(os.path.dirname(DB_PATH), 'tap_journal.log')
+# Rows per chunk of a streamed list response
+STREAM_BATCH_ROWS = 500
+
+# Hot per-card state (balance, status, fare multiplier), kept in sync with Card
+card_store = CardStateStore()
+# Time-range reads over the hot database plus the per-month archives
+archive_router = PartitionRouter(DB_PATH, os.path.join(os.path.dirname(DB_PATH), 'archive'))
+# Merged trip/transaction timeline per card, including archived months
+card_history = CardHistory(archive_router.archive_dir)
+# A client's last write time, sent back on every successful write and echoed by the client
+# (cookie, or header for non-browser clients) so its reads never see a snapshot older than it
+LAST_WRITE_COOKIE = 'metro_last_write'
+LAST_WRITE_HEADER = 'X-Last-Write'
+# Read-only snapshot of project.db for GET endpoints that can tolerate stale data. With sharded
+# storage it still only serves project.db tables: card-scoped reads go to the shards directly
+replica = ReplicaManager(
+    DB_PATH,
+    replica_path=os.environ.get('METRO_REPLICA_PATH', ':memory:'),
+    refresh_interval=float(os.environ.get('METRO_REPLICA_INTERVAL', '30'))
+)
+# Duplicate-tap debounce and anti-passback in front of trip writes
+tap_filter = TapFilter(window_seconds=float(os.environ.get('METRO_TAP_WINDOW', '10')))
+# Stored responses for create requests carrying an Idempotency-Key header
+idempotency_store = IdempotencyStore(DB_PATH)
+# All-pairs route/fare matrices over the station network
+station_graph = StationGraph()
+# Peak/Off-Peak resolution of trip entry times
+fare_resolver = FareWindowResolver()
+
+def on_trips_swept(charged: List[tuple]) -> None:
+    """Keep the in-memory card state, open-trip cache and station counters in step with swept trips."""
+    station_live.request_reconcile()
+    for card_id, amount in charged:
+        tap_filter.mark_closed(card_id)
+        anomaly_detector.mark_closed(card_id)
+        try:
+            card_store.adjust_balance(card_id, -amount)
+        except KeyError:
+            pass
+
+# Optional hash-sharded storage for Card/Trip/Transaction; METRO_SHARDS >= 2 enables it
+SHARD_COUNT = int(os.environ.get('METRO_SHARDS', '0'))
+shard_store = ShardedStore(
+    DB_PATH, SHARD_COUNT, os.environ.get('METRO_SHARD_DIR', DEFAULT_SHARD_DIR)
+) if SHARD_COUNT > 1 else None
+# Background closing of abandoned trips, in project.db or every card shard
+trip_sweeper = TripSweeper(
+    DB_PATH,
+    max_age_hours=float(os.environ.get('METRO_OPEN_TRIP_MAX_AGE_HOURS', '6')),
+    penalty_fare=float(os.environ['METRO_PENALTY_FARE']) if os.environ.get('METRO_PENALTY_FARE') else None,
+    on_closed=on_trips_swept,
+    shard_paths=[shard_store.shard_path(shard) for shard in range(SHARD_COUNT)] if shard_store else ()
+)
+# Trigger-populated change log for delta sync (long-poll and SSE). The capture triggers only
+# see project.db, so with sharded storage the feed is refused rather than served incomplete
+CHANGE_FEED_UNAVAILABLE = "The change feed is not available with sharded storage (METRO_SHARDS)"
+change_feed = ChangeFeed(DB_PATH) if not shard_store else None
+
+def on_taps_applied(applied: List[tuple]) -> None:
+    """
+    Swap the tap filter's placeholders for the TripIDs the journal drainer wrote, take closed trips
+    off the live open counts, and check the trips.
+    """
+    for values, trip_id, closed in applied:
+        entry_time, exit_time, _, card_id, entry_station_id, exit_station_id = values
+        direction = 'exit' if exit_station_id else 'entry'
+        tap_filter.resolve_pending(card_id, exit_station_id or entry_station_id, direction, trip_id)
+        if closed:
+            station_live.record_close(closed[0])
+            entry_station_id, entry_time = closed
+        anomaly_detector.observe(trip_id, card_id, entry_time, exit_time, entry_station_id, exit_station_id,
+                                 unmatched_exit=direction == 'exit' and not closed)
+
+# Durable journal that acknowledges gate taps before they reach Trip (METRO_TAP_JOURNAL=1);
+# sharded storage already splits the write lock, so the journal is only used without it
+TAP_JOURNAL_REQUESTED = os.environ.get('METRO_TAP_JOURNAL', '').lower() in ('1', 'true', 'yes')
+tap_journal = TapJournal(
+    TAP_JOURNAL_PATH, DB_PATH, on_applied=on_taps_applied
+) if TAP_JOURNAL_REQUESTED and not shard_store else None
+if TAP_JOURNAL_REQUESTED and shard_store:
+    logger.warning("Tap journal disabled: taps are written to the card shards (METRO_SHARDS)")
+def live_open_counts() -> Dict[int, int]:
+    """Open trips per entry station in project.db or the shards, plus journaled entries not yet applied."""
+    if shard_store:
+        counts: Dict[int, int] = {}
+        for row in shard_store.scatter(OPEN_BY_STATION_QUERY):
+            counts[row['StationID']] = counts.get(row['StationID'], 0) + row['OpenTrips']
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=5)
+        try:
+            counts = {station_id: count for station_id, count in conn.execute(OPEN_BY_STATION_QUERY)}
+        finally:
+            conn.close()
+    if tap_journal:
+        for station_id, count in tap_journal.pending_open_trips().items():
+            counts[station_id] = counts.get(station_id, 0) + count
+    return counts
+
+# Per-station open trips and 5-minute entry/exit rates, reconciled against the database
+station_live = StationLiveCounters(
+    DB_PATH,
+    window_seconds=int(os.environ.get('METRO_LIVE_WINDOW_SECONDS', '300')),
+    reconcile_interval=float(os.environ.get('METRO_LIVE_RECONCILE_INTERVAL', '60')),
+    open_counts=live_open_counts
+)
+# Double entries, exits without entries and impossible travel times, checked off the tap path
+anomaly_detector = AnomalyDetector(
+    DB_PATH,
+    TripScanner(station_graph.distance,
+                float(os.environ.get('METRO_ANOMALY_MAX_KMH', str(DEFAULT_MAX_SPEED_KMH)))),
+    connect=shard_store.connect_for_card if shard_store else None,
+    refresh_graph=station_graph.refresh
+)
+# WAL checkpoints, statistics and vacuum in quiet periods or the maintenance window
+maintenance = MaintenanceScheduler(
+    DB_PATH,
+    interval_seconds=float(os.environ.get('METRO_MAINTENANCE_INTERVAL', '60')),
+    window=tuple(os.environ.get('METRO_MAINTENANCE_WINDOW', '02:00-05:00').split('-', 1))
+)
+# Expired idempotency keys are purged on every maintenance pass
+maintenance.add_task('idempotency_purge', idempotency_store.purge_expired)
+if shard_store:
+    # Shard writes never reach the PassengerSummary triggers in project.db, so with sharded
+    # storage the summaries are rebuilt from the shards on a schedule and lag by up to that long
+    maintenance.add_task('passenger_summary_rebuild', lambda: rebuild_passenger_summaries(
+        DB_PATH, archive_router.archive_dir, [shard_store.shard_path(shard) for shard in range(SHARD_COUNT)]
+    ), every_seconds=float(os.environ.get('METRO_SUMMARY_REBUILD_INTERVAL', '900')))
+# gzip for clients that accept it, including streamed responses
+compressor = GzipCompressor(
+    level=int(os.environ.get('METRO_GZIP_LEVEL', '5')),
+    min_size=int(os.environ.get('METRO_GZIP_MIN_SIZE', '1024'))
+)
+# Row limits for list responses derived from a per-request memory budget
+memory_guard = MemoryGuard(
+    budget_bytes=int(float(os.environ.get('METRO_MEMORY_BUDGET_MB', '64')) * 1024 * 1024),
+    oversize=os.environ.get('METRO_MEMORY_OVERSIZE', 'stream'),
+    trace=os.environ.get('METRO_TRACEMALLOC', '').lower() in ('1', 'true', 'yes')
+)
+# Opt-in cProfile of single requests (X-Profile-Token header or 1-in-N sampling); off without a token
+profiler = RequestProfiler(
+    token=os.environ.get('METRO_PROFILE_TOKEN') or None,
+    sample_rate=int(os.environ.get('METRO_PROFILE_SAMPLE', '0'))
+)
 
 def get_db_connection() -> sqlite3.Connection:
-    """Create and return a database connection."""
+    """Create and return a project.db connection (the replica when the request tolerates staleness)."""
     try:
+        if has_request_context() and g.get('max_staleness') is not None and \
+                replica.usable(g.max_staleness, client_last_write()):
+            return replica.connect()
         conn = sqlite3.connect(DB_PATH)
         conn.row_factory = sqlite3.Row
         return conn
@@ -48,6 +230,68 @@ def get_db_connection() -> sqlite3.Connection:
         logger.error(f"Database connection error: {e}")
         raise
 
+def client_last_write() -> float:
+    """Epoch time of the calling client's last successful write, from its header or cookie (0 if none)."""
+    written_at = 0.0
+    for value in (request.headers.get(LAST_WRITE_HEADER), request.cookies.get(LAST_WRITE_COOKIE)):
+        try:
+            written_at = max(written_at, float(value or 0))
+        except ValueError:
+            continue
+    return written_at
+
+def tolerates_staleness(max_seconds: float):
+    """Mark a read-only endpoint as allowed to read from the replica if it is fresh enough."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.max_staleness = max_seconds
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def idempotent(view):
+    """Replay the stored response when a create request repeats its Idempotency-Key."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": "Idempotency-Key is too long"}), 400
+
+        route = request.path
+        request_fingerprint = fingerprint(request.get_data())
+        try:
+            stored = idempotency_store.begin(route, key, request_fingerprint)
+        except KeyInFlight as e:
+            return jsonify({"error": str(e)}), 409
+        except KeyConflict as e:
+            return jsonify({"error": str(e)}), 422
+        if stored is not None:
+            response = make_response(stored[1], stored[0])
+            response.mimetype = 'application/json'
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.abandon(route, key)
+            raise
+        if response.status_code >= 500:
+            # Server errors are not final; let the client retry with the same key
+            idempotency_store.abandon(route, key)
+        else:
+            try:
+                idempotency_store.complete(route, key, request_fingerprint,
+                                           response.status_code, response.get_data())
+            except sqlite3.Error as e:
+                idempotency_store.abandon(route, key)
+                logger.error(f"Error storing idempotent response: {e}")
+        return response
+    return wrapper
+
 def execute_query(query: str, params: tuple = (), fetch_one: bool = False) -> Union[Dict, List[Dict], int, None]:
     """Execute a database query and return the results."""
     conn = None
@@ -74,30 +318,209 @@ def execute_query(query: str, params: tuple = (), fetch_one: bool = False) -> Un
         if conn:
             conn.close()
 
+@app.before_request
+def start_profiling():
+    """Profile the request when it carries the profile token or is sampled."""
+    header = request.headers.get(PROFILE_HEADER)
+    if request.path.startswith('/debug/') or not profiler.should_profile(header):
+        return
+    g.profile = profiler.start()
+    g.profile_sampled = not profiler.authorized(header)
+
+@app.after_request
+def finish_profiling(response):
+    """Merge the request's profile into its route; registered first so it runs after the other hooks."""
+    profile = g.pop('profile', None)
+    if profile:
+        route = request.url_rule.rule if request.url_rule else request.path
+        elapsed_ms = profiler.finish(route, *profile, sampled=g.profile_sampled)
+        response.headers['Server-Timing'] = f"app;dur={elapsed_ms:.2f}"
+    return response
+
+@app.teardown_request
+def discard_profile(exc):
+    """Stop a profiler left running by an unhandled exception."""
+    profile = g.pop('profile', None)
+    if profile:
+        profile[0].disable()
+
+@app.before_request
+def count_request():
+    """Feed the maintenance scheduler's quiet-period check."""
+    maintenance.record_request()
+
+@app.before_request
+def start_memory_trace():
+    """Reset the tracemalloc peak when memory tracing is enabled."""
+    g.memory_baseline = memory_guard.trace_start()
+
+@app.after_request
+def finish_memory_trace(response):
+    """Record the request's tracemalloc high-water mark under its route."""
+    baseline = g.pop('memory_baseline', None)
+    if baseline is not None:
+        route = request.url_rule.rule if request.url_rule else request.path
+        if response.is_streamed:
+            # The body is generated after this hook; record once it has been sent
+            response.call_on_close(lambda: memory_guard.trace_finish(route, baseline))
+        else:
+            memory_guard.trace_finish(route, baseline)
+    return response
+
+@app.after_request
+def note_write(response):
+    """Tell the client when it last wrote, so its own reads skip replica snapshots older than that."""
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        written_at = f"{time.time():.3f}"
+        response.headers[LAST_WRITE_HEADER] = written_at
+        response.set_cookie(LAST_WRITE_COOKIE, written_at, httponly=True, samesite='Lax')
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Gzip-encode the response when the client accepts it and it is large enough."""
+    route = request.url_rule.rule if request.url_rule else request.path
+    return compressor.compress_response(response, request.accept_encodings, route)
+
+def merged_rows(rows: List[Dict], requested: List[str], merge_fields: Sequence[str]) -> List[Dict]:
+    """Drop the merge fields from merged rows when the client did not ask for them."""
+    dropped = [field for field in merge_fields if field not in requested]
+    if dropped:
+        for row in rows:
+            for field in dropped:
+                row.pop(field, None)
+    return rows
+
+def stream_rows(query: str, params: tuple) -> Response:
+    """Stream a query's rows as a JSON array, STREAM_BATCH_ROWS rows per chunk, without materializing them."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(query, params)
+    except sqlite3.Error:
+        conn.close()
+        raise
+
+    def generate():
+        try:
+            yield '['
+            separator = ''
+            while True:
+                batch = cursor.fetchmany(STREAM_BATCH_ROWS)
+                if not batch:
+                    break
+                yield separator + ','.join(json.dumps(dict(row), default=str, sort_keys=True) for row in batch)
+                separator = ','
+            yield ']'
+        finally:
+            conn.close()
+
+    return Response(generate(), mimetype='application/json', headers={'X-Result-Streamed': 'true'})
+
+def page_response(rows: List[Dict], compiled: Dict[str, Any], args: Dict[str, str], row_limit: int,
+                  streamable: Optional[tuple] = None):
+    """
+    Answer with rows fetched with at most one row past the budget's row limit
+    :param rows: fetched rows, limited to the client's limit or row_limit + 1
+    :param compiled: compiled list query (limit and offset)
+    :param args: request query parameters
+    :param row_limit: rows that fit in the memory budget
+    :param streamable: (query, params) to stream when the result overflows, if it can be streamed
+    """
+    route = request.url_rule.rule if request.url_rule else request.path
+    limit, offset = compiled['limit'], compiled['offset']
+    if (limit is None or limit > row_limit) and len(rows) > row_limit:
+        del rows[:]
+        if memory_guard.oversize == 'stream' and streamable:
+            memory_guard.record_oversize(route, 'streamed')
+            return stream_rows(*streamable)
+        memory_guard.record_oversize(route, 'rejected')
+        return jsonify(memory_guard.pagination_hint(request.path, args, row_limit, offset,
+                                                     streamable is not None)), 413
+
+    response = jsonify(rows)
+    if limit is not None and len(rows) == limit:
+        next_args = dict(args, offset=offset + limit)
+        response.headers['Link'] = f'<{request.path}?{urlencode(next_args)}>; rel="next"'
+    return response
+
+def list_response(list_query: ListQuery, time_field: Optional[str] = None, sharded: bool = False):
+    """
+    Answer a list endpoint from its filter, fields, count, paging and stream query parameters
+    :param list_query: endpoint description from list_filters
+    :param time_field: field that from/to filter on, when archived months may hold matching rows
+    :param sharded: the base table is card-scoped and lives in the shards when sharding is enabled
+    """
+    args = request.args.to_dict()
+    try:
+        compiled = list_query.compile(args)
+    except FilterError as e:
+        return jsonify({"error": str(e)}), 400
+    row_limit = memory_guard.row_limit(len(compiled['fields']))
+    # Never fetch more than one row past what the memory budget allows
+    fetch = min(compiled['limit'] or row_limit + 1, row_limit + 1)
+
+    if sharded and shard_store:
+        requested = compiled['fields']
+        compiled = list_query.compile(args, extra_fields=list_query.order_fields)
+        # Months archived out of the shards are read through the archive router and merged in
+        bounds = (args.get('from') or '0000', args.get('to') or '9999')
+        archived = list_query.compile(args, schema='{schema}', extra_fields=list_query.order_fields) \
+            if time_field and archive_router.partitions_for(*bounds) else None
+        if wants_count(args):
+            total = shard_store.count(compiled['count'], compiled['params'])
+            if archived:
+                total += archive_router.count(archived['count'], archived['params'], *bounds)
+            return jsonify({'total': total})
+        rows = shard_store.scatter(f"{compiled['select']}\nORDER BY {compiled['order_by']}", compiled['params'],
+                                   list_query.order_fields, list_query.descending, compiled['offset'] + fetch)
+        if archived:
+            archived_rows = archive_router.query(archived['select'], archived['params'], list_query.order_fields,
+                                                 *bounds, limit=compiled['offset'] + fetch)
+            key = lambda row: tuple(row[field] for field in list_query.order_fields)
+            rows = list(heapq.merge(rows, archived_rows, key=key, reverse=True))[:compiled['offset'] + fetch]
+        rows = merged_rows(rows[compiled['offset']:], requested, list_query.order_fields)
+        return page_response(rows, compiled, args, row_limit)
+
+    if time_field:
+        bounds = (args.get('from') or '0000', args.get('to') or '9999')
+        if archive_router.partitions_for(*bounds):
+            # Reads also cover the archived months the range overlaps (all of them
+            # without from/to); the order fields are selected so results can be merged
+            requested = compiled['fields']
+            compiled = list_query.compile(args, schema='{schema}', extra_fields=list_query.order_fields)
+            if wants_count(args):
+                return jsonify({'total': archive_router.count(compiled['count'], compiled['params'], *bounds)})
+            rows = archive_router.query(compiled['select'], compiled['params'], list_query.order_fields, *bounds,
+                                        limit=compiled['offset'] + fetch)
+            rows = merged_rows(rows[compiled['offset']:], requested, list_query.order_fields)
+            return page_response(rows, compiled, args, row_limit)
+
+    if wants_count(args):
+        return jsonify(execute_query(compiled['count'], tuple(compiled['params']), fetch_one=True))
+    query = f"{compiled['select']}\nORDER BY {compiled['order_by']}"
+    params = tuple(compiled['params'])
+    # LIMIT -1 is no limit in SQLite
+    streamed = (f"{query}\nLIMIT ? OFFSET ?", params + (compiled['limit'] or -1, compiled['offset']))
+    if wants_stream(args):
+        return stream_rows(*streamed)
+    rows = execute_query(f"{query}\nLIMIT ? OFFSET ?", params + (fetch, compiled['offset'])) or []
+    return page_response(rows, compiled, args, row_limit, streamable=streamed)
+
 # ==============================================================================
 # == Card Operations
 # ==============================================================================
 
 @app.route('/cards', methods=['GET'])
 def get_cards():
-    """Get all cards with passenger and card type details."""
+    """Get cards with passenger and card type details, filtered by cardId/passengerId/status/from/to."""
     try:
-        query = """
-            SELECT c.*, p.FirstName, p.LastName, p.Email, ct.TypeName, ct.BaseFareMultiplier
-            FROM Card c
-            LEFT JOIN Passenger p ON c.PassengerID = p.PassengerID
-            LEFT JOIN CardType ct ON c.CardTypeID = ct.CardTypeID
-            ORDER BY c.CardID
-        """
-        cards = execute_query(query)
-        if cards is None:
-            return jsonify([])
-        return jsonify(cards if isinstance(cards, list) else [cards])
+        return list_response(CARD_QUERY, sharded=True)
     except Exception as e:
         logger.error(f"Error fetching cards: {e}", exc_info=True)
         return jsonify({"error": f"Failed to fetch cards: {str(e)}"}), 500
 
 @app.route('/api/cards', methods=['POST'])
+@idempotent
 def create_card():
     """Create a new metro card."""
     try:
@@ -120,8 +543,40 @@ def create_card():
         INSERT INTO Card (CardNumber, Balance, IssueDate, Status, PassengerID, CardTypeID)
         VALUES (:CardNumber, :Balance, :IssueDate, :Status, :PassengerID, :CardTypeID)
         """
+        # The opening balance is written to the ledger with the card so its balance reconciles
+        opening = (card_data['Balance'], card_data['IssueDate'])
         
-        card_id = execute_query(query, tuple(card_data.values()))
+        if shard_store:
+            card_id = execute_query(query, tuple(card_data.values()))
+            # project.db allocated the CardID and checked the number; the card's shard holds the balance
+            try:
+                conn = shard_store.connect_for_card(card_id)
+                try:
+                    with conn:
+                        conn.execute("""
+                        INSERT INTO Card (CardID, CardNumber, Balance, IssueDate, Status, PassengerID, CardTypeID)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """, (card_id, *card_data.values()))
+                        conn.execute(ISSUE_INSERT, (*opening, card_id))
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                execute_query("DELETE FROM Card WHERE CardID = ?", (card_id,))
+                raise
+        else:
+            conn = sqlite3.connect(DB_PATH)
+            try:
+                with conn:
+                    card_id = conn.execute(query, tuple(card_data.values())).lastrowid
+                    conn.execute(ISSUE_INSERT, (*opening, card_id))
+            finally:
+                conn.close()
+        card_type = execute_query(
+            "SELECT BaseFareMultiplier FROM CardType WHERE CardTypeID = ?",
+            (card_data['CardTypeID'],), fetch_one=True
+        )
+        card_store.upsert(card_id, card_data['CardNumber'], card_data['Balance'], card_data['Status'],
+                          card_type['BaseFareMultiplier'] if card_type else 1.0)
         return jsonify({"id": card_id, "message": "Card created successfully"}), 201
         
     except ValueError as e:
@@ -134,27 +589,123 @@ def create_card():
         logger.error(f"Error creating card: {e}")
         return jsonify({"error": "Failed to create card"}), 500
 
+@app.route('/cards/<card_number>/state', methods=['GET'])
+def get_card_state(card_number: str):
+    """Get the hot balance/status state of a card from the in-memory store."""
+    state = card_store.get_by_number(card_number)
+    if state is None:
+        return jsonify({"error": "Card not found"}), 404
+    return jsonify(state)
+
+@app.route('/cards/<int:card_id>/history', methods=['GET'])
+def get_card_history(card_id: int):
+    """Get a card's trips and transactions as one newest-first timeline, paged with a cursor."""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        cursor = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+    try:
+        card = execute_query("SELECT CardID, CardNumber FROM Card WHERE CardID = ?", (card_id,), fetch_one=True)
+        if not card:
+            return jsonify({"error": "Card not found"}), 404
+        conn = shard_store.connect_for_card(card_id) if shard_store else get_db_connection()
+        try:
+            page = card_history.page(conn, card_id, cursor, limit)
+        finally:
+            conn.close()
+
+        station_ids = {item[field] for item in page['items'] if item['type'] == 'trip'
+                       for field in ('EntryStationID', 'ExitStationID') if item[field] is not None}
+        names = {}
+        if station_ids:
+            rows = execute_query(f"SELECT StationID, StationName FROM Station WHERE StationID IN "
+                                 f"({', '.join('?' * len(station_ids))})", tuple(station_ids)) or []
+            names = {row['StationID']: row['StationName'] for row in rows}
+        for item in page['items']:
+            if item['type'] == 'trip':
+                item['EntryStation'] = names.get(item['EntryStationID'])
+                item['ExitStation'] = names.get(item['ExitStationID'])
+        return jsonify({'cardId': card_id, 'cardNumber': card['CardNumber'], **page})
+    except Exception as e:
+        logger.error(f"Error fetching card history: {e}")
+        return jsonify({"error": "Failed to fetch card history"}), 500
+
+@app.route('/api/cards/<int:card_id>/top-up', methods=['POST'])
+@idempotent
+def top_up_card(card_id: int):
+    """Add credit to an active card and record a Top-up transaction."""
+    try:
+        data = request.get_json()
+        amount = round(float(data['amount']), 2)
+        if amount <= 0:
+            return jsonify({"error": "Amount must be positive"}), 400
+
+        conn = shard_store.connect_for_card(card_id) if shard_store else get_db_connection()
+        try:
+            with conn:
+                updated = conn.execute(
+                    "UPDATE Card SET Balance = Balance + ? WHERE CardID = ? AND Status = 'Active'", (amount, card_id)
+                ).rowcount
+                if updated:
+                    conn.execute("""
+                    INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID)
+                    VALUES ('Top-up', ?, ?, ?)
+                    """, (amount, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), card_id))
+                    balance = conn.execute("SELECT Balance FROM Card WHERE CardID = ?", (card_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        if not updated:
+            return jsonify({"error": "Active card not found"}), 404
+
+        try:
+            card_store.adjust_balance(card_id, amount)
+        except KeyError:
+            pass
+        return jsonify({"cardId": card_id, "balance": balance, "message": "Card topped up successfully"}), 200
+
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Invalid input: {e}")
+        return jsonify({"error": "Invalid input data"}), 400
+    except sqlite3.OperationalError as e:
+        logger.error(f"Error topping up card: {e}")
+        if 'locked' in str(e):
+            return jsonify({"error": "Database is busy, retry the top-up"}), 503
+        return jsonify({"error": "Failed to top up card"}), 500
+    except Exception as e:
+        logger.error(f"Error topping up card: {e}")
+        return jsonify({"error": "Failed to top up card"}), 500
+
 # ==============================================================================
 # == Passenger Operations
 # ==============================================================================
 
 @app.route('/passengers', methods=['GET'])
 def get_passengers():
-    """Get all passengers with their card count."""
+    """Get passengers with their card count and activity counters, filtered by passengerId/cardId/from/to."""
     try:
-        query = """
-        SELECT p.*, COUNT(c.CardID) as card_count
-        FROM Passenger p
-        LEFT JOIN Card c ON p.PassengerID = c.PassengerID
-        GROUP BY p.PassengerID
-        """
-        passengers = execute_query(query)
-        return jsonify(passengers or [])
+        return list_response(PASSENGER_QUERY)
     except Exception as e:
         logger.error(f"Error fetching passengers: {e}")
         return jsonify({"error": "Failed to fetch passengers"}), 500
 
+@app.route('/passengers/<int:passenger_id>/summary', methods=['GET'])
+def get_passenger_summary(passenger_id):
+    """Get a passenger's card count, trip count, lifetime spend, last trip and total balance."""
+    try:
+        summary = execute_query(SUMMARY_SELECT, (passenger_id,), fetch_one=True)
+        if not summary:
+            return jsonify({"error": "Passenger not found"}), 404
+        return jsonify(summary)
+    except Exception as e:
+        logger.error(f"Error fetching passenger summary: {e}")
+        return jsonify({"error": "Failed to fetch passenger summary"}), 500
+
 @app.route('/api/passengers', methods=['POST'])
+@idempotent
 def create_passenger():
     """Create a new passenger."""
     try:
@@ -178,6 +729,8 @@ def create_passenger():
         """
         
         passenger_id = execute_query(query, tuple(passenger_data.values()))
+        if shard_store:
+            shard_store.upsert_reference('Passenger', 'PassengerID', passenger_id, passenger_id)
         return jsonify({"id": passenger_id, "message": "Passenger created successfully"}), 201
         
     except sqlite3.IntegrityError as e:
@@ -187,34 +740,57 @@ def create_passenger():
         logger.error(f"Error creating passenger: {e}")
         return jsonify({"error": "Failed to create passenger"}), 500
 
+def on_cards_imported(created: List[tuple]) -> None:
+    """Add cards written by a bulk import to the in-memory card state."""
+    for card_id, card_number, balance, status, multiplier in created:
+        card_store.upsert(card_id, card_number, balance, status, multiplier)
+
+@app.route('/api/onboarding/import', methods=['POST'])
+def import_onboarding():
+    """Bulk import passengers with their cards from a streamed CSV or NDJSON body."""
+    fmt = request.args.get('format') or ('csv' if 'csv' in (request.mimetype or '') else 'ndjson')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        chunk_size = int(request.args.get('chunkSize', 1000))
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+    dry_run = request.args.get('dryRun', '').lower() in ('1', 'true', 'yes')
+
+    try:
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        # Imported passengers take IDs above the current highest, which is all the shards need copied
+        last_passenger_id = execute_query("SELECT COALESCE(MAX(PassengerID), 0) AS id FROM Passenger",
+                                          fetch_one=True)['id'] if shard_store else 0
+        importer = OnboardingImport(DB_PATH, max(1, chunk_size), dry_run, on_chunk=on_cards_imported)
+        report = importer.run(read_rows(stream, fmt))
+        if shard_store and report['imported'] and not dry_run:
+            shard_store.upsert_reference('Passenger', 'PassengerID', last_passenger_id + 1)
+            shard_store.migrate()
+        return jsonify(report), 200 if not report['failed'] else 207
+    except (UnicodeDecodeError, csv.Error) as e:
+        logger.error(f"Unreadable onboarding import: {e}")
+        return jsonify({"error": f"Unreadable import body: {e}"}), 400
+    except Exception as e:
+        logger.error(f"Error importing onboarding batch: {e}")
+        return jsonify({"error": "Failed to import onboarding batch"}), 500
+
 # ==============================================================================
 # == Trip Operations
 # ==============================================================================
 
 @app.route('/trips', methods=['GET'])
+@tolerates_staleness(60)
 def get_trips():
-    """Get all trips with related information."""
+    """Get trips with related information, filtered by cardId/passengerId/stationId/status/from/to."""
     try:
-        query = """
-        SELECT 
-            t.TripID, t.EntryTime, t.ExitTime, t.FareAmount,
-            c.CardNumber, p.PassengerID, p.FirstName, p.LastName,
-            es.StationID as EntryStationID, es.StationName as EntryStation,
-            xs.StationID as ExitStationID, xs.StationName as ExitStation
-        FROM Trip t
-        JOIN Card c ON t.CardID = c.CardID
-        JOIN Passenger p ON c.PassengerID = p.PassengerID
-        LEFT JOIN Station es ON t.EntryStationID = es.StationID
-        LEFT JOIN Station xs ON t.ExitStationID = xs.StationID
-        ORDER BY t.EntryTime DESC
-        """
-        trips = execute_query(query)
-        return jsonify(trips or [])
+        return list_response(TRIP_QUERY, time_field='EntryTime', sharded=True)
     except Exception as e:
         logger.error(f"Error fetching trips: {e}")
         return jsonify({"error": "Failed to fetch trips"}), 500
 
 @app.route('/trips', methods=['POST'])
+@idempotent
 def create_trip():
     """Create a new trip entry."""
     try:
@@ -224,34 +800,148 @@ def create_trip():
         if not all(field in data for field in required_fields):
             return jsonify({"error": "Missing required fields"}), 400
             
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         trip_data = {
-            'EntryTime': data.get('entryTime', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-            'ExitTime': data.get('exitTime'),
-            'FareAmount': float(data.get('fareAmount', 0.0)),
+            'EntryTime': data.get('entryTime', now),
+            # An exit tap closes the open trip at the time of the tap
+            'ExitTime': data.get('exitTime') or (now if data.get('exitStationId') else None),
+            # Left NULL when not supplied so the settlement job rates the trip
+            'FareAmount': float(data['fareAmount']) if data.get('fareAmount') is not None else None,
             'CardID': int(data['cardId']),
             'EntryStationID': int(data['entryStationId']),
             'ExitStationID': int(data['exitStationId']) if data.get('exitStationId') else None
         }
         
-        query = """
-        INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
-        VALUES (:EntryTime, :ExitTime, :FareAmount, :CardID, :EntryStationID, :ExitStationID)
-        """
+        # A trip posted without an exit is a gate entry tap; with one, an exit tap
+        direction = 'exit' if trip_data['ExitStationID'] else 'entry'
+        station_id = trip_data['ExitStationID'] or trip_data['EntryStationID']
+        conn = shard_store.connect_for_card(trip_data['CardID']) if shard_store else get_db_connection()
+        try:
+            decision, existing_trip_id = tap_filter.admit(conn, trip_data['CardID'], station_id, direction)
+        finally:
+            conn.close()
+        if decision == DUPLICATE:
+            return jsonify({"id": existing_trip_id, "duplicate": True, "message": "Duplicate tap ignored"}), 200
+        if decision == PASSBACK:
+            return jsonify({
+                "error": "Card already has an open trip",
+                "openTripId": existing_trip_id if existing_trip_id != PENDING else None
+            }), 409
+
+        if tap_journal:
+            try:
+                seq = tap_journal.append(list(trip_data.values()))
+            except JournalFull as e:
+                seq = None
+                logger.warning(f"Tap journal unavailable, writing the trip directly: {e}")
+            except JournalTimeout as e:
+                # Already queued: the drainer applies it once flushed, so a direct write would apply it twice
+                seq = e.seq
+                logger.warning(f"Tap journal flush is slow: {e}")
+            if seq is not None:
+                # The TripID is filled in by on_taps_applied once the drainer writes the trip
+                tap_filter.confirm(trip_data['CardID'], station_id, direction, PENDING)
+                station_live.record_tap(station_id, direction, opened=trip_data['ExitTime'] is None)
+                return jsonify({"journalSeq": seq, "message": "Trip accepted"}), 202
         
-        trip_id = execute_query(query, tuple(trip_data.values()))
+        # Entries insert an open trip; exits close it in place (write_tap is shared with the drainer)
+        conn = shard_store.connect_for_card(trip_data['CardID']) if shard_store else sqlite3.connect(DB_PATH)
+        try:
+            with conn:
+                trip_id, closed = write_tap(conn, list(trip_data.values()))
+        except Exception:
+            tap_filter.release(trip_data['CardID'], station_id, direction)
+            raise
+        finally:
+            conn.close()
+        tap_filter.confirm(trip_data['CardID'], station_id, direction, trip_id)
+        station_live.record_tap(station_id, direction, opened=trip_data['ExitTime'] is None,
+                                closed_station=closed[0] if closed else None)
+        # A closing exit is checked against the entry as stored, not the one the gate sent
+        entry_station_id, entry_time = closed or (trip_data['EntryStationID'], trip_data['EntryTime'])
+        anomaly_detector.observe(trip_id, trip_data['CardID'], entry_time, trip_data['ExitTime'],
+                                 entry_station_id, trip_data['ExitStationID'],
+                                 unmatched_exit=direction == 'exit' and not closed)
         return jsonify({"id": trip_id, "message": "Trip recorded successfully"}), 201
         
     except ValueError as e:
         logger.error(f"Invalid input: {e}")
         return jsonify({"error": "Invalid input data"}), 400
+    except sqlite3.OperationalError as e:
+        logger.error(f"Error creating trip: {e}")
+        if 'locked' in str(e):
+            # Gates retry on 503; a lock timeout is not a failed tap
+            return jsonify({"error": "Database is busy, retry the tap"}), 503
+        return jsonify({"error": "Failed to record trip"}), 500
     except Exception as e:
         logger.error(f"Error creating trip: {e}")
         return jsonify({"error": "Failed to record trip"}), 500
 
+@app.route('/trips/open-counts', methods=['GET'])
+def get_open_trip_counts():
+    """Get the number of open trips per entry station, across the shards and the tap journal."""
+    try:
+        stations = execute_query("SELECT StationID, StationName FROM Station ORDER BY StationID") or []
+        counts = live_open_counts()
+        return jsonify({
+            'stations': [
+                {**station, 'OpenTrips': counts.get(station['StationID'], 0)} for station in stations
+            ],
+            'total': sum(counts.values()),
+            'sweeper': trip_sweeper.status()
+        })
+    except Exception as e:
+        logger.error(f"Error fetching open trip counts: {e}")
+        return jsonify({"error": "Failed to fetch open trip counts"}), 500
+
+@app.route('/trips/journal', methods=['GET'])
+def get_tap_journal_status():
+    """Report tap journal depth and drain lag."""
+    if not tap_journal:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **tap_journal.status()})
+
+@app.route('/trips/tap-stats', methods=['GET'])
+def get_tap_stats():
+    """Report duplicate-tap and anti-passback filter hit rates."""
+    return jsonify(tap_filter.stats())
+
+@app.route('/trips/alerts', methods=['GET'])
+def get_trip_alerts():
+    """Get trip anomaly alerts, filtered by cardId/tripId/stationId/type/from/to."""
+    try:
+        return list_response(ALERT_QUERY)
+    except Exception as e:
+        logger.error(f"Error fetching trip alerts: {e}")
+        return jsonify({"error": "Failed to fetch trip alerts"}), 500
+
+@app.route('/trips/alerts/status', methods=['GET'])
+def get_anomaly_detector_status():
+    """Report the anomaly detector's queue, card state cache and alert counts."""
+    return jsonify(anomaly_detector.status())
+
 # ==============================================================================
 # == Station Operations
 # ==============================================================================
 
+@app.route('/stations/live', methods=['GET'])
+def get_stations_live():
+    """Get open trips and entry/exit rates per station from the in-memory counters."""
+    return jsonify(station_live.snapshot())
+
+@app.route('/stations/live/stream', methods=['GET'])
+def stream_stations_live():
+    """Stream station counter snapshots as Server-Sent Events."""
+    try:
+        interval = max(0.2, float(request.args.get('interval', 1.0)))
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+    return Response(
+        station_live.stream(interval),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/stations', methods=['GET'])
 def get_stations():
     """Get all stations."""
@@ -262,6 +952,84 @@ def get_stations():
         logger.error(f"Error fetching stations: {e}")
         return jsonify({"error": "Failed to fetch stations"}), 500
 
+@app.route('/station-links', methods=['GET'])
+def get_station_links():
+    """Get all links between adjacent stations."""
+    try:
+        query = """
+        SELECT sl.*, s1.StationName as FromStationName, s2.StationName as ToStationName
+        FROM StationLink sl
+        JOIN Station s1 ON sl.FromStationID = s1.StationID
+        JOIN Station s2 ON sl.ToStationID = s2.StationID
+        ORDER BY sl.FromStationID, sl.ToStationID
+        """
+        links = execute_query(query)
+        return jsonify(links or [])
+    except Exception as e:
+        logger.error(f"Error fetching station links: {e}")
+        return jsonify({"error": "Failed to fetch station links"}), 500
+
+@app.route('/station-links', methods=['POST'])
+def create_station_link():
+    """Create or update the link between two adjacent stations."""
+    try:
+        data = request.get_json()
+        required_fields = ['fromStationId', 'toStationId', 'distanceKm']
+        
+        if not all(field in data for field in required_fields):
+            return jsonify({"error": "Missing required fields"}), 400
+        
+        from_id, to_id = int(data['fromStationId']), int(data['toStationId'])
+        distance = float(data['distanceKm'])
+        if from_id == to_id or distance <= 0:
+            return jsonify({"error": "Invalid input data"}), 400
+        
+        stations = execute_query("SELECT COUNT(*) as count FROM Station WHERE StationID IN (?, ?)",
+                                 (from_id, to_id), fetch_one=True)
+        if stations['count'] != 2:
+            return jsonify({"error": "One or both stations not found"}), 404
+        
+        # Links are undirected; store them with the lower StationID first
+        execute_query("""
+        INSERT OR REPLACE INTO StationLink (FromStationID, ToStationID, DistanceKm)
+        VALUES (?, ?, ?)
+        """, (min(from_id, to_id), max(from_id, to_id), distance))
+        if shard_store:
+            shard_store.replicate_reference(('StationLink',))
+        return jsonify({"message": "Station link saved successfully"}), 201
+        
+    except ValueError as e:
+        logger.error(f"Invalid input: {e}")
+        return jsonify({"error": "Invalid input data"}), 400
+    except Exception as e:
+        logger.error(f"Error creating station link: {e}")
+        return jsonify({"error": "Failed to save station link"}), 500
+
+@app.route('/route-plan', methods=['GET'])
+def plan_route():
+    """Plan the shortest route between two stations, with hop count and fare."""
+    try:
+        from_id = int(request.args['from'])
+        to_id = int(request.args['to'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Query parameters 'from' and 'to' must be station IDs"}), 400
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        station_graph.refresh(conn)
+    except Exception as e:
+        logger.error(f"Error refreshing station graph: {e}")
+        return jsonify({"error": "Failed to plan route"}), 500
+    finally:
+        if conn:
+            conn.close()
+    
+    route = station_graph.plan(from_id, to_id)
+    if route is None:
+        return jsonify({"error": "Station not found"}), 404
+    return jsonify(route)
+
 # ==============================================================================
 # == Card Type Operations
 # ==============================================================================
@@ -281,18 +1049,11 @@ def get_card_types():
 # ==============================================================================
 
 @app.route('/transactions', methods=['GET'])
+@tolerates_staleness(60)
 def get_transactions():
-    """Get all transactions with card and passenger details."""
+    """Get transactions with card and passenger details, filtered by cardId/passengerId/status/from/to."""
     try:
-        query = """
-        SELECT t.*, c.CardNumber, p.FirstName, p.LastName
-        FROM [Transaction] t
-        JOIN Card c ON t.CardID = c.CardID
-        JOIN Passenger p ON c.PassengerID = p.PassengerID
-        ORDER BY t.TransactionDate DESC
-        """
-        transactions = execute_query(query)
-        return jsonify(transactions or [])
+        return list_response(TRANSACTION_QUERY, time_field='TransactionDate', sharded=True)
     except Exception as e:
         logger.error(f"Error fetching transactions: {e}")
         return jsonify({"error": "Failed to fetch transactions"}), 500
@@ -321,6 +1082,132 @@ def get_fare_rules():
         logger.error(f"Error fetching fare rules: {e}")
         return jsonify({"error": "Failed to fetch fare rules"}), 500
 
+@app.route('/fare-windows', methods=['GET'])
+def get_fare_windows():
+    """Get the configured peak windows and holiday calendar."""
+    return jsonify(fare_resolver.config())
+
+@app.route('/fare-windows', methods=['PUT'])
+def update_fare_windows():
+    """Replace the peak windows (per weekday, Monday=0) and holiday calendar."""
+    conn = None
+    try:
+        data = request.get_json()
+        if not data or 'peakWindows' not in data:
+            return jsonify({"error": "Missing required fields"}), 400
+        
+        peak_windows = {
+            int(weekday): [(start, end) for start, end in windows]
+            for weekday, windows in data['peakWindows'].items()
+        }
+        if any(weekday not in range(7) for weekday in peak_windows):
+            return jsonify({"error": "Weekday must be between 0 (Monday) and 6 (Sunday)"}), 400
+        
+        conn = get_db_connection()
+        fare_resolver.save_config(conn, peak_windows, data.get('holidays', []))
+        return jsonify({"message": "Fare windows updated successfully", **fare_resolver.config()}), 200
+        
+    except (ValueError, TypeError) as e:
+        logger.error(f"Invalid fare window input: {e}")
+        return jsonify({"error": "Invalid input data"}), 400
+    except Exception as e:
+        logger.error(f"Error updating fare windows: {e}")
+        return jsonify({"error": "Failed to update fare windows"}), 500
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/fares/resolve', methods=['POST'])
+def resolve_fares():
+    """Resolve fare type and fare for a batch of trips in one call."""
+    conn = None
+    try:
+        data = request.get_json()
+        trips = data.get('trips') if data else None
+        if not isinstance(trips, list):
+            return jsonify({"error": "Missing required fields"}), 400
+        
+        card_type_ids = [trip.get('cardTypeId') for trip in trips]
+        if any(isinstance(card_type_id, (bool, float)) for card_type_id in card_type_ids):
+            raise ValueError("cardTypeId must be an integer")
+        card_type_ids = [int(card_type_id) if card_type_id is not None else None for card_type_id in card_type_ids]
+        
+        conn = get_db_connection()
+        fare_resolver.load_fares(conn)
+        multipliers = {
+            row['CardTypeID']: row['BaseFareMultiplier']
+            for row in conn.execute("SELECT CardTypeID, BaseFareMultiplier FROM CardType")
+        }
+        unknown = sorted({card_type_id for card_type_id in card_type_ids
+                          if card_type_id is not None and card_type_id not in multipliers})
+        if unknown:
+            return jsonify({"error": f"Unknown cardTypeId: {', '.join(map(str, unknown))}"}), 400
+        
+        results = fare_resolver.resolve(
+            [trip['entryTime'] for trip in trips],
+            [(int(trip['entryStationId']), int(trip['exitStationId'])) for trip in trips],
+            [multipliers[card_type_id] if card_type_id is not None else 1.0 for card_type_id in card_type_ids]
+        )
+        return jsonify(results), 200
+        
+    except (KeyError, ValueError, TypeError) as e:
+        logger.error(f"Invalid fare resolution input: {e}")
+        return jsonify({"error": "Invalid input data"}), 400
+    except Exception as e:
+        logger.error(f"Error resolving fares: {e}")
+        return jsonify({"error": "Failed to resolve fares"}), 500
+    finally:
+        if conn:
+            conn.close()
+
+# ==============================================================================
+# == Change Feed
+# ==============================================================================
+
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    """Long-poll for changes to trips, transactions, cards and fare rules after a sequence number."""
+    try:
+        since = int(request.args.get('since', 0))
+        timeout = min(float(request.args.get('timeout', 25)), 60.0)
+        limit = min(int(request.args.get('limit', 500)), 5000)
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+    if not change_feed:
+        return jsonify({"error": CHANGE_FEED_UNAVAILABLE}), 503
+    
+    try:
+        if timeout > 0:
+            result = change_feed.wait(since, timeout=timeout, limit=limit)
+        else:
+            result = change_feed.changes_since(since, limit=limit)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error fetching changes: {e}")
+        return jsonify({"error": "Failed to fetch changes"}), 500
+
+@app.route('/changes/stream', methods=['GET'])
+def stream_changes():
+    """Stream changes as Server-Sent Events, resuming from Last-Event-ID when reconnecting."""
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+    if not change_feed:
+        return jsonify({"error": CHANGE_FEED_UNAVAILABLE}), 503
+    return Response(
+        change_feed.stream(since),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/changes/status', methods=['GET'])
+def get_change_feed_status():
+    """Report change feed head, buffer size and subscriber count."""
+    if not change_feed:
+        return jsonify({'enabled': False, 'reason': CHANGE_FEED_UNAVAILABLE})
+    return jsonify({'enabled': True, **change_feed.status()})
+
 # ==============================================================================
 # == Health Check Endpoint
 # ==============================================================================
@@ -352,6 +1239,80 @@ def health_check():
             'error': str(e)
         }), 500
 
+@app.route('/health/deep', methods=['GET'])
+def deep_health_check():
+    """Report WAL size, checkpoint lag, page/freelist counts and last maintenance times."""
+    try:
+        report = maintenance.deep_health()
+        # A WAL well past the truncate threshold means checkpoints are not keeping up
+        degraded = report['wal_bytes'] > 2 * maintenance.truncate_wal_bytes
+        report['status'] = 'degraded' if degraded else 'healthy'
+        report['timestamp'] = datetime.now().isoformat()
+        return jsonify(report), 503 if degraded else 200
+    except Exception as e:
+        return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
+
+@app.route('/replica/status', methods=['GET'])
+def replica_status():
+    """Report read-replica freshness and refresh statistics."""
+    return jsonify(replica.status())
+
+@app.route('/idempotency/stats', methods=['GET'])
+def idempotency_stats():
+    """Report idempotent replays, conflicts and cached keys."""
+    return jsonify(idempotency_store.stats())
+
+@app.route('/compression/stats', methods=['GET'])
+def compression_stats():
+    """Report per-route compression ratio and CPU time."""
+    return jsonify(compressor.stats())
+
+@app.route('/memory/stats', methods=['GET'])
+def memory_stats():
+    """Report the list memory budget, oversize counts and per-route tracemalloc peaks."""
+    return jsonify(memory_guard.stats())
+
+@app.route('/debug/profiles', methods=['GET', 'DELETE'])
+def profile_reports():
+    """
+    Per-route request profiles, for holders of the profile token.
+    Without route: summary of profiled routes. With route: format=top (sort, limit),
+    collapsed (flamegraph stacks) or pstats (binary dump). DELETE clears them.
+    """
+    if not profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({"error": "Not found"}), 404
+    if request.method == 'DELETE':
+        profiler.reset()
+        return jsonify({"message": "Profiles cleared"})
+
+    route = request.args.get('route')
+    if not route:
+        return jsonify(profiler.summary())
+    output = request.args.get('format', 'top')
+    try:
+        if output == 'top':
+            return jsonify(profiler.top_functions(
+                route, request.args.get('sort', 'cumulative'), int(request.args.get('limit', '30'))
+            ))
+        if output == 'collapsed':
+            return Response(profiler.collapsed(route), mimetype='text/plain')
+        if output == 'pstats':
+            filename = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root'
+            return Response(profiler.dump(route), mimetype='application/octet-stream',
+                            headers={'Content-Disposition': f'attachment; filename="{filename}.prof"'})
+    except KeyError:
+        return jsonify({"error": f"No profiles recorded for route {route}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"error": "format must be one of top, collapsed, pstats"}), 400
+
+@app.route('/shards/status', methods=['GET'])
+def shards_status():
+    """Report the shard files when sharded storage is enabled."""
+    if not shard_store:
+        return jsonify({'shards': 0, 'files': []})
+    return jsonify(shard_store.status())
+
 # ==============================================================================
 # == Error Handlers
 # ==============================================================================
@@ -382,6 +1343,30 @@ def list_routes():
         })
     return jsonify(routes)
 
+def warm_card_store(conn: sqlite3.Connection) -> None:
+    """
+    Load the card state snapshot (if any) and reconcile it against the Card table.
+    Under sharding the shards hold the authoritative balances, so their Card
+    tables are read instead of project.db's directory copy.
+    """
+    card_store.load_snapshot(CARD_STATE_PATH)
+    if not shard_store:
+        card_store.reconcile(conn)
+        return
+    shard_conns = [shard_store.connect(shard) for shard in range(SHARD_COUNT)]
+    try:
+        card_store.reconcile(*shard_conns)
+    finally:
+        for shard_conn in shard_conns:
+            shard_conn.close()
+
+def save_card_store() -> None:
+    """Persist the card state store so the next start can warm up from it."""
+    try:
+        card_store.save_snapshot(CARD_STATE_PATH)
+    except OSError as e:
+        logger.error(f"Error saving card state snapshot: {e}")
+
 def initialize_database():
     """Initialize the database and return the database file path."""
     try:
@@ -391,7 +1376,7 @@ def initialize_database():
         logger.info(f"Added to path: {project_root}")
         
         # Set the database file path
-        db_file = os.path.join(project_root, 'project.db')
+        db_file = DB_PATH
         logger.info(f"Database file path: {db_file}")
         
         # Import after adding to path
@@ -403,6 +1388,22 @@ def initialize_database():
             logger.info("Successfully connected to database")
             create_tables_if_not_exist(conn)
             insert_sample_data(conn)  # Insert sample data
+            idempotency_store.ensure_schema(conn)
+            fare_resolver.ensure_schema(conn)
+            fare_resolver.load_config(conn)
+            if change_feed:
+                change_feed.ensure_schema(conn)
+            else:
+                ChangeFeed.drop_triggers(conn)
+            ensure_graph_schema(conn)
+            ensure_passenger_summary(conn, db_file)
+            ensure_alert_schema(conn)
+            if shard_store:
+                shard_store.ensure_schema()
+                shard_store.replicate_reference()
+                shard_store.migrate()
+            # After the migration, so shard balances are what the store starts from
+            warm_card_store(conn)
             conn.close()
             logger.info("Database initialization completed")
             return db_file
@@ -410,8 +1411,51 @@ def initialize_database():
         logger.error(f"Error initializing database: {e}", exc_info=True)
     return None
 
+# Run with the debug reloader, `python app.py` executes this module twice: in a watcher
+# process that only restarts the server, and in the child that serves requests
+# (WERKZEUG_RUN_MAIN=true). Background jobs and the card snapshot belong to the latter;
+# a second copy would race the first on the tap journal and shared state files.
+DEBUG = True
+serving_process = __name__ != '__main__' or not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
 # Initialize the database before starting the app
 db_file = initialize_database()
+if serving_process:
+    atexit.register(save_card_store)
+    memory_guard.start()
+if db_file and serving_process:
+    try:
+        maintenance.start()
+    except sqlite3.Error as e:
+        logger.error(f"Database maintenance disabled: {e}")
+    try:
+        idempotency_store.purge_expired()
+    except sqlite3.Error as e:
+        logger.error(f"Error purging idempotency keys: {e}")
+    try:
+        replica.refresh()
+        replica.start()
+    except Exception as e:
+        logger.error(f"Read replica disabled: {e}")
+    trip_sweeper.start()
+    if change_feed:
+        change_feed.start()
+    else:
+        logger.warning(f"Change feed disabled: {CHANGE_FEED_UNAVAILABLE}")
+    if tap_journal:
+        try:
+            tap_journal.start()
+            atexit.register(tap_journal.stop)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.error(f"Tap journal disabled: {e}")
+            tap_journal = None
+    try:
+        station_live.start()
+        atexit.register(station_live.stop)
+    except sqlite3.Error as e:
+        logger.error(f"Station live counters disabled: {e}")
+    anomaly_detector.start()
+    atexit.register(anomaly_detector.stop)
 
 # Print all registered routes when the app starts
 with app.app_context():
@@ -423,4 +1467,5 @@ with app.app_context():
 if __name__ == '__main__':
     # Start the Flask application
     logger.info("Starting Flask application...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # tracemalloc peaks are process-wide: trace one request at a time or the figures mix
+    app.run(host='0.0.0.0', port=5000, debug=DEBUG, threaded=not memory_guard.trace)
@@ -0,0 +1,369 @@
+import sqlite3
+import os
+import re
+import shutil
+import glob
+import heapq
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+DEFAULT_ARCHIVE_DIR = os.path.join(BASE_DIR, '..', 'archive')
+
+ARCHIVE_FILE_PATTERN = re.compile(r'^metro_(\d{4})_(\d{2})\.db$')
+# SQLite's default SQLITE_MAX_ATTACHED; larger ranges are queried in groups
+MAX_ATTACHED = 10
+ARCHIVE_MMAP_SIZE = 256 * 1024 * 1024
+# Suffix of the copy a month is built in before it replaces the published (immutable) file
+WORKING_SUFFIX = '.building'
+
+ARCHIVE_TABLES = {
+    'Trip': """
+    CREATE TABLE IF NOT EXISTS {schema}.Trip (
+        TripID INTEGER PRIMARY KEY,
+        EntryTime TEXT NOT NULL,
+        ExitTime TEXT,
+        FareAmount REAL,
+        CardID INTEGER NOT NULL,
+        EntryStationID INTEGER NOT NULL,
+        ExitStationID INTEGER
+    )""",
+
+    'Transaction': """
+    CREATE TABLE IF NOT EXISTS {schema}.[Transaction] (
+        TransactionID INTEGER PRIMARY KEY,
+        TransactionType TEXT NOT NULL,
+        Amount REAL NOT NULL,
+        TransactionDate TEXT NOT NULL,
+        CardID INTEGER
+    )"""
+}
+
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_trip_entry_time ON Trip (EntryTime)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_trip_card ON Trip (CardID, EntryTime)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_transaction_card ON [Transaction] (CardID, TransactionDate)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_transaction_date ON [Transaction] (TransactionDate)"
+]
+
+def month_start(year: int, month: int) -> str:
+    """Return the first timestamp of a month in the database's text format."""
+    return f"{year:04d}-{month:02d}-01 00:00:00"
+
+
+def next_month(year: int, month: int) -> Tuple[int, int]:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def archive_path(archive_dir: str, year: int, month: int) -> str:
+    return os.path.join(archive_dir, f"metro_{year:04d}_{month:02d}.db")
+
+
+def list_partitions(archive_dir: str = DEFAULT_ARCHIVE_DIR) -> List[Tuple[int, int]]:
+    """Return the (year, month) of every archive file, oldest first."""
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for name in os.listdir(archive_dir):
+        match = ARCHIVE_FILE_PATTERN.match(name)
+        if match:
+            months.append((int(match.group(1)), int(match.group(2))))
+    return sorted(months)
+
+
+def working_path(path: str) -> str:
+    """Where a month's archive is built before it replaces the published file."""
+    return path + WORKING_SUFFIX
+
+
+def _working_copy(path: str) -> str:
+    """Start (or resume) the working copy of a month's archive from the published file, if any."""
+    work = working_path(path)
+    if not os.path.exists(work) and os.path.exists(path):
+        shutil.copyfile(path, work)
+        os.chmod(work, 0o644)
+    return work
+
+
+def _copy_month(db_path: str, work: str, start: str, end: str) -> Dict[str, int]:
+    """Copy one month of closed trips and its transactions into a working archive; the hot rows stay."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS arc", (work,))
+        try:
+            with conn:
+                for create_sql in ARCHIVE_TABLES.values():
+                    conn.execute(create_sql.format(schema='arc'))
+                # Open trips stay in the hot database until they are closed. REPLACE picks up
+                # rows changed since a run that copied them but could not release them
+                trips = conn.execute("""
+                    INSERT OR REPLACE INTO arc.Trip
+                    SELECT TripID, EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID
+                    FROM main.Trip
+                    WHERE EntryTime >= ? AND EntryTime < ? AND ExitTime IS NOT NULL
+                """, (start, end)).rowcount
+                transactions = conn.execute("""
+                    INSERT OR REPLACE INTO arc.[Transaction]
+                    SELECT TransactionID, TransactionType, Amount, TransactionDate, CardID
+                    FROM main.[Transaction]
+                    WHERE TransactionDate >= ? AND TransactionDate < ?
+                """, (start, end)).rowcount
+        finally:
+            conn.execute("DETACH DATABASE arc")
+    finally:
+        conn.close()
+    return {'trips': trips, 'transactions': transactions}
+
+
+def _release(db_path: str, archive_file: str, start: str, end: str, publish_as: Optional[str] = None) -> None:
+    """
+    Delete a database's hot rows for a month that an archive file holds unchanged
+    :param archive_file: sealed archive to check rows against
+    :param publish_as: move archive_file here first, under the same write lock, so
+                       nothing holding that lock sees the rows in both places or neither
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # Attached by inode: the handle follows the file through the rename
+        conn.execute("ATTACH DATABASE ? AS arc", (archive_file,))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if publish_as:
+                os.replace(archive_file, publish_as)
+            # A trip settled after it was copied differs from its archived row and stays for the next run
+            conn.execute("""
+                DELETE FROM main.Trip
+                WHERE EntryTime >= ? AND EntryTime < ? AND ExitTime IS NOT NULL AND EXISTS (
+                    SELECT 1 FROM arc.Trip a
+                    WHERE a.TripID = Trip.TripID AND a.ExitTime IS Trip.ExitTime
+                      AND a.FareAmount IS Trip.FareAmount AND a.ExitStationID IS Trip.ExitStationID
+                )
+            """, (start, end))
+            conn.execute("""
+                DELETE FROM main.[Transaction]
+                WHERE TransactionDate >= ? AND TransactionDate < ? AND EXISTS (
+                    SELECT 1 FROM arc.[Transaction] a
+                    WHERE a.TransactionID = [Transaction].TransactionID AND a.Amount = [Transaction].Amount
+                )
+            """, (start, end))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("DETACH DATABASE arc")
+    finally:
+        conn.close()
+
+
+def archive_month(db_path: str, year: int, month: int,
+                  archive_dir: str = DEFAULT_ARCHIVE_DIR) -> Dict[str, int]:
+    """
+    Move one month of closed trips and its transactions into a per-month archive.
+
+    A published archive is never written in place, since readers attach it
+    with immutable=1. The month is built in a working copy: the published
+    file's rows plus the hot rows. The copy is sealed and then renamed over
+    the published file, and the hot rows are deleted under the same write
+    lock on db_path.
+    :param db_path: hot database file
+    :param year: year of the month to archive
+    :param month: month to archive
+    :param archive_dir: directory holding the per-month archive files
+    :return: counts of archived trips and transactions
+    """
+    now = datetime.now()
+    if (year, month) >= (now.year, now.month):
+        raise ValueError(f"Month {year:04d}-{month:02d} is not closed yet")
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(archive_dir, year, month)
+    start, end = month_start(year, month), month_start(*next_month(year, month))
+    work = _working_copy(path)
+    counts = _copy_month(db_path, work, start, end)
+    seal_archive(work)
+    _release(db_path, work, start, end, publish_as=path)
+    logger.info(f"Archived {year:04d}-{month:02d} of {db_path}: "
+                f"{counts['trips']} trip(s), {counts['transactions']} transaction(s) -> {path}")
+    return counts
+
+
+def seal_archive(path: str) -> None:
+    """Index, compact and mark an archive file read-only."""
+    conn = sqlite3.connect(path)
+    try:
+        for create_sql in ARCHIVE_INDEXES:
+            conn.execute(create_sql.format(schema='main'))
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("ANALYZE")
+        conn.commit()
+        # A compact file with no WAL sidecar maps cleanly with mmap and immutable=1
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.chmod(path, 0o444)
+
+
+def archive_closed_months(db_path: str = DEFAULT_DB_PATH, keep_months: int = 3,
+                          archive_dir: str = DEFAULT_ARCHIVE_DIR,
+                          shard_paths: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """
+    Archive every month older than the most recent keep_months
+    :param db_path: hot database file
+    :param keep_months: number of recent months (including the current one) kept hot
+    :param archive_dir: directory holding the per-month archive files
+    :param shard_paths: card shards whose closed months go into the same per-month
+                        archives (shards number their rows from disjoint ID blocks)
+    :return: per-month archive results, one per database and month
+    """
+    now = datetime.now()
+    cutoff_year, cutoff_month = now.year, now.month
+    for _ in range(max(keep_months, 1) - 1):
+        cutoff_year, cutoff_month = (cutoff_year - 1, 12) if cutoff_month == 1 else (cutoff_year, cutoff_month - 1)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    results = []
+    archived: Dict[Tuple[int, int], List[str]] = {}
+    for path in [db_path, *shard_paths]:
+        conn = sqlite3.connect(path)
+        try:
+            # Both scans are covered by the EntryTime / TransactionDate indexes
+            months = conn.execute("""
+                SELECT DISTINCT substr(EntryTime, 1, 7) FROM Trip
+                WHERE ExitTime IS NOT NULL AND EntryTime < ?
+                UNION
+                SELECT DISTINCT substr(TransactionDate, 1, 7) FROM [Transaction]
+                WHERE TransactionDate < ?
+            """, (month_start(cutoff_year, cutoff_month),) * 2).fetchall()
+        finally:
+            conn.close()
+
+        for (label,) in sorted(months):
+            year, month = int(label[:4]), int(label[5:7])
+            work = _working_copy(archive_path(archive_dir, year, month))
+            counts = _copy_month(path, work, month_start(year, month), month_start(*next_month(year, month)))
+            archived.setdefault((year, month), []).append(path)
+            results.append({'database': path, 'month': label, **counts})
+
+    # Each month is sealed and published once, after every database has added its rows
+    for (year, month), databases in sorted(archived.items()):
+        path = archive_path(archive_dir, year, month)
+        start, end = month_start(year, month), month_start(*next_month(year, month))
+        work = working_path(path)
+        seal_archive(work)
+        _release(db_path, work, start, end, publish_as=path)
+        for database in databases:
+            if database != db_path:
+                _release(database, path, start, end)
+        logger.info(f"Archived {year:04d}-{month:02d} of {len(databases)} database(s) -> {path}")
+    return results
+
+
+class PartitionRouter:
+    """
+    Routes time-range reads to the hot database and the archive partitions
+    they overlap, attaching archives read-only on demand.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, archive_dir: str = DEFAULT_ARCHIVE_DIR):
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+
+    def partitions_for(self, start: str, end: str) -> List[Tuple[int, int]]:
+        """Return the archived months overlapping [start, end)."""
+        return [
+            (year, month) for year, month in list_partitions(self.archive_dir)
+            if month_start(year, month) < end and month_start(*next_month(year, month)) > start
+        ]
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _query(self, select_sql: str, order_columns: Sequence[str], start: str, end: str,
+               params: Optional[Sequence[Any]] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Run select_sql against the hot tables and every overlapping partition
+        :param select_sql: SELECT with a {schema} placeholder for the partitioned table
+        :param order_columns: result columns to order by (newest first, the time column
+                              then a unique tiebreaker), or empty for no ordering
+        :param params: parameters for one branch; defaults to (start, end)
+        :param limit: return at most this many rows (each group is limited before the merge)
+        """
+        partitions = self.partitions_for(start, end)
+        branch_params = list(params) if params is not None else [start, end]
+        # Hot tables count as one branch; archives are attached in groups that
+        # fit under SQLite's attach limit and the group results merged in order
+        groups: List[List[Optional[Tuple[int, int]]]] = [[None]]
+        for partition in partitions:
+            if len(groups[-1]) >= MAX_ATTACHED:
+                groups.append([])
+            groups[-1].append(partition)
+
+        streams = []
+        conn = self._connect()
+        try:
+            for group in groups:
+                branches, query_params, attached = [], [], []
+                for partition in group:
+                    if partition is None:
+                        schema = 'main'
+                    else:
+                        schema = f"p_{partition[0]:04d}_{partition[1]:02d}"
+                        uri = f"file:{os.path.abspath(archive_path(self.archive_dir, *partition))}?mode=ro&immutable=1"
+                        conn.execute("ATTACH DATABASE ? AS " + schema, (uri,))
+                        conn.execute(f"PRAGMA {schema}.mmap_size = {ARCHIVE_MMAP_SIZE}")
+                        attached.append(schema)
+                    branches.append(select_sql.format(schema=schema))
+                    query_params.extend(branch_params)
+                try:
+                    query = "\nUNION ALL\n".join(branches)
+                    if order_columns:
+                        query += "\nORDER BY " + ', '.join(f"{column} DESC" for column in order_columns)
+                    if limit is not None:
+                        query += f"\nLIMIT {int(limit)}"
+                    streams.append([dict(row) for row in conn.execute(query, query_params).fetchall()])
+                finally:
+                    for schema in attached:
+                        conn.execute(f"DETACH DATABASE {schema}")
+        finally:
+            conn.close()
+
+        if len(streams) == 1:
+            return streams[0]
+        if not order_columns:
+            rows = [row for stream in streams for row in stream]
+        else:
+            rows = list(heapq.merge(*streams, key=lambda row: tuple(row[column] for column in order_columns),
+                                    reverse=True))
+        return rows if limit is None else rows[:limit]
+
+    def query(self, select_sql: str, params: Sequence[Any], order_columns: Sequence[str],
+              start: str, end: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Run a filtered SELECT over the hot database and the partitions overlapping [start, end)."""
+        return self._query(select_sql, order_columns, start, end, params, limit)
+
+    def count(self, count_sql: str, params: Sequence[Any], start: str, end: str) -> int:
+        """Sum a COUNT(*) AS total query over the hot database and the overlapping partitions."""
+        return sum(row['total'] for row in self._query(count_sql, (), start, end, params))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Archive closed months of trips and transactions')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the hot SQLite database')
+    parser.add_argument('--archive-dir', default=DEFAULT_ARCHIVE_DIR, help='directory for per-month archives')
+    parser.add_argument('--keep-months', type=int, default=3, help='recent months to keep in the hot database')
+    parser.add_argument('--shard-dir', default=None,
+                        help='also archive the card shards in this directory (required when sharding is on)')
+    args = parser.parse_args()
+
+    shard_files = sorted(glob.glob(os.path.join(args.shard_dir, 'metro_shard_*.db'))) if args.shard_dir else []
+    for result in archive_closed_months(args.db, args.keep_months, args.archive_dir, shard_files):
+        print(f"{result['database']} {result['month']}: {result['trips']} trip(s), "
+              f"{result['transactions']} transaction(s)")
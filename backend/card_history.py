@@ -0,0 +1,133 @@
+import sqlite3
+import os
+import json
+import heapq
+import base64
+import logging
+from typing import Dict, List, Optional, Any, Tuple
+
+from archive import DEFAULT_ARCHIVE_DIR, list_partitions, archive_path, month_start, next_month
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_ID = 2 ** 63 - 1
+
+# Timeline order is newest first on (time, rank, id); at the same time a trip
+# precedes the transaction it caused
+TRIP_RANK, TRANSACTION_RANK = 1, 0
+
+# Keyset page of one card's rows: the (CardID, time) index with its implicit
+# trailing rowid resolves the filter and the order, so only the rows returned
+# are read from the table. Parameters: card, cursor time (twice), id bound, limit
+STREAMS = {
+    'trip': (TRIP_RANK, """
+        SELECT TripID AS id, EntryTime AS time, ExitTime, FareAmount, EntryStationID, ExitStationID
+        FROM {schema}.Trip
+        WHERE CardID = ? AND EntryTime <= ? AND (EntryTime < ? OR TripID < ?)
+        ORDER BY EntryTime DESC, TripID DESC
+        LIMIT ?
+    """),
+    'transaction': (TRANSACTION_RANK, """
+        SELECT TransactionID AS id, TransactionDate AS time, TransactionType, Amount
+        FROM {schema}.[Transaction]
+        WHERE CardID = ? AND TransactionDate <= ? AND (TransactionDate < ? OR TransactionID < ?)
+        ORDER BY TransactionDate DESC, TransactionID DESC
+        LIMIT ?
+    """)
+}
+
+# Cursor position: (time, rank, id) of the last item returned
+Cursor = Tuple[str, int, int]
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Cursor:
+    """Parse a cursor from a previous page; raises ValueError when it is malformed."""
+    try:
+        time_value, rank, item_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(time_value, str) or rank not in (TRIP_RANK, TRANSACTION_RANK) or not isinstance(item_id, int):
+        raise ValueError("Invalid cursor")
+    return time_value, rank, item_id
+
+
+def _sort_key(item: Dict[str, Any]) -> Cursor:
+    return item['time'] or '', item['rank'], item['id']
+
+
+class CardHistory:
+    """
+    One card's trips and transactions as a single newest-first timeline.
+
+    Each stream is read with keyset pagination from the hot database (or the
+    card's shard) and, once the hot rows run out or get older than a month,
+    from the per-month archives, newest month first. The two sorted streams
+    are then merged, so a page costs two index range scans of page-size rows
+    per source touched, however long the card's history is.
+    """
+
+    def __init__(self, archive_dir: str = DEFAULT_ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+
+    def _read(self, conn: sqlite3.Connection, schema: str, stream: str, card_id: int,
+              cursor: Optional[Cursor], limit: int) -> List[Dict[str, Any]]:
+        rank, query = STREAMS[stream]
+        if cursor is None:
+            bound_time, bound_id = '9999', MAX_ID
+        else:
+            bound_time, cursor_rank, cursor_id = cursor
+            # Equal-time rows come after the cursor only if they sort lower: by id
+            # within the cursor's own stream, all or none of the other stream
+            bound_id = cursor_id if cursor_rank == rank else (MAX_ID if rank < cursor_rank else 0)
+        rows = conn.execute(query.format(schema=schema), (card_id, bound_time, bound_time, bound_id, limit))
+        return [dict(zip([column[0] for column in rows.description], row), rank=rank, type=stream) for row in rows]
+
+    def _stream(self, conn: sqlite3.Connection, stream: str, card_id: int, cursor: Optional[Cursor],
+                limit: int) -> List[Dict[str, Any]]:
+        """The next limit items of one stream across the hot database and the archives."""
+        items = self._read(conn, 'main', stream, card_id, cursor, limit)
+        upper = cursor[0] if cursor else '9999'
+        for year, month in reversed(list_partitions(self.archive_dir)):
+            if month_start(year, month) > upper:
+                continue
+            # An archive month older than the last candidate cannot contribute to this page
+            if len(items) >= limit and month_start(*next_month(year, month)) <= items[limit - 1]['time']:
+                break
+            schema = f"h_{year:04d}_{month:02d}"
+            uri = f"file:{os.path.abspath(archive_path(self.archive_dir, year, month))}?mode=ro&immutable=1"
+            conn.execute("ATTACH DATABASE ? AS " + schema, (uri,))
+            try:
+                items += self._read(conn, schema, stream, card_id, cursor, limit)
+            finally:
+                conn.execute(f"DETACH DATABASE {schema}")
+            items.sort(key=_sort_key, reverse=True)
+            del items[limit:]
+        return items
+
+    def page(self, conn: sqlite3.Connection, card_id: int, cursor: Optional[Cursor] = None,
+             limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        """
+        Read one page of a card's timeline
+        :param conn: connection to the database (or shard) holding the card's hot rows
+        :param card_id: card to read
+        :param cursor: position after which to continue, from decode_cursor()
+        :param limit: items per page
+        :return: {'items', 'nextCursor'}; nextCursor is None on the last page
+        """
+        # One extra row per stream tells whether anything follows the page
+        trips = self._stream(conn, 'trip', card_id, cursor, limit + 1)
+        transactions = self._stream(conn, 'transaction', card_id, cursor, limit + 1)
+        merged = heapq.merge(trips, transactions, key=_sort_key, reverse=True)
+        items = [item for _, item in zip(range(limit + 1), merged)]
+        has_more = len(items) > limit
+        items = items[:limit]
+        next_cursor = encode_cursor(_sort_key(items[-1])) if has_more else None
+        for item in items:
+            del item['rank']
+        return {'items': items, 'nextCursor': next_cursor}
@@ -0,0 +1,248 @@
+import sqlite3
+import os
+import struct
+import logging
+import threading
+from array import array
+from typing import Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Status codes stored in the status array; -1 marks an unused CardID slot
+STATUS_CODES = {'Active': 0, 'Inactive': 1, 'Blocked': 2}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+EMPTY_SLOT = -1
+
+# Snapshot layout: header, balance doubles, status bytes, multiplier floats,
+# then (CardID, length, CardNumber) records for the number -> index mapping
+SNAPSHOT_MAGIC = b'MSCARDS1'
+SNAPSHOT_HEADER = struct.Struct('<8sII')
+NUMBER_RECORD = struct.Struct('<IH')
+
+
+class CardStateStore:
+    """
+    Compact hot store of per-card state indexed by CardID.
+
+    Balance, status code and card-type multiplier live in typed arrays, 13
+    bytes per CardID slot. The CardNumber mapping is kept in both directions
+    as str/int dict entries and dominates: about 200 bytes per card in
+    CPython, against several times that for a row dict per card. All
+    mutations go through a single lock so updates are atomic.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._lock = threading.Lock()
+        self._balance = array('d', bytes(8 * capacity))
+        self._status = array('b', [EMPTY_SLOT]) * capacity
+        self._multiplier = array('f', bytes(4 * capacity))
+        self._number_to_id: Dict[str, int] = {}
+        self._id_to_number: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._number_to_id)
+
+    @property
+    def capacity(self) -> int:
+        return len(self._status)
+
+    def _grow(self, card_id: int) -> None:
+        """Extend the arrays so card_id is a valid slot (caller holds the lock)."""
+        new_capacity = self.capacity
+        while new_capacity <= card_id:
+            new_capacity *= 2
+        extra = new_capacity - self.capacity
+        self._balance.frombytes(bytes(8 * extra))
+        self._status.extend(array('b', [EMPTY_SLOT]) * extra)
+        self._multiplier.frombytes(bytes(4 * extra))
+
+    def _set(self, card_id: int, card_number: str, balance: float,
+             status: str, multiplier: float) -> None:
+        if card_id >= self.capacity:
+            self._grow(card_id)
+        previous = self._id_to_number.get(card_id)
+        if previous is not None and previous != card_number:
+            del self._number_to_id[previous]
+        self._balance[card_id] = balance
+        self._status[card_id] = STATUS_CODES.get(status, STATUS_CODES['Inactive'])
+        self._multiplier[card_id] = multiplier
+        self._number_to_id[card_number] = card_id
+        self._id_to_number[card_id] = card_number
+
+    # ==================== Reads ====================
+
+    def card_id_for(self, card_number: str) -> Optional[int]:
+        """Return the CardID for a card number, or None if unknown."""
+        return self._number_to_id.get(card_number)
+
+    def get(self, card_id: int) -> Optional[Dict[str, Any]]:
+        """Return the state of a card, or None if it is not in the store."""
+        if card_id < 0 or card_id >= self.capacity:
+            return None
+        with self._lock:
+            status = self._status[card_id]
+            if status == EMPTY_SLOT:
+                return None
+            return {
+                'CardID': card_id,
+                'CardNumber': self._id_to_number[card_id],
+                'Balance': self._balance[card_id],
+                'Status': STATUS_NAMES[status],
+                'BaseFareMultiplier': round(self._multiplier[card_id], 4)
+            }
+
+    def get_by_number(self, card_number: str) -> Optional[Dict[str, Any]]:
+        """Return the state of a card looked up by its card number."""
+        card_id = self.card_id_for(card_number)
+        return self.get(card_id) if card_id is not None else None
+
+    # ==================== Updates ====================
+
+    def upsert(self, card_id: int, card_number: str, balance: float,
+               status: str = 'Active', multiplier: float = 1.0) -> None:
+        """Insert or replace the full state of a card."""
+        with self._lock:
+            self._set(card_id, card_number, balance, status, multiplier)
+
+    def adjust_balance(self, card_id: int, delta: float) -> float:
+        """Atomically add delta to a card balance and return the new balance."""
+        with self._lock:
+            if card_id >= self.capacity or self._status[card_id] == EMPTY_SLOT:
+                raise KeyError(card_id)
+            self._balance[card_id] += delta
+            return self._balance[card_id]
+
+    def set_status(self, card_id: int, status: str) -> None:
+        """Atomically change the status of a card."""
+        if status not in STATUS_CODES:
+            raise ValueError(f"Unknown card status: {status}")
+        with self._lock:
+            if card_id >= self.capacity or self._status[card_id] == EMPTY_SLOT:
+                raise KeyError(card_id)
+            self._status[card_id] = STATUS_CODES[status]
+
+    def remove(self, card_id: int) -> None:
+        """Drop a card from the store."""
+        with self._lock:
+            card_number = self._id_to_number.pop(card_id, None)
+            if card_number is None:
+                return
+            del self._number_to_id[card_number]
+            self._status[card_id] = EMPTY_SLOT
+            self._balance[card_id] = 0.0
+            self._multiplier[card_id] = 0.0
+
+    # ==================== Persistence ====================
+
+    def save_snapshot(self, path: str) -> None:
+        """
+        Write the store to path atomically (write to a temp file, then rename)
+        :param path: snapshot file path
+        :return: None
+        """
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            numbers = b''.join(
+                NUMBER_RECORD.pack(card_id, len(encoded)) + encoded
+                for card_id, encoded in (
+                    (card_id, number.encode('utf-8'))
+                    for card_id, number in self._id_to_number.items()
+                )
+            )
+            with open(tmp_path, 'wb') as f:
+                f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.capacity, len(self._id_to_number)))
+                self._balance.tofile(f)
+                self._status.tofile(f)
+                self._multiplier.tofile(f)
+                f.write(numbers)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        logger.info(f"Saved card state snapshot with {len(self)} cards to {path}")
+
+    def load_snapshot(self, path: str) -> bool:
+        """
+        Load a snapshot written by save_snapshot.
+
+        The file is read in one call and checked against its header: a
+        truncated or padded snapshot is ignored, and the caller rebuilds the
+        store from the Card table with reconcile().
+        :param path: snapshot file path
+        :return: True if the snapshot was loaded
+        """
+        if not os.path.exists(path) or os.path.getsize(path) < SNAPSHOT_HEADER.size:
+            return False
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, capacity, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+            if magic != SNAPSHOT_MAGIC:
+                logger.warning(f"Ignoring card state snapshot with bad header: {path}")
+                return False
+            offset = SNAPSHOT_HEADER.size
+            if len(data) < offset + 13 * capacity + NUMBER_RECORD.size * count:
+                raise ValueError(f"{len(data)} bytes is too short for {capacity} slots and {count} cards")
+            balance = array('d')
+            balance.frombytes(data[offset:offset + 8 * capacity])
+            offset += 8 * capacity
+            status = array('b')
+            status.frombytes(data[offset:offset + capacity])
+            offset += capacity
+            multiplier = array('f')
+            multiplier.frombytes(data[offset:offset + 4 * capacity])
+            offset += 4 * capacity
+
+            id_to_number = {}
+            for _ in range(count):
+                card_id, length = NUMBER_RECORD.unpack_from(data, offset)
+                offset += NUMBER_RECORD.size
+                if card_id >= capacity or offset + length > len(data):
+                    raise ValueError(f"card record at offset {offset} is out of bounds")
+                id_to_number[card_id] = data[offset:offset + length].decode('utf-8')
+                offset += length
+            if offset != len(data) or len(id_to_number) != count:
+                raise ValueError(f"{count} card records end at byte {offset} of {len(data)}")
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Ignoring card state snapshot {path}: {e}")
+            return False
+
+        with self._lock:
+            self._balance, self._status, self._multiplier = balance, status, multiplier
+            self._id_to_number = id_to_number
+            self._number_to_id = {number: card_id for card_id, number in id_to_number.items()}
+        logger.info(f"Loaded card state snapshot with {count} cards from {path}")
+        return True
+
+    def reconcile(self, *conns: sqlite3.Connection) -> Tuple[int, int]:
+        """
+        Bring the store in line with the Card table
+        :param conns: Connection objects whose Card tables together hold every card
+                      (project.db, or each shard when sharding is on)
+        :return: (cards loaded, cards whose snapshot state was stale or missing)
+        """
+        loaded = corrected = 0
+        seen = set()
+        with self._lock:
+            for conn in conns:
+                cursor = conn.execute("""
+                    SELECT c.CardID, c.CardNumber, c.Balance, c.Status,
+                           COALESCE(ct.BaseFareMultiplier, 1.0)
+                    FROM Card c
+                    LEFT JOIN CardType ct ON c.CardTypeID = ct.CardTypeID
+                """)
+                for card_id, card_number, balance, status, multiplier in cursor:
+                    seen.add(card_id)
+                    loaded += 1
+                    if (card_id >= self.capacity
+                            or self._status[card_id] == EMPTY_SLOT
+                            or self._id_to_number.get(card_id) != card_number
+                            or self._balance[card_id] != balance
+                            or self._status[card_id] != STATUS_CODES.get(status)):
+                        corrected += 1
+                    self._set(card_id, card_number, balance, status, multiplier)
+            for card_id in [cid for cid in self._id_to_number if cid not in seen]:
+                corrected += 1
+                del self._number_to_id[self._id_to_number.pop(card_id)]
+                self._status[card_id] = EMPTY_SLOT
+        logger.info(f"Reconciled card state store: {loaded} cards, {corrected} corrected")
+        return loaded, corrected
@@ -0,0 +1,276 @@
+import sqlite3
+import json
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+CHANGE_LOG_TABLE = """
+CREATE TABLE IF NOT EXISTS ChangeLog (
+    Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    TableName TEXT NOT NULL,
+    Operation TEXT NOT NULL CHECK (Operation IN ('INSERT', 'UPDATE', 'DELETE')),
+    RowID INTEGER NOT NULL,
+    Data TEXT,
+    ChangedAt TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+)"""
+
+CHANGE_LOG_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_changelog_row ON ChangeLog (TableName, RowID, Seq)",
+    "CREATE INDEX IF NOT EXISTS idx_changelog_time ON ChangeLog (ChangedAt)"
+]
+
+# Tracked tables: (table name as logged, quoted SQL name, primary key, columns)
+TRACKED_TABLES = [
+    ('Trip', 'Trip', 'TripID',
+     ['TripID', 'EntryTime', 'ExitTime', 'FareAmount', 'CardID', 'EntryStationID', 'ExitStationID']),
+    ('Transaction', '[Transaction]', 'TransactionID',
+     ['TransactionID', 'TransactionType', 'Amount', 'TransactionDate', 'CardID']),
+    ('Card', 'Card', 'CardID',
+     ['CardID', 'CardNumber', 'Balance', 'IssueDate', 'Status', 'PassengerID', 'CardTypeID']),
+    ('FareRule', 'FareRule', 'FareRuleID',
+     ['FareRuleID', 'StartStationID', 'EndStationID', 'FareType', 'FareAmount'])
+]
+
+CHANGE_COLUMNS = "Seq, TableName, Operation, RowID, Data, ChangedAt"
+
+
+def _trigger_sql(table: str, sql_name: str, key: str, columns: List[str], operation: str) -> str:
+    row = 'OLD' if operation == 'DELETE' else 'NEW'
+    data = 'NULL' if operation == 'DELETE' else \
+        'json_object(' + ', '.join(f"'{column}', NEW.{column}" for column in columns) + ')'
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS trg_changelog_{table.lower()}_{operation.lower()}
+    AFTER {operation} ON {sql_name}
+    BEGIN
+        INSERT INTO ChangeLog (TableName, Operation, RowID, Data)
+        VALUES ('{table}', '{operation}', {row}.{key}, {data});
+    END"""
+
+
+def _row_to_change(row: tuple) -> Dict[str, Any]:
+    return {
+        'seq': row[0],
+        'table': row[1],
+        'op': row[2],
+        'id': row[3],
+        'data': json.loads(row[4]) if row[4] else None,
+        'at': row[5]
+    }
+
+
+class ChangeFeed:
+    """
+    Change-data-capture feed over the ChangeLog table.
+
+    A single poller thread tails ChangeLog and keeps the most recent
+    changes in a ring buffer; any number of long-poll or SSE subscribers
+    wait on one condition variable and read from that buffer, so the
+    database sees one query per poll interval regardless of subscriber count.
+
+    Capture triggers only exist in project.db. With sharded storage, trips,
+    transactions and balances are written to the shards, so the feed is not
+    run at all (see drop_triggers) rather than serve a partial stream.
+    """
+
+    def __init__(self, db_path: str, buffer_size: int = 10000, poll_interval: float = 0.5,
+                 retention_hours: float = 72.0, compact_after_hours: float = 1.0,
+                 maintenance_interval: float = 600.0):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.retention_hours = retention_hours
+        self.compact_after_hours = compact_after_hours
+        self.maintenance_interval = maintenance_interval
+
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._last_seq = 0
+        # Highest Seq removed by retention; clients behind it must resynchronise
+        self._expired_through = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.subscribers = 0
+
+    def ensure_schema(self, conn: sqlite3.Connection) -> None:
+        """Create ChangeLog and the capture triggers on the tracked tables."""
+        conn.execute(CHANGE_LOG_TABLE)
+        for create_sql in CHANGE_LOG_INDEXES:
+            conn.execute(create_sql)
+        for table, sql_name, key, columns in TRACKED_TABLES:
+            for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(_trigger_sql(table, sql_name, key, columns, operation))
+        conn.commit()
+
+    @staticmethod
+    def drop_triggers(conn: sqlite3.Connection) -> None:
+        """Remove the capture triggers, e.g. when sharding leaves the feed disabled and ChangeLog unpruned."""
+        for table, _, _, _ in TRACKED_TABLES:
+            for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(f"DROP TRIGGER IF EXISTS trg_changelog_{table.lower()}_{operation.lower()}")
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+
+    @property
+    def last_seq(self) -> int:
+        return self._last_seq
+
+    # ==================== Reads ====================
+
+    def _from_db(self, since: int, limit: int) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {CHANGE_COLUMNS} FROM ChangeLog WHERE Seq > ? ORDER BY Seq LIMIT ?", (since, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [_row_to_change(row) for row in rows]
+
+    def changes_since(self, since: int, limit: int = 500) -> Dict[str, Any]:
+        """
+        Return changes after since without waiting
+        :return: {'changes', 'lastSeq', 'reset'}; reset means changes the client
+                 has not seen were dropped by retention and it must refetch
+        """
+        with self._cond:
+            if since < self._expired_through:
+                return {'changes': [], 'lastSeq': self._last_seq, 'reset': True}
+            buffered = list(self._buffer) if self._buffer and self._buffer[0]['seq'] <= since + 1 else None
+        if buffered is not None:
+            changes = [change for change in buffered if change['seq'] > since][:limit]
+        else:
+            # Compaction only removes changes superseded by a newer one for the
+            # same row, so reading past the gaps still yields each row's latest state
+            changes = self._from_db(since, limit)
+        return {'changes': changes, 'lastSeq': changes[-1]['seq'] if changes else since, 'reset': False}
+
+    def wait(self, since: int, timeout: float = 25.0, limit: int = 500) -> Dict[str, Any]:
+        """Long-poll: block until there are changes after since, or timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.subscribers += 1
+            try:
+                while self._last_seq <= since and not self._stop.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            finally:
+                self.subscribers -= 1
+        return self.changes_since(since, limit)
+
+    def stream(self, since: int, heartbeat: float = 15.0) -> Iterator[str]:
+        """Yield Server-Sent Events for every change after since."""
+        yield "retry: 3000\n\n"
+        while not self._stop.is_set():
+            result = self.wait(since, timeout=heartbeat)
+            if result['reset']:
+                yield f"event: reset\ndata: {json.dumps({'lastSeq': result['lastSeq']})}\n\n"
+            for change in result['changes']:
+                yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+            if not result['changes'] and not result['reset']:
+                yield ": keep-alive\n\n"
+            since = result['lastSeq']
+
+    # ==================== Poller ====================
+
+    def poll_once(self, conn: sqlite3.Connection) -> int:
+        """Move new ChangeLog rows into the buffer and wake subscribers."""
+        rows = conn.execute(
+            f"SELECT {CHANGE_COLUMNS} FROM ChangeLog WHERE Seq > ? ORDER BY Seq LIMIT 5000", (self._last_seq,)
+        ).fetchall()
+        if not rows:
+            return 0
+        changes = [_row_to_change(row) for row in rows]
+        with self._cond:
+            self._buffer.extend(changes)
+            self._last_seq = changes[-1]['seq']
+            self._cond.notify_all()
+        return len(changes)
+
+    def compact(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        """
+        Drop changes past retention, and collapse older changes to the latest per row
+        :return: number of rows removed by each step
+        """
+        now = datetime.now()
+        retention_cutoff = (now - timedelta(hours=self.retention_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        compact_cutoff = (now - timedelta(hours=self.compact_after_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        expired_through = conn.execute(
+            "SELECT MAX(Seq) FROM ChangeLog WHERE ChangedAt < ?", (retention_cutoff,)
+        ).fetchone()[0]
+        with conn:
+            expired = conn.execute("DELETE FROM ChangeLog WHERE ChangedAt < ?", (retention_cutoff,)).rowcount
+            superseded = conn.execute("""
+                DELETE FROM ChangeLog
+                WHERE ChangedAt < ?
+                  AND EXISTS (
+                      SELECT 1 FROM ChangeLog newer
+                      WHERE newer.TableName = ChangeLog.TableName
+                        AND newer.RowID = ChangeLog.RowID
+                        AND newer.Seq > ChangeLog.Seq
+                  )
+            """, (compact_cutoff,)).rowcount
+        if expired_through is not None:
+            with self._cond:
+                self._expired_through = max(self._expired_through, expired_through)
+        if expired or superseded:
+            logger.info(f"Compacted change log: {expired} expired, {superseded} superseded")
+        return {'expired': expired, 'superseded': superseded}
+
+    def _run(self) -> None:
+        conn = self._connect()
+        next_maintenance = time.monotonic() + self.maintenance_interval
+        try:
+            # Start from the current head; older changes are served from the table.
+            # Anything below the oldest retained change may have expired before this start.
+            head, oldest = conn.execute("SELECT MAX(Seq), MIN(Seq) FROM ChangeLog").fetchone()
+            if head is None:
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ChangeLog'").fetchone()
+                head = row[0] if row else 0
+                oldest = head + 1
+            self._last_seq = head
+            self._expired_through = oldest - 1
+            while not self._stop.is_set():
+                try:
+                    self.poll_once(conn)
+                    if time.monotonic() >= next_maintenance:
+                        self.compact(conn)
+                        next_maintenance = time.monotonic() + self.maintenance_interval
+                except sqlite3.Error as e:
+                    logger.error(f"Error polling change log: {e}")
+                self._stop.wait(self.poll_interval)
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """Start the poller thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the poller thread and release waiting subscribers."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'lastSeq': self._last_seq,
+                'buffered': len(self._buffer),
+                'subscribers': self.subscribers,
+                'retentionHours': self.retention_hours
+            }
@@ -0,0 +1,165 @@
+import sqlite3
+import logging
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+PEAK = 'Peak'
+OFF_PEAK = 'Off-Peak'
+ANYTIME = 'Anytime'
+FARE_TYPES = (OFF_PEAK, PEAK)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Weekday peak windows (Monday=0 ... Sunday=6) as (start, end) "HH:MM" pairs
+DEFAULT_PEAK_WINDOWS = {
+    weekday: [('07:30', '10:00'), ('17:00', '19:30')] for weekday in range(5)
+}
+
+FARE_WINDOW_TABLES = {
+    'FarePeakWindow': """
+    CREATE TABLE IF NOT EXISTS FarePeakWindow (
+        Weekday INTEGER NOT NULL CHECK (Weekday BETWEEN 0 AND 6),
+        StartTime TEXT NOT NULL,
+        EndTime TEXT NOT NULL,
+        PRIMARY KEY (Weekday, StartTime)
+    )""",
+
+    'FareHoliday': """
+    CREATE TABLE IF NOT EXISTS FareHoliday (
+        HolidayDate TEXT PRIMARY KEY,
+        Description TEXT
+    )"""
+}
+
+
+def _minute_of_day(hhmm: str) -> int:
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class FareWindowResolver:
+    """
+    Maps trip entry times to fare types through a compiled minute-of-week table.
+
+    Peak windows per weekday are compiled once into a 10080-entry bytes
+    table (0 = Off-Peak, 1 = Peak); resolving a batch is then one table
+    lookup per timestamp with no per-trip branching. Holidays are
+    resolved as Off-Peak.
+    """
+
+    def __init__(self, peak_windows: Optional[Dict[int, Sequence[Tuple[str, str]]]] = None,
+                 holidays: Optional[Iterable[date]] = None):
+        self._lock = threading.Lock()
+        self._holidays: Set[str] = set()
+        self._table = bytes(MINUTES_PER_WEEK)
+        self._fares: Dict[Tuple[int, int], Dict[str, float]] = {}
+        self.configure(peak_windows if peak_windows is not None else DEFAULT_PEAK_WINDOWS, holidays or ())
+
+    def configure(self, peak_windows: Dict[int, Sequence[Tuple[str, str]]],
+                  holidays: Iterable[date] = ()) -> None:
+        """Compile peak windows and the holiday calendar into the lookup table."""
+        table = bytearray(MINUTES_PER_WEEK)
+        for weekday, windows in peak_windows.items():
+            if int(weekday) not in range(7):
+                raise ValueError(f"Weekday must be between 0 and 6, got {weekday}")
+            base = int(weekday) * MINUTES_PER_DAY
+            for start, end in windows:
+                start_minute, end_minute = _minute_of_day(start), _minute_of_day(end)
+                if end_minute <= start_minute:
+                    raise ValueError(f"Peak window {start}-{end} must end after it starts")
+                table[base + start_minute:base + end_minute] = b'\x01' * (end_minute - start_minute)
+        with self._lock:
+            self._table = bytes(table)
+            self._holidays = {d.isoformat() if isinstance(d, date) else str(d) for d in holidays}
+            self.peak_windows = {int(k): [tuple(w) for w in v] for k, v in peak_windows.items()}
+
+    def ensure_schema(self, conn: sqlite3.Connection) -> None:
+        for create_sql in FARE_WINDOW_TABLES.values():
+            conn.execute(create_sql)
+        conn.commit()
+
+    def load_config(self, conn: sqlite3.Connection) -> None:
+        """Compile the windows stored in FarePeakWindow/FareHoliday, keeping the defaults if none are stored."""
+        peak_windows: Dict[int, List[Tuple[str, str]]] = {}
+        for weekday, start, end in conn.execute(
+                "SELECT Weekday, StartTime, EndTime FROM FarePeakWindow ORDER BY Weekday, StartTime"):
+            peak_windows.setdefault(weekday, []).append((start, end))
+        holidays = [row[0] for row in conn.execute("SELECT HolidayDate FROM FareHoliday")]
+        self.configure(peak_windows or DEFAULT_PEAK_WINDOWS, holidays)
+
+    def save_config(self, conn: sqlite3.Connection, peak_windows: Dict[int, Sequence[Tuple[str, str]]],
+                    holidays: Iterable[str]) -> None:
+        """Validate, compile and persist a new set of peak windows and holidays."""
+        holidays = [date.fromisoformat(str(day)).isoformat() for day in holidays]
+        self.configure(peak_windows, holidays)
+        with conn:
+            conn.execute("DELETE FROM FarePeakWindow")
+            conn.execute("DELETE FROM FareHoliday")
+            conn.executemany(
+                "INSERT INTO FarePeakWindow (Weekday, StartTime, EndTime) VALUES (?, ?, ?)",
+                [(int(weekday), start, end) for weekday, windows in peak_windows.items() for start, end in windows]
+            )
+            conn.executemany("INSERT INTO FareHoliday (HolidayDate) VALUES (?)", [(day,) for day in holidays])
+
+    def load_fares(self, conn: sqlite3.Connection) -> None:
+        """Load FareRule amounts keyed by (start, end) and fare type."""
+        fares: Dict[Tuple[int, int], Dict[str, float]] = {}
+        for start, end, fare_type, amount in conn.execute(
+                "SELECT StartStationID, EndStationID, FareType, FareAmount FROM FareRule"):
+            fares.setdefault((start, end), {})[fare_type or ANYTIME] = amount
+        with self._lock:
+            self._fares = fares
+
+    def resolve_types(self, entry_times: Sequence[str]) -> List[str]:
+        """
+        Resolve fare types for a batch of entry timestamps
+        :param entry_times: 'YYYY-MM-DD HH:MM:SS' timestamps
+        :return: 'Peak' or 'Off-Peak' per timestamp
+        """
+        table, holidays = self._table, self._holidays
+        # Day offsets are computed once per distinct date in the batch; holidays
+        # are Off-Peak all day
+        day_offsets: Dict[str, Optional[int]] = {}
+        for day in {ts[:10] for ts in entry_times}:
+            day_offsets[day] = None if day in holidays else date.fromisoformat(day).weekday() * MINUTES_PER_DAY
+        codes = [
+            0 if day_offsets[ts[:10]] is None
+            else table[day_offsets[ts[:10]] + int(ts[11:13] or 0) * 60 + int(ts[14:16] or 0)]
+            for ts in entry_times
+        ]
+        return [FARE_TYPES[code] for code in codes]
+
+    def resolve(self, entry_times: Sequence[str],
+                station_pairs: Sequence[Tuple[int, Optional[int]]],
+                multipliers: Optional[Sequence[float]] = None) -> List[Dict[str, object]]:
+        """
+        Resolve fare type and fare for a batch of trips
+        :param entry_times: entry timestamp per trip
+        :param station_pairs: (EntryStationID, ExitStationID) per trip
+        :param multipliers: optional card-type multiplier per trip
+        :return: {'FareType', 'FareAmount'} per trip; FareAmount is None when no rule covers the pair
+        """
+        fare_types = self.resolve_types(entry_times)
+        fares = self._fares
+        multipliers = multipliers if multipliers is not None else [1.0] * len(fare_types)
+        results = []
+        for fare_type, pair, multiplier in zip(fare_types, station_pairs, multipliers):
+            # Fall back to the reverse direction, then from the time-specific fare to
+            # Anytime; a pair whose only rule is for the other fare type has no fare
+            rules = fares.get(pair) or fares.get((pair[1], pair[0])) or {}
+            amount = rules.get(fare_type, rules.get(ANYTIME))
+            results.append({
+                'FareType': fare_type,
+                'FareAmount': round(amount * multiplier, 2) if amount is not None else None
+            })
+        return results
+
+    def config(self) -> Dict[str, object]:
+        return {
+            'peakWindows': {str(k): [list(w) for w in v] for k, v in self.peak_windows.items()},
+            'holidays': sorted(self._holidays)
+        }
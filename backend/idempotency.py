@@ -0,0 +1,171 @@
+import sqlite3
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TABLE = """
+CREATE TABLE IF NOT EXISTS IdempotencyKey (
+    Route TEXT NOT NULL,
+    IdemKey TEXT NOT NULL,
+    Fingerprint BLOB NOT NULL,
+    StatusCode INTEGER NOT NULL,
+    Body BLOB NOT NULL,
+    CreatedAt REAL NOT NULL,
+    PRIMARY KEY (Route, IdemKey)
+) WITHOUT ROWID"""
+
+IDEMPOTENCY_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_idempotency_created
+ON IdempotencyKey (CreatedAt)"""
+
+# (status code, response body, request fingerprint)
+StoredResponse = Tuple[int, bytes, bytes]
+
+
+class KeyConflict(Exception):
+    """Raised when a key is reused for a different request."""
+
+
+class KeyInFlight(KeyConflict):
+    """Raised when a request with the same key has not finished yet."""
+
+
+def fingerprint(body: bytes) -> bytes:
+    """Short digest of a request body, used to detect key reuse with a different payload."""
+    return hashlib.sha256(body).digest()[:16]
+
+
+class IdempotencyStore:
+    """
+    Stores responses of create requests by (route, Idempotency-Key).
+
+    Recent keys are served from a bounded in-memory LRU; older ones from a
+    WITHOUT ROWID table holding zlib-compressed bodies. Entries expire
+    after ttl_seconds.
+    """
+
+    def __init__(self, db_path: str, capacity: int = 10000, ttl_seconds: float = 24 * 3600):
+        self.db_path = db_path
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[Tuple[str, str], Tuple[float, StoredResponse]]' = OrderedDict()
+        self._in_flight = set()
+        self._stats = {'replays': 0, 'cache_hits': 0, 'db_hits': 0, 'stored': 0, 'conflicts': 0}
+
+    def ensure_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(IDEMPOTENCY_TABLE)
+        conn.execute(IDEMPOTENCY_INDEX)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def begin(self, route: str, key: str, request_fingerprint: bytes) -> Optional[StoredResponse]:
+        """
+        Look up a key before running the request
+        :return: the stored response to replay, or None after reserving the key
+        :raises KeyConflict: if the key is in flight or was used for another payload
+        """
+        now = time.time()
+        cache_key = (route, key)
+        with self._lock:
+            if cache_key in self._in_flight:
+                self._stats['conflicts'] += 1
+                raise KeyInFlight("A request with this Idempotency-Key is still being processed")
+            cached = self._cache.get(cache_key)
+            if cached is not None and now - cached[0] <= self.ttl_seconds:
+                self._cache.move_to_end(cache_key)
+                self._stats['cache_hits'] += 1
+                stored = cached[1]
+            else:
+                stored = None
+                self._in_flight.add(cache_key)
+
+        if stored is None:
+            conn = self._connect()
+            try:
+                row = conn.execute("""
+                    SELECT StatusCode, Body, Fingerprint, CreatedAt FROM IdempotencyKey
+                    WHERE Route = ? AND IdemKey = ? AND CreatedAt > ?
+                """, (route, key, now - self.ttl_seconds)).fetchone()
+            except sqlite3.Error:
+                self.abandon(route, key)
+                raise
+            finally:
+                conn.close()
+            if row is None:
+                return None
+            stored = (row[0], zlib.decompress(row[1]), row[2])
+            with self._lock:
+                self._in_flight.discard(cache_key)
+                self._remember(cache_key, row[3], stored)
+                self._stats['db_hits'] += 1
+
+        if stored[2] != request_fingerprint:
+            with self._lock:
+                self._stats['conflicts'] += 1
+            raise KeyConflict("Idempotency-Key was already used for a different request")
+        with self._lock:
+            self._stats['replays'] += 1
+        return stored
+
+    def _remember(self, cache_key: Tuple[str, str], created_at: float, stored: StoredResponse) -> None:
+        """Insert into the LRU and trim it to capacity (caller holds the lock)."""
+        self._cache[cache_key] = (created_at, stored)
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def complete(self, route: str, key: str, request_fingerprint: bytes, status_code: int, body: bytes) -> None:
+        """Store the response of a reserved key."""
+        now = time.time()
+        stored = (status_code, body, request_fingerprint)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO IdempotencyKey
+                        (Route, IdemKey, Fingerprint, StatusCode, Body, CreatedAt)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (route, key, request_fingerprint, status_code, zlib.compress(body), now))
+        finally:
+            conn.close()
+        with self._lock:
+            self._in_flight.discard((route, key))
+            self._remember((route, key), now, stored)
+            self._stats['stored'] += 1
+
+    def abandon(self, route: str, key: str) -> None:
+        """Release a reserved key without storing a response, so the client may retry."""
+        with self._lock:
+            self._in_flight.discard((route, key))
+
+    def purge_expired(self) -> int:
+        """Delete expired keys from the table and the LRU."""
+        cutoff = time.time() - self.ttl_seconds
+        conn = self._connect()
+        try:
+            with conn:
+                deleted = conn.execute("DELETE FROM IdempotencyKey WHERE CreatedAt <= ?", (cutoff,)).rowcount
+        finally:
+            conn.close()
+        with self._lock:
+            for cache_key in [k for k, (created, _) in self._cache.items() if created <= cutoff]:
+                del self._cache[cache_key]
+        if deleted:
+            logger.info(f"Purged {deleted} expired idempotency key(s)")
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_keys'] = len(self._cache)
+            stats['in_flight'] = len(self._in_flight)
+        return stats
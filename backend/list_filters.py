@@ -0,0 +1,292 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from reconciliation import DEBIT_TYPES
+
+_DEBIT_LIST = ', '.join(f"'{transaction_type}'" for transaction_type in DEBIT_TYPES)
+
+
+class FilterError(ValueError):
+    """Raised for query parameters or fields a list endpoint does not accept."""
+
+
+class Filter:
+    """
+    A whitelisted query parameter compiled to a parameterized SQL condition.
+
+    sql holds one '?' per placeholder in params_per_value; for enumerated
+    parameters, choices maps each accepted value to a fixed condition.
+    """
+
+    def __init__(self, sql: str = '', convert: Callable[[str], Any] = str, aliases: Sequence[str] = (),
+                 params_per_value: int = 1, choices: Optional[Dict[str, str]] = None):
+        self.sql = sql
+        self.convert = convert
+        self.aliases = tuple(aliases)
+        self.params_per_value = params_per_value
+        self.choices = choices
+
+    def compile(self, name: str, raw: str) -> Tuple[str, List[Any]]:
+        if self.choices is not None:
+            if raw not in self.choices:
+                raise FilterError(f"Invalid value for '{name}'; expected one of: {', '.join(self.choices)}")
+            return self.choices[raw], []
+        try:
+            value = self.convert(raw)
+        except ValueError:
+            raise FilterError(f"Invalid value for '{name}'")
+        return self.sql, [value] * self.params_per_value
+
+
+class ListQuery:
+    """
+    Declarative description of a list endpoint's SELECT.
+
+    Columns and joins are only emitted when a requested field or active
+    filter needs them, so a narrow projection reads fewer tables. Joins
+    marked required (inner joins that define the row set) are always kept.
+    """
+
+    def __init__(self, base: str, columns: Dict[str, Tuple[str, Sequence[str]]],
+                 joins: Sequence[Tuple[str, str, bool]], filters: Dict[str, Filter], order_by: str,
+                 order_fields: Sequence[str]):
+        self.base = base
+        self.columns = columns
+        self.joins = joins
+        self.filters = filters
+        self.order_by = order_by
+        # Output fields matching order_by, used to merge results from several databases
+        self.order_fields = tuple(order_fields)
+        self.descending = order_by.upper().endswith(' DESC')
+
+    def compile(self, args: Dict[str, str], schema: str = 'main',
+                extra_fields: Sequence[str] = ()) -> Dict[str, Any]:
+        """
+        Compile request arguments into SQL
+        :param args: query parameters (control parameters such as fields/count included)
+        :param schema: database schema holding the base table (for attached archives)
+        :param extra_fields: fields that must be selected in addition to the requested ones
+        :return: {'select', 'count', 'order_by', 'params', 'fields', 'limit', 'offset'}; raises FilterError
+        """
+        control = {'fields', 'count', 'limit', 'offset', 'stream'}
+        unknown = [name for name in args if name not in self.filters and name not in control]
+        if unknown:
+            raise FilterError(f"Unsupported query parameter(s): {', '.join(sorted(unknown))}. "
+                              f"Allowed: {', '.join(sorted(set(self.filters) | control))}")
+
+        if args.get('fields'):
+            fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+            invalid = [field for field in fields if field not in self.columns]
+            if invalid:
+                raise FilterError(f"Unknown field(s): {', '.join(invalid)}")
+        else:
+            fields = list(self.columns)
+        fields += [field for field in extra_fields if field not in fields]
+
+        limit, offset = args.get('limit'), args.get('offset')
+        try:
+            limit = int(limit) if limit else None
+            offset = int(offset) if offset else 0
+        except ValueError:
+            raise FilterError("limit and offset must be integers")
+        if (limit is not None and limit < 1) or offset < 0:
+            raise FilterError("limit must be at least 1 and offset not negative")
+
+        needed = set()
+        for field in fields:
+            needed.update(self.columns[field][1])
+
+        conditions, params = [], []
+        for name, raw in args.items():
+            if name in control:
+                continue
+            condition, values = self.filters[name].compile(name, raw)
+            needed.update(self.filters[name].aliases)
+            conditions.append(condition)
+            params.extend(values)
+
+        from_sql = self.base.format(schema=schema) + ''.join(
+            f"\n{clause}" for alias, clause, required in self.joins if required or alias in needed
+        )
+        where_sql = f"\nWHERE {' AND '.join(conditions)}" if conditions else ''
+        select_sql = (
+            "SELECT " + ', '.join(f"{self.columns[field][0]} AS {field}" for field in fields)
+            + f"\nFROM {from_sql}{where_sql}"
+        )
+        return {
+            'select': select_sql,
+            'order_by': self.order_by,
+            'count': f"SELECT COUNT(*) AS total FROM {from_sql}{where_sql}",
+            'params': params,
+            'fields': fields,
+            'limit': limit,
+            'offset': offset
+        }
+
+
+def wants_count(args: Dict[str, str]) -> bool:
+    return args.get('count', '').lower() in ('1', 'true', 'yes')
+
+
+def wants_stream(args: Dict[str, str]) -> bool:
+    return args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+TRIP_QUERY = ListQuery(
+    base="{schema}.Trip t",
+    columns={
+        'TripID': ('t.TripID', ()),
+        'EntryTime': ('t.EntryTime', ()),
+        'ExitTime': ('t.ExitTime', ()),
+        'FareAmount': ('t.FareAmount', ()),
+        'CardNumber': ('c.CardNumber', ('c',)),
+        'PassengerID': ('p.PassengerID', ('p',)),
+        'FirstName': ('p.FirstName', ('p',)),
+        'LastName': ('p.LastName', ('p',)),
+        'EntryStationID': ('es.StationID', ('es',)),
+        'EntryStation': ('es.StationName', ('es',)),
+        'ExitStationID': ('xs.StationID', ('xs',)),
+        'ExitStation': ('xs.StationName', ('xs',))
+    },
+    joins=[
+        ('c', "JOIN main.Card c ON t.CardID = c.CardID", True),
+        ('p', "JOIN main.Passenger p ON c.PassengerID = p.PassengerID", True),
+        ('es', "LEFT JOIN main.Station es ON t.EntryStationID = es.StationID", False),
+        ('xs', "LEFT JOIN main.Station xs ON t.ExitStationID = xs.StationID", False)
+    ],
+    filters={
+        'cardId': Filter("t.CardID = ?", int),
+        'passengerId': Filter("c.PassengerID = ?", int, ('c',)),
+        'stationId': Filter("(t.EntryStationID = ? OR t.ExitStationID = ?)", int, params_per_value=2),
+        'from': Filter("t.EntryTime >= ?"),
+        'to': Filter("t.EntryTime < ?"),
+        'status': Filter(choices={
+            'open': "t.ExitTime IS NULL",
+            'closed': "t.ExitTime IS NOT NULL",
+            'unsettled': "t.ExitTime IS NOT NULL AND t.FareAmount IS NULL"
+        })
+    },
+    # TripID breaks ties between trips entered in the same second, so paging is stable
+    order_by="t.EntryTime DESC, t.TripID DESC",
+    order_fields=('EntryTime', 'TripID')
+)
+
+TRANSACTION_QUERY = ListQuery(
+    base="{schema}.[Transaction] t",
+    columns={
+        'TransactionID': ('t.TransactionID', ()),
+        'TransactionType': ('t.TransactionType', ()),
+        'Amount': ('t.Amount', ()),
+        'TransactionDate': ('t.TransactionDate', ()),
+        'CardID': ('t.CardID', ()),
+        'CardNumber': ('c.CardNumber', ('c',)),
+        'FirstName': ('p.FirstName', ('p',)),
+        'LastName': ('p.LastName', ('p',))
+    },
+    joins=[
+        ('c', "JOIN main.Card c ON t.CardID = c.CardID", True),
+        ('p', "JOIN main.Passenger p ON c.PassengerID = p.PassengerID", True)
+    ],
+    filters={
+        'cardId': Filter("t.CardID = ?", int),
+        'passengerId': Filter("c.PassengerID = ?", int, ('c',)),
+        'from': Filter("t.TransactionDate >= ?"),
+        'to': Filter("t.TransactionDate < ?"),
+        'status': Filter(choices={
+            'credit': f"t.TransactionType NOT IN ({_DEBIT_LIST})",
+            'debit': f"t.TransactionType IN ({_DEBIT_LIST})"
+        })
+    },
+    order_by="t.TransactionDate DESC, t.TransactionID DESC",
+    order_fields=('TransactionDate', 'TransactionID')
+)
+
+CARD_QUERY = ListQuery(
+    base="{schema}.Card c",
+    columns={
+        'CardID': ('c.CardID', ()),
+        'CardNumber': ('c.CardNumber', ()),
+        'Balance': ('c.Balance', ()),
+        'IssueDate': ('c.IssueDate', ()),
+        'Status': ('c.Status', ()),
+        'PassengerID': ('c.PassengerID', ()),
+        'CardTypeID': ('c.CardTypeID', ()),
+        'FirstName': ('p.FirstName', ('p',)),
+        'LastName': ('p.LastName', ('p',)),
+        'Email': ('p.Email', ('p',)),
+        'TypeName': ('ct.TypeName', ('ct',)),
+        'BaseFareMultiplier': ('ct.BaseFareMultiplier', ('ct',))
+    },
+    joins=[
+        ('p', "LEFT JOIN main.Passenger p ON c.PassengerID = p.PassengerID", False),
+        ('ct', "LEFT JOIN main.CardType ct ON c.CardTypeID = ct.CardTypeID", False)
+    ],
+    filters={
+        'cardId': Filter("c.CardID = ?", int),
+        'passengerId': Filter("c.PassengerID = ?", int),
+        'from': Filter("c.IssueDate >= ?"),
+        'to': Filter("c.IssueDate < ?"),
+        'status': Filter(choices={status.lower(): f"c.Status = '{status}'"
+                                  for status in ('Active', 'Inactive', 'Blocked')})
+    },
+    order_by="c.CardID",
+    order_fields=('CardID',)
+)
+
+PASSENGER_QUERY = ListQuery(
+    base="{schema}.Passenger p",
+    columns={
+        'PassengerID': ('p.PassengerID', ()),
+        'FirstName': ('p.FirstName', ()),
+        'LastName': ('p.LastName', ()),
+        'Email': ('p.Email', ()),
+        'PhoneNumber': ('p.PhoneNumber', ()),
+        'RegistrationDate': ('p.RegistrationDate', ()),
+        # Denormalized counters kept current by triggers (passenger_summary.py)
+        'card_count': ("COALESCE(s.CardCount, 0)", ('s',)),
+        'TripCount': ("COALESCE(s.TripCount, 0)", ('s',)),
+        'LifetimeSpend': ("ROUND(COALESCE(s.LifetimeSpend, 0), 2)", ('s',)),
+        'LastTripTime': ("s.LastTripTime", ('s',)),
+        'TotalBalance': ("ROUND(COALESCE(s.TotalBalance, 0), 2)", ('s',))
+    },
+    joins=[
+        ('s', "LEFT JOIN main.PassengerSummary s ON s.PassengerID = p.PassengerID", False)
+    ],
+    filters={
+        'passengerId': Filter("p.PassengerID = ?", int),
+        'cardId': Filter("p.PassengerID = (SELECT PassengerID FROM main.Card WHERE CardID = ?)", int),
+        'from': Filter("p.RegistrationDate >= ?"),
+        'to': Filter("p.RegistrationDate < ?")
+    },
+    order_by="p.PassengerID",
+    order_fields=('PassengerID',)
+)
+
+ALERT_QUERY = ListQuery(
+    base="{schema}.TripAlert a",
+    columns={
+        'AlertID': ('a.AlertID', ()),
+        'AlertType': ('a.AlertType', ()),
+        'CardID': ('a.CardID', ()),
+        'TripID': ('a.TripID', ()),
+        'RelatedTripID': ('a.RelatedTripID', ()),
+        'StationID': ('a.StationID', ()),
+        'StationName': ('s.StationName', ('s',)),
+        'OccurredAt': ('a.OccurredAt', ()),
+        'Details': ('a.Details', ()),
+        'DetectedAt': ('a.DetectedAt', ())
+    },
+    joins=[
+        ('s', "LEFT JOIN main.Station s ON a.StationID = s.StationID", False)
+    ],
+    filters={
+        'cardId': Filter("a.CardID = ?", int),
+        'tripId': Filter("(a.TripID = ? OR a.RelatedTripID = ?)", int, params_per_value=2),
+        'stationId': Filter("a.StationID = ?", int),
+        'from': Filter("a.OccurredAt >= ?"),
+        'to': Filter("a.OccurredAt < ?"),
+        'type': Filter(choices={alert_type: f"a.AlertType = '{alert_type}'" for alert_type in (
+            'double_entry', 'exit_without_entry', 'impossible_transit', 'distant_reuse')})
+    },
+    order_by="a.OccurredAt DESC, a.AlertID DESC",
+    order_fields=('OccurredAt', 'AlertID')
+)
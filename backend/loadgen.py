@@ -0,0 +1,375 @@
+import asyncio
+import json
+import math
+import random
+import time
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Relative demand (0-1) at each hour of the day; values between hours are interpolated
+DEMAND_PROFILES = {
+    'weekday': [0.02, 0.01, 0.01, 0.01, 0.03, 0.10, 0.35, 0.80, 1.00, 0.70, 0.40, 0.35,
+                0.40, 0.38, 0.35, 0.40, 0.60, 0.90, 0.95, 0.60, 0.40, 0.25, 0.12, 0.05],
+    'weekend': [0.05, 0.03, 0.02, 0.01, 0.01, 0.03, 0.08, 0.15, 0.25, 0.35, 0.45, 0.55,
+                0.60, 0.60, 0.55, 0.55, 0.55, 0.55, 0.50, 0.45, 0.40, 0.30, 0.20, 0.10],
+    'flat': [1.0] * 24
+}
+
+DASHBOARD_READS = [
+    '/trips?count=true',
+    '/trips/open-counts',
+    '/trips?status=open&fields=TripID,CardNumber,EntryStation',
+    '/cards?fields=CardID,Balance,Status',
+    '/changes/status',
+    '/health'
+]
+
+
+def demand(profile: List[float], sim_time: datetime) -> float:
+    """Interpolated relative demand for a simulated time of day."""
+    hour = sim_time.hour + sim_time.minute / 60 + sim_time.second / 3600
+    low = int(hour) % 24
+    fraction = hour - int(hour)
+    return profile[low] * (1 - fraction) + profile[(low + 1) % 24] * fraction
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+
+class HttpClient:
+    """
+    Minimal HTTP/1.1 client on asyncio streams (keeps the tool stdlib-only).
+
+    One connection per client; it is reused while the server keeps it alive
+    and reopened after a Connection: close or an error.
+    """
+
+    def __init__(self, base_url: str, timeout: float):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def _close(self) -> None:
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def _read_response(self) -> Tuple[int, bytes, bool]:
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by server')
+        version, status = status_line.split(b' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if 'content-length' in headers:
+            body = await self._reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).strip().split(b';')[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            body = b''.join(chunks)
+        else:
+            body, keep_alive = await self._reader.read(), False
+        return int(status), body, keep_alive
+
+    async def request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Length: {len(body)}\r\n")
+        if payload is not None:
+            head += "Content-Type: application/json\r\n"
+        try:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            self._writer.write(head.encode() + b"\r\n" + body)
+            await self._writer.drain()
+            status, response, keep_alive = await asyncio.wait_for(self._read_response(), self.timeout)
+        except BaseException:
+            await self._close()
+            raise
+        if not keep_alive:
+            await self._close()
+        return status, response
+
+
+class Metrics:
+    """Latency and outcome counters, per operation and per reporting interval."""
+
+    def __init__(self):
+        self.interval: Dict[str, List[float]] = defaultdict(list)
+        self.totals: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.interval_outcomes: Dict[str, int] = defaultdict(int)
+
+    def record(self, operation: str, latency: float, outcome: str) -> None:
+        self.interval[operation].append(latency)
+        self.totals[operation].append(latency)
+        self.outcomes[operation][outcome] += 1
+        self.interval_outcomes[outcome] += 1
+
+    def take_interval(self) -> Tuple[List[float], Dict[str, int]]:
+        latencies = sorted(value for values in self.interval.values() for value in values)
+        outcomes = dict(self.interval_outcomes)
+        self.interval.clear()
+        self.interval_outcomes.clear()
+        return latencies, outcomes
+
+
+def classify(status: int, body: bytes, conflict_expected: bool = False) -> str:
+    """
+    Outcome of a response; a 409 is only a legitimate rejection when the
+    caller expected one (an anti-passback entry for a card mid-journey)
+    """
+    if status < 400:
+        return 'ok'
+    if status == 503 or b'locked' in body or b'busy' in body:
+        return 'lock_timeout'
+    if status == 409:
+        return 'rejected' if conflict_expected else 'unexpected_conflict'
+    return 'error'
+
+
+class LoadGenerator:
+    """
+    Simulates riders tapping through gates against a running backend.
+
+    Riders arrive as a Poisson process whose rate follows a daily demand
+    profile on a simulated clock (speed simulated seconds per real
+    second). Each rider taps in, travels, taps out with the FareRule fare,
+    and sometimes tops up; dashboard readers poll list endpoints alongside.
+
+    Rides pick cards at random, so a card can be drawn while another ride
+    has it mid-journey; that entry is expected to be refused (409) and the
+    ride ends there. A 409 for a card the generator has since tapped out
+    is counted as a failure.
+    """
+
+    def __init__(self, base_url: str, peak_rps: float, profile: List[float], start: datetime, speed: float,
+                 duration: float, concurrency: int, readers: int, top_up_rate: float, report_every: float,
+                 timeout: float, seed: Optional[int] = None):
+        self.base_url = base_url
+        self.peak_rps = peak_rps
+        self.profile = profile
+        self.sim_start = start
+        self.speed = speed
+        self.duration = duration
+        self.concurrency = concurrency
+        self.readers = readers
+        self.top_up_rate = top_up_rate
+        self.report_every = report_every
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.metrics = Metrics()
+        self.timeline: List[Dict[str, Any]] = []
+        self._clients: asyncio.Queue = asyncio.Queue()
+        self._started = 0.0
+        # Rides in progress per card, and cards whose last ride the generator tapped out
+        self._riding: Dict[int, int] = defaultdict(int)
+        self._tapped_out: set = set()
+
+    def sim_now(self) -> datetime:
+        return self.sim_start + timedelta(seconds=(time.monotonic() - self._started) * self.speed)
+
+    async def load_reference_data(self) -> None:
+        client = HttpClient(self.base_url, self.timeout)
+        try:
+            stations = json.loads((await client.request('GET', '/stations'))[1])
+            cards = json.loads((await client.request('GET', '/cards?status=active&fields=CardID'))[1])
+            fare_rules = json.loads((await client.request('GET', '/fare-rules'))[1])
+        finally:
+            await client._close()
+        self.station_ids = [station['StationID'] for station in stations]
+        self.card_ids = [card['CardID'] for card in cards]
+        self.fares: Dict[Tuple[int, int], float] = {}
+        for rule in fare_rules:
+            pair = (rule['StartStationID'], rule['EndStationID'])
+            self.fares[pair] = min(self.fares.get(pair, rule['FareAmount']), rule['FareAmount'])
+        if len(self.station_ids) < 2 or not self.card_ids:
+            raise RuntimeError('The backend needs at least two stations and one active card')
+        logger.info(f"Simulating {len(self.card_ids)} card(s) across {len(self.station_ids)} station(s)")
+
+    async def call(self, operation: str, method: str, path: str, payload: Optional[Dict[str, Any]] = None,
+                   conflict_expected: bool = False) -> int:
+        client = await self._clients.get()
+        started = time.perf_counter()
+        try:
+            status, body = await client.request(method, path, payload)
+            outcome = classify(status, body, conflict_expected)
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            status, outcome = 0, 'timeout'
+        finally:
+            self._clients.put_nowait(client)
+        self.metrics.record(operation, time.perf_counter() - started, outcome)
+        return status
+
+    async def ride(self) -> None:
+        card_id = self.random.choice(self.card_ids)
+        entry_station, exit_station = self.random.sample(self.station_ids, 2)
+        entered = self.sim_now()
+        # Passback is expected while another ride holds the card, or for a card this run has
+        # not tapped out yet (it may have been left open before the run)
+        conflict_expected = self._riding[card_id] > 0 or card_id not in self._tapped_out
+        self._riding[card_id] += 1
+        try:
+            status = await self.call('tap_in', 'POST', '/trips', {
+                'cardId': card_id, 'entryStationId': entry_station,
+                'entryTime': entered.strftime('%Y-%m-%d %H:%M:%S')
+            }, conflict_expected=conflict_expected)
+            if not 200 <= status < 300:
+                # Refused at the gate: tapping out would close another ride's trip
+                return
+            # 5-40 simulated minutes on the train
+            await asyncio.sleep(self.random.uniform(5, 40) * 60 / self.speed)
+            fare = self.fares.get((entry_station, exit_station)) or self.fares.get((exit_station, entry_station))
+            status = await self.call('tap_out', 'POST', '/trips', {
+                'cardId': card_id, 'entryStationId': entry_station, 'exitStationId': exit_station,
+                'entryTime': entered.strftime('%Y-%m-%d %H:%M:%S'),
+                'exitTime': self.sim_now().strftime('%Y-%m-%d %H:%M:%S'),
+                'fareAmount': fare
+            })
+            if 200 <= status < 300:
+                self._tapped_out.add(card_id)
+        finally:
+            self._riding[card_id] -= 1
+        if self.random.random() < self.top_up_rate:
+            await self.call('top_up', 'POST', f'/api/cards/{card_id}/top-up',
+                            {'amount': self.random.choice([100, 200, 500])})
+
+    async def arrivals(self, deadline: float) -> None:
+        rides = set()
+        while time.monotonic() < deadline:
+            rate = self.peak_rps * demand(self.profile, self.sim_now())
+            if rate <= 0:
+                await asyncio.sleep(0.1)
+                continue
+            await asyncio.sleep(self.random.expovariate(rate))
+            task = asyncio.ensure_future(self.ride())
+            rides.add(task)
+            task.add_done_callback(rides.discard)
+        if rides:
+            await asyncio.wait(rides, timeout=self.timeout * 3)
+
+    async def dashboard(self, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            await self.call('dashboard', 'GET', self.random.choice(DASHBOARD_READS))
+            await asyncio.sleep(self.random.uniform(0.5, 2.0))
+
+    async def reporter(self, deadline: float) -> None:
+        last = time.monotonic()
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.report_every)
+            now = time.monotonic()
+            latencies, outcomes = self.metrics.take_interval()
+            requests = len(latencies)
+            failed = requests - outcomes.get('ok', 0) - outcomes.get('rejected', 0)
+            point = {
+                'elapsed': round(now - self._started, 1),
+                'sim_time': self.sim_now().strftime('%H:%M'),
+                'target_rides_per_s': round(self.peak_rps * demand(self.profile, self.sim_now()), 2),
+                'requests_per_s': round(requests / (now - last), 1),
+                'p50_ms': percentile(latencies, 0.50),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'error_rate': round(failed / requests, 4) if requests else 0.0,
+                'lock_timeouts': outcomes.get('lock_timeout', 0),
+                'timeouts': outcomes.get('timeout', 0),
+                'unexpected_conflicts': outcomes.get('unexpected_conflict', 0)
+            }
+            self.timeline.append(point)
+            print(f"[{point['elapsed']:>7}s sim {point['sim_time']}] {point['requests_per_s']:>7} req/s  "
+                  f"p50 {point['p50_ms']}ms p95 {point['p95_ms']}ms p99 {point['p99_ms']}ms  "
+                  f"errors {point['error_rate']:.2%}  lock timeouts {point['lock_timeouts']}  "
+                  f"unexpected 409s {point['unexpected_conflicts']}", flush=True)
+            last = now
+
+    async def run(self) -> Dict[str, Any]:
+        await self.load_reference_data()
+        for _ in range(self.concurrency):
+            self._clients.put_nowait(HttpClient(self.base_url, self.timeout))
+        self._started = time.monotonic()
+        deadline = self._started + self.duration
+        await asyncio.gather(
+            self.arrivals(deadline),
+            self.reporter(deadline),
+            *(self.dashboard(deadline) for _ in range(self.readers))
+        )
+        while not self._clients.empty():
+            await self._clients.get_nowait()._close()
+        return self.summary(time.monotonic() - self._started)
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        operations = {}
+        for operation, latencies in self.metrics.totals.items():
+            latencies = sorted(latencies)
+            outcomes = dict(self.metrics.outcomes[operation])
+            operations[operation] = {
+                'requests': len(latencies),
+                'per_second': round(len(latencies) / elapsed, 2),
+                'p50_ms': percentile(latencies, 0.50),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'max_ms': percentile(latencies, 1.0),
+                'outcomes': outcomes
+            }
+        return {'elapsed_seconds': round(elapsed, 1), 'operations': operations, 'timeline': self.timeline}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Simulate rush-hour gate traffic against a running backend')
+    parser.add_argument('--url', default='http://localhost:5000', help='backend base URL')
+    parser.add_argument('--profile', choices=sorted(DEMAND_PROFILES), default='weekday', help='daily demand curve')
+    parser.add_argument('--peak-rps', type=float, default=50.0, help='rider arrivals per second at peak demand')
+    parser.add_argument('--start', default='07:30', help='simulated start time of day, HH:MM')
+    parser.add_argument('--speed', type=float, default=60.0, help='simulated seconds per real second')
+    parser.add_argument('--duration', type=float, default=120.0, help='real seconds to run')
+    parser.add_argument('--concurrency', type=int, default=64, help='maximum requests in flight')
+    parser.add_argument('--readers', type=int, default=4, help='concurrent dashboard readers')
+    parser.add_argument('--top-up-rate', type=float, default=0.05, help='share of rides followed by a top-up')
+    parser.add_argument('--report-every', type=float, default=5.0, help='seconds between progress lines')
+    parser.add_argument('--timeout', type=float, default=10.0, help='per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for repeatable runs')
+    parser.add_argument('--json', default=None, help='write the summary and timeline to this file')
+    args = parser.parse_args()
+
+    hours, minutes = (int(part) for part in args.start.split(':'))
+    sim_start = datetime.now().replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    generator = LoadGenerator(
+        args.url, args.peak_rps, DEMAND_PROFILES[args.profile], sim_start, args.speed, args.duration,
+        args.concurrency, args.readers, args.top_up_rate, args.report_every, args.timeout, args.seed
+    )
+    result = asyncio.run(generator.run())
+    for name, stats in sorted(result['operations'].items()):
+        print(f"{name:>10}: {stats['requests']} req ({stats['per_second']}/s)  p50 {stats['p50_ms']}ms  "
+              f"p95 {stats['p95_ms']}ms  p99 {stats['p99_ms']}ms  outcomes {stats['outcomes']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
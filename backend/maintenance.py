@@ -0,0 +1,232 @@
+import sqlite3
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_SECONDS = 5
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+# Switching an existing database to incremental auto-vacuum needs a full VACUUM;
+# only worth it once this share of the file is free pages
+REBUILD_FREELIST_RATIO = 0.2
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MaintenanceScheduler:
+    """
+    Keeps the WAL, planner statistics and free pages in check.
+
+    A passive checkpoint runs every interval and never blocks readers or
+    writers. Heavier work (TRUNCATE checkpoint, PRAGMA optimize/ANALYZE,
+    incremental vacuum) only runs inside the configured window or while the
+    API sees fewer than quiet_requests_per_minute requests. Periodic tasks
+    registered with add_task run on every pass, or at most every
+    every_seconds.
+    """
+
+    def __init__(self, db_path: str, interval_seconds: float = 60.0,
+                 window: Tuple[str, str] = ('02:00', '05:00'), quiet_requests_per_minute: int = 30, optimize_interval_hours: float = 24.0,
+                 vacuum_pages: int = 2000, truncate_wal_bytes: int = 64 * 1024 * 1024):
+        self.db_path = db_path
+        self.interval_seconds = interval_seconds
+        self.window = window
+        self.quiet_requests_per_minute = quiet_requests_per_minute
+        self.optimize_interval_hours = optimize_interval_hours
+        self.vacuum_pages = vacuum_pages
+        self.truncate_wal_bytes = truncate_wal_bytes
+
+        self._requests: deque = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_run: Dict[str, Optional[str]] = {
+            'passive_checkpoint': None, 'truncate_checkpoint': None, 'optimize': None,
+            'incremental_vacuum': None, 'rebuild': None
+        }
+        self.last_checkpoint: Optional[Dict[str, int]] = None
+        self._last_optimize = 0.0
+        self._tasks: Dict[str, Tuple[Callable[[], Any], float]] = {}
+        self._task_ran: Dict[str, float] = {}
+
+    def add_task(self, name: str, task: Callable[[], Any], every_seconds: float = 0.0) -> None:
+        """
+        Run task on maintenance passes; its result is reported under name
+        :param every_seconds: skip passes until this long after the task last ran (0 runs it every pass)
+        """
+        self._tasks[name] = (task, every_seconds)
+        self.last_run[name] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+
+    # ==================== Traffic ====================
+
+    def record_request(self) -> None:
+        """Count one API request toward the quiet-period check."""
+        now = time.monotonic()
+        with self._lock:
+            self._requests.append(now)
+            while self._requests and now - self._requests[0] > 60:
+                self._requests.popleft()
+
+    def requests_per_minute(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            while self._requests and now - self._requests[0] > 60:
+                self._requests.popleft()
+            return len(self._requests)
+
+    def in_window(self, now: Optional[datetime] = None) -> bool:
+        """True inside the maintenance window; windows may wrap past midnight."""
+        current = (now or datetime.now()).strftime('%H:%M')
+        start, end = self.window
+        return start <= current < end if start <= end else current >= start or current < end
+
+    def low_traffic(self) -> bool:
+        return self.in_window() or self.requests_per_minute() < self.quiet_requests_per_minute
+
+    # ==================== Tasks ====================
+
+    def ensure_wal(self) -> str:
+        """Switch the database to WAL (persistent across connections) and return the journal mode."""
+        conn = self._connect()
+        try:
+            return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        finally:
+            conn.close()
+
+    def checkpoint(self, conn: sqlite3.Connection, mode: str = 'PASSIVE') -> Dict[str, int]:
+        busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        self.last_checkpoint = {'mode': mode, 'busy': busy, 'wal_frames': log_frames,
+                                'checkpointed_frames': checkpointed}
+        self.last_run[f"{mode.lower()}_checkpoint"] = _now()
+        return self.last_checkpoint
+
+    def optimize(self, conn: sqlite3.Connection) -> None:
+        """Refresh planner statistics: a full ANALYZE the first time, PRAGMA optimize afterwards."""
+        analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        conn.execute("PRAGMA optimize" if analyzed else "ANALYZE")
+        self._last_optimize = time.monotonic()
+        self.last_run['optimize'] = _now()
+
+    def reclaim(self, conn: sqlite3.Connection) -> int:
+        """Return free pages to the filesystem; returns the number of pages released."""
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not freelist:
+            return 0
+        if auto_vacuum == 2:
+            conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+            self.last_run['incremental_vacuum'] = _now()
+            return min(freelist, self.vacuum_pages)
+        if auto_vacuum == 0 and freelist / page_count >= REBUILD_FREELIST_RATIO and self.in_window():
+            # One-off rebuild so later runs can reclaim pages incrementally
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            self.last_run['rebuild'] = _now()
+            logger.info(f"Rebuilt database with incremental auto-vacuum, released {freelist} page(s)")
+            return freelist
+        return 0
+
+    def wal_bytes(self) -> int:
+        wal_path = self.db_path + '-wal'
+        return os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+    def run_once(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Run one maintenance pass
+        :param force: run the heavy tasks regardless of window and traffic
+        :return: what was done
+        """
+        done: Dict[str, Any] = {}
+        conn = self._connect()
+        try:
+            done['checkpoint'] = self.checkpoint(conn, 'PASSIVE')
+            for name, (task, every_seconds) in self._tasks.items():
+                if name in self._task_ran and time.monotonic() - self._task_ran[name] < every_seconds:
+                    continue
+                try:
+                    done[name] = task()
+                    self._task_ran[name] = time.monotonic()
+                    self.last_run[name] = _now()
+                except Exception as e:
+                    # One failing task must not keep the others, or the checkpoints below, from running
+                    logger.error(f"Maintenance task {name} failed: {e}", exc_info=True)
+            if not (force or self.low_traffic()):
+                return done
+            if force or self.wal_bytes() >= self.truncate_wal_bytes or self.in_window():
+                done['checkpoint'] = self.checkpoint(conn, 'TRUNCATE')
+            due = not self._last_optimize or \
+                time.monotonic() - self._last_optimize >= self.optimize_interval_hours * 3600
+            if force or due:
+                self.optimize(conn)
+                done['optimized'] = True
+            done['pages_released'] = self.reclaim(conn)
+        finally:
+            conn.close()
+        return done
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception as e:
+                # Keep the thread alive; the next pass retries
+                logger.error(f"Database maintenance failed: {e}", exc_info=True)
+
+    def start(self) -> None:
+        """Switch to WAL and start the maintenance thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        mode = self.ensure_wal()
+        if mode.lower() != 'wal':
+            logger.warning(f"Database journal mode is {mode}; WAL checkpoints will be no-ops")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    # ==================== Health ====================
+
+    def deep_health(self) -> Dict[str, Any]:
+        """Report WAL, page and freelist state plus the last maintenance times."""
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True,
+                               timeout=BUSY_TIMEOUT_SECONDS)
+        try:
+            pragmas = {name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+                       for name in ('journal_mode', 'page_size', 'page_count', 'freelist_count', 'auto_vacuum')}
+        finally:
+            conn.close()
+        wal_bytes = self.wal_bytes()
+        checkpoint = self.last_checkpoint or {}
+        page_count = pragmas['page_count']
+        return {
+            'journal_mode': pragmas['journal_mode'],
+            'auto_vacuum': AUTO_VACUUM_MODES.get(pragmas['auto_vacuum'], pragmas['auto_vacuum']),
+            'page_size': pragmas['page_size'],
+            'page_count': pragmas['page_count'],
+            'freelist_count': pragmas['freelist_count'],
+            'freelist_ratio': round(pragmas['freelist_count'] / page_count, 4) if page_count else 0.0,
+            'database_bytes': os.path.getsize(self.db_path),
+            'wal_bytes': wal_bytes,
+            # Frames in the WAL that the last checkpoint could not copy back (held by readers)
+            'checkpoint_lag_frames': checkpoint.get('wal_frames', 0) - checkpoint.get('checkpointed_frames', 0),
+            'last_checkpoint': checkpoint or None,
+            'last_maintenance': dict(self.last_run),
+            'requests_per_minute': self.requests_per_minute(),
+            'in_window': self.in_window()
+        }
@@ -0,0 +1,111 @@
+import threading
+import tracemalloc
+import logging
+from datetime import datetime
+from urllib.parse import urlencode
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_BYTES = 64 * 1024 * 1024
+# Rough cost of one field of one row while a list response is built: the
+# sqlite3.Row value, its dict entry and its share of the JSON body
+DEFAULT_BYTES_PER_FIELD = 200
+OVERSIZE_ACTIONS = ('stream', 'reject')
+
+
+class MemoryGuard:
+    """
+    Keeps list responses within a per-request memory budget.
+
+    The budget is turned into a row limit for the requested projection, and
+    list queries fetch at most one row past it. A result that overflows is
+    never materialized: it is streamed from the cursor instead, or rejected
+    with a pagination hint. With trace enabled, tracemalloc high-water marks
+    are recorded per route, for streamed responses once the body has been
+    sent. tracemalloc peaks are process-wide, so the figures only hold when
+    requests are served one at a time: app.py runs the development server
+    with threaded=False while tracing, and other servers need one worker
+    thread per process.
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_BYTES, oversize: str = 'stream',
+                 bytes_per_field: int = DEFAULT_BYTES_PER_FIELD, trace: bool = False):
+        if oversize not in OVERSIZE_ACTIONS:
+            raise ValueError(f"Oversize action must be one of {', '.join(OVERSIZE_ACTIONS)}, got {oversize}")
+        self.budget_bytes = budget_bytes
+        self.oversize = oversize
+        self.bytes_per_field = bytes_per_field
+        self.trace = trace
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def _route(self, route: str) -> Dict[str, Any]:
+        return self._routes.setdefault(route, {'requests': 0, 'peak_bytes': 0, 'last_peak_bytes': 0,
+                                               'streamed': 0, 'rejected': 0, 'last_oversize': None})
+
+    # ==================== Budget ====================
+
+    def row_limit(self, field_count: int) -> int:
+        """Rows of field_count fields that fit in the budget."""
+        return max(1, self.budget_bytes // (max(field_count, 1) * self.bytes_per_field))
+
+    def record_oversize(self, route: str, action: str) -> None:
+        with self._lock:
+            stats = self._route(route)
+            stats[action] += 1
+            stats['last_oversize'] = datetime.now().isoformat()
+        logger.warning(f"Result for {route} exceeds the {self.budget_bytes}-byte memory budget; {action}")
+
+    def pagination_hint(self, path: str, args: Dict[str, str], row_limit: int, offset: int,
+                        streamable: bool = False) -> Dict[str, Any]:
+        """Body for a rejected oversized list request, with the URL of its first page."""
+        page_args = {name: value for name, value in args.items() if name not in ('stream', 'limit', 'offset')}
+        hint = {
+            'error': 'Result exceeds the memory budget; request it in pages',
+            'budgetBytes': self.budget_bytes,
+            'maxLimit': row_limit,
+            'next': f"{path}?{urlencode(dict(page_args, limit=row_limit, offset=offset))}"
+        }
+        if streamable:
+            hint['stream'] = f"{path}?{urlencode(dict(args, stream='true'))}"
+        return hint
+
+    # ==================== Tracing ====================
+
+    def start(self) -> None:
+        """Start tracemalloc when tracing is enabled."""
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self) -> None:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def trace_start(self) -> Optional[int]:
+        """Reset the traced peak; returns the baseline, or None when not tracing."""
+        if not (self.trace and tracemalloc.is_tracing()):
+            return None
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def trace_finish(self, route: str, baseline: int) -> int:
+        """Record the request's high-water mark above its baseline; returns it in bytes."""
+        peak = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+        with self._lock:
+            stats = self._route(route)
+            stats['requests'] += 1
+            stats['last_peak_bytes'] = peak
+            stats['peak_bytes'] = max(stats['peak_bytes'], peak)
+        return peak
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {route: dict(stats) for route, stats in self._routes.items()}
+        return {
+            'budget_bytes': self.budget_bytes,
+            'oversize': self.oversize,
+            'bytes_per_field': self.bytes_per_field,
+            'tracing': self.trace and tracemalloc.is_tracing(),
+            'routes': routes
+        }
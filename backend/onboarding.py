@@ -0,0 +1,248 @@
+import sqlite3
+import io
+import os
+import re
+import csv
+import json
+import argparse
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Any, Tuple
+
+from reconciliation import ISSUE_INSERT
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+DEFAULT_CHUNK_SIZE = 1000
+BUSY_TIMEOUT_SECONDS = 30
+# Per-row errors kept in the report; the counts always cover every row
+MAX_REPORTED_ERRORS = 1000
+
+CARD_STATUSES = ('Active', 'Inactive', 'Blocked')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# (card id, card number, balance, status, fare multiplier) for each created card
+CreatedCard = Tuple[int, str, float, str, float]
+
+
+def read_rows(stream: Iterable[str], fmt: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield import rows one at a time from a text stream
+    :param stream: lines of CSV (with a header row) or NDJSON
+    :param fmt: 'csv' or 'ndjson'
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'ndjson':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            # Malformed lines still take a row number so the report lines up with the input
+            yield row if isinstance(row, dict) else {'__invalid__': line[:200]}
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+class OnboardingImport:
+    """
+    Bulk import of passengers with their first card.
+
+    Existing emails, phone numbers and card numbers are preloaded into
+    sets and card type names resolved once, so every row is validated and
+    deduplicated in memory; only valid rows reach the database, written
+    with executemany in one transaction per chunk. IDs are assigned inside
+    that transaction so cards can reference their new passenger.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 dry_run: bool = False, on_chunk: Optional[Callable[[List[CreatedCard]], None]] = None):
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.on_chunk = on_chunk
+
+    def _load_keys(self, conn: sqlite3.Connection) -> None:
+        self.emails = {row[0].lower() for row in conn.execute("SELECT Email FROM Passenger")}
+        self.phones = {row[0] for row in conn.execute("SELECT PhoneNumber FROM Passenger WHERE PhoneNumber != ''")}
+        self.card_numbers = {row[0] for row in conn.execute("SELECT CardNumber FROM Card")}
+        self.card_types: Dict[str, Tuple[int, float]] = {}
+        for type_id, name, multiplier in conn.execute("SELECT CardTypeID, TypeName, BaseFareMultiplier FROM CardType"):
+            self.card_types[name.lower()] = (type_id, multiplier)
+            self.card_types[str(type_id)] = (type_id, multiplier)
+
+    def validate(self, row: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """
+        Validate one row against the preloaded keys and the rows accepted so far
+        :return: (normalised row or None, errors)
+        """
+        if '__invalid__' in row:
+            return None, ['Malformed JSON line']
+        errors = []
+        first_name = str(row.get('firstName') or '').strip()
+        last_name = str(row.get('lastName') or '').strip()
+        email = str(row.get('email') or '').strip().lower()
+        phone = str(row.get('phoneNumber') or '').strip()
+        card_number = str(row.get('cardNumber') or '').strip()
+        status = str(row.get('status') or 'Active').strip()
+        card_type = self.card_types.get(str(row.get('cardType') or row.get('cardTypeId') or 'regular').strip().lower())
+
+        if not first_name or not last_name:
+            errors.append('firstName and lastName are required')
+        if not EMAIL_PATTERN.match(email):
+            errors.append('Invalid email')
+        elif email in self.emails:
+            errors.append(f"Email already exists: {email}")
+        if phone and phone in self.phones:
+            errors.append(f"Phone number already exists: {phone}")
+        if not card_number:
+            errors.append('cardNumber is required')
+        elif card_number in self.card_numbers:
+            errors.append(f"Card number already exists: {card_number}")
+        if card_type is None:
+            errors.append(f"Unknown card type: {row.get('cardType') or row.get('cardTypeId')}")
+        if status not in CARD_STATUSES:
+            errors.append(f"Invalid status: {status}")
+        try:
+            balance = float(row.get('balance') or 0)
+            if balance < 0:
+                errors.append('balance must not be negative')
+        except (TypeError, ValueError):
+            balance = 0.0
+            errors.append('Invalid balance')
+        if errors:
+            return None, errors
+
+        # Reserve the keys so later duplicates in the same batch are rejected
+        self.emails.add(email)
+        if phone:
+            self.phones.add(phone)
+        self.card_numbers.add(card_number)
+        return {
+            'FirstName': first_name,
+            'LastName': last_name,
+            'Email': email,
+            'PhoneNumber': phone,
+            'CardNumber': card_number,
+            'Balance': balance,
+            'Status': status,
+            'CardTypeID': card_type[0],
+            'Multiplier': card_type[1]
+        }, []
+
+    def _next_id(self, conn: sqlite3.Connection, table: str, key: str) -> int:
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        highest = conn.execute(f"SELECT COALESCE(MAX({key}), 0) FROM {table}").fetchone()[0]
+        return max(row[0] if row else 0, highest) + 1
+
+    def _write_chunk(self, conn: sqlite3.Connection, chunk: List[Dict[str, Any]]) -> List[CreatedCard]:
+        """Insert one chunk of passengers and cards in a single write transaction."""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            passenger_id = self._next_id(conn, 'Passenger', 'PassengerID')
+            card_id = self._next_id(conn, 'Card', 'CardID')
+            passengers, cards, created = [], [], []
+            for offset, row in enumerate(chunk):
+                passengers.append((passenger_id + offset, row['FirstName'], row['LastName'], row['Email'],
+                                   row['PhoneNumber'] or None, now))
+                cards.append((card_id + offset, row['CardNumber'], row['Balance'], now, row['Status'],
+                              passenger_id + offset, row['CardTypeID']))
+                created.append((card_id + offset, row['CardNumber'], row['Balance'], row['Status'], row['Multiplier']))
+            conn.executemany("""
+                INSERT INTO Passenger (PassengerID, FirstName, LastName, Email, PhoneNumber, RegistrationDate)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, passengers)
+            conn.executemany("""
+                INSERT INTO Card (CardID, CardNumber, Balance, IssueDate, Status, PassengerID, CardTypeID)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, cards)
+            conn.executemany(ISSUE_INSERT, [(balance, now, card_id) for card_id, _, balance, *_ in cards])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return created
+
+    def run(self, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Validate and import rows
+        :param rows: parsed rows, e.g. from read_rows()
+        :return: counts and per-row errors (row numbers are 1-based, excluding any header)
+        """
+        started = datetime.now()
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        report = {'rows': 0, 'imported': 0, 'failed': 0, 'dry_run': self.dry_run, 'errors': []}
+        try:
+            self._load_keys(conn)
+            chunk: List[Dict[str, Any]] = []
+            chunk_rows: List[int] = []
+            for number, row in enumerate(rows, start=1):
+                report['rows'] = number
+                valid, errors = self.validate(row)
+                if errors:
+                    report['failed'] += 1
+                    if len(report['errors']) < MAX_REPORTED_ERRORS:
+                        report['errors'].append({'row': number, 'errors': errors})
+                    continue
+                chunk.append(valid)
+                chunk_rows.append(number)
+                if len(chunk) >= self.chunk_size:
+                    self._flush(conn, chunk, chunk_rows, report)
+                    chunk, chunk_rows = [], []
+            if chunk:
+                self._flush(conn, chunk, chunk_rows, report)
+        finally:
+            conn.close()
+        report['elapsed_seconds'] = round((datetime.now() - started).total_seconds(), 3)
+        logger.info(f"Onboarding import: {report['imported']} imported, {report['failed']} failed "
+                    f"of {report['rows']} row(s)")
+        return report
+
+    def _flush(self, conn: sqlite3.Connection, chunk: List[Dict[str, Any]], chunk_rows: List[int],
+               report: Dict[str, Any]) -> None:
+        if self.dry_run:
+            report['imported'] += len(chunk)
+            return
+        try:
+            created = self._write_chunk(conn, chunk)
+        except sqlite3.Error as e:
+            # A concurrent writer took a key after the preload; the whole chunk is rolled back
+            logger.error(f"Error importing rows {chunk_rows[0]}-{chunk_rows[-1]}: {e}")
+            report['failed'] += len(chunk)
+            for number in chunk_rows:
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'row': number, 'errors': [f"Chunk rolled back: {e}"]})
+            return
+        report['imported'] += len(created)
+        if self.on_chunk:
+            self.on_chunk(created)
+
+
+def import_file(path: str, db_path: str = DEFAULT_DB_PATH, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                dry_run: bool = False) -> Dict[str, Any]:
+    """Import a .csv or .ndjson/.jsonl file."""
+    fmt = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+    with io.open(path, encoding='utf-8', newline='') as stream:
+        return OnboardingImport(db_path, chunk_size, dry_run).run(read_rows(stream, fmt))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Bulk import passengers and their cards from CSV or NDJSON')
+    parser.add_argument('path', help='.csv file with a header row, or .ndjson/.jsonl file')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='rows per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='validate only, write nothing')
+    args = parser.parse_args()
+
+    result = import_file(args.path, args.db, args.chunk_size, args.dry_run)
+    for error in result['errors']:
+        print(f"Row {error['row']}: {'; '.join(error['errors'])}")
+    print(f"{result['imported']} imported, {result['failed']} failed of {result['rows']} row(s)")
@@ -0,0 +1,261 @@
+import sqlite3
+import os
+import glob
+import argparse
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+
+from archive import DEFAULT_ARCHIVE_DIR, list_partitions, archive_path
+from reconciliation import DEBIT_TYPES
+from sharding import DEFAULT_SHARD_DIR
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+BUSY_TIMEOUT_SECONDS = 30
+
+SUMMARY_TABLE = """
+CREATE TABLE IF NOT EXISTS PassengerSummary (
+    PassengerID INTEGER PRIMARY KEY,
+    CardCount INTEGER NOT NULL DEFAULT 0,
+    TripCount INTEGER NOT NULL DEFAULT 0,
+    LifetimeSpend REAL NOT NULL DEFAULT 0,
+    LastTripTime TEXT,
+    TotalBalance REAL NOT NULL DEFAULT 0
+)"""
+
+_DEBIT_LIST = ', '.join(f"'{transaction_type}'" for transaction_type in DEBIT_TYPES)
+
+# Trip and transaction counters are lifetime figures: rows leaving project.db for
+# the archive or a shard are not subtracted, so there are no DELETE triggers on them.
+# An exit tap closes its trip with an UPDATE, so each journey is inserted (and counted) once
+SUMMARY_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_summary_passenger_insert AFTER INSERT ON Passenger
+    BEGIN
+        INSERT OR IGNORE INTO PassengerSummary (PassengerID) VALUES (NEW.PassengerID);
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_summary_passenger_delete AFTER DELETE ON Passenger
+    BEGIN
+        DELETE FROM PassengerSummary WHERE PassengerID = OLD.PassengerID;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_summary_card_insert AFTER INSERT ON Card
+    WHEN NEW.PassengerID IS NOT NULL
+    BEGIN
+        INSERT INTO PassengerSummary (PassengerID, CardCount, TotalBalance)
+        VALUES (NEW.PassengerID, 1, COALESCE(NEW.Balance, 0))
+        ON CONFLICT (PassengerID) DO UPDATE SET
+            CardCount = CardCount + 1,
+            TotalBalance = TotalBalance + excluded.TotalBalance;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_summary_card_update AFTER UPDATE OF Balance, PassengerID ON Card
+    BEGIN
+        UPDATE PassengerSummary
+        SET CardCount = CardCount - 1, TotalBalance = TotalBalance - COALESCE(OLD.Balance, 0)
+        WHERE PassengerID = OLD.PassengerID;
+        INSERT INTO PassengerSummary (PassengerID, CardCount, TotalBalance)
+        SELECT NEW.PassengerID, 1, COALESCE(NEW.Balance, 0) WHERE NEW.PassengerID IS NOT NULL
+        ON CONFLICT (PassengerID) DO UPDATE SET
+            CardCount = CardCount + 1,
+            TotalBalance = TotalBalance + excluded.TotalBalance;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_summary_card_delete AFTER DELETE ON Card
+    BEGIN
+        UPDATE PassengerSummary
+        SET CardCount = CardCount - 1, TotalBalance = TotalBalance - COALESCE(OLD.Balance, 0)
+        WHERE PassengerID = OLD.PassengerID;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_summary_trip_insert AFTER INSERT ON Trip
+    BEGIN
+        UPDATE PassengerSummary
+        SET TripCount = TripCount + 1,
+            LastTripTime = CASE WHEN LastTripTime IS NULL OR NEW.EntryTime > LastTripTime
+                                THEN NEW.EntryTime ELSE LastTripTime END
+        WHERE PassengerID = (SELECT PassengerID FROM Card WHERE CardID = NEW.CardID);
+    END""",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_summary_transaction_insert AFTER INSERT ON [Transaction]
+    WHEN NEW.TransactionType IN ({_DEBIT_LIST})
+    BEGIN
+        UPDATE PassengerSummary
+        SET LifetimeSpend = LifetimeSpend + NEW.Amount
+        WHERE PassengerID = (SELECT PassengerID FROM Card WHERE CardID = NEW.CardID);
+    END"""
+]
+
+SUMMARY_SELECT = """
+    SELECT p.PassengerID, p.FirstName, p.LastName,
+           COALESCE(s.CardCount, 0) AS CardCount, COALESCE(s.TripCount, 0) AS TripCount,
+           ROUND(COALESCE(s.LifetimeSpend, 0), 2) AS LifetimeSpend, s.LastTripTime,
+           ROUND(COALESCE(s.TotalBalance, 0), 2) AS TotalBalance
+    FROM Passenger p
+    LEFT JOIN PassengerSummary s ON s.PassengerID = p.PassengerID
+    WHERE p.PassengerID = ?
+"""
+
+
+def ensure_schema(conn: sqlite3.Connection, db_path: Optional[str] = None) -> None:
+    """
+    Create PassengerSummary and its maintenance triggers
+    :param db_path: database file to rebuild from when the table is new
+    """
+    existed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'PassengerSummary'").fetchone()
+    conn.execute(SUMMARY_TABLE)
+    for create_sql in SUMMARY_TRIGGERS:
+        conn.execute(create_sql)
+    conn.commit()
+    if not existed and db_path:
+        rebuild(db_path)
+
+
+def _card_activity(conn: sqlite3.Connection, read_balances: bool = False) -> Dict[int, List[Any]]:
+    """Per-card trip count, last entry time, debit spend and (optionally) balance from one database."""
+    activity: Dict[int, List[Any]] = defaultdict(lambda: [0, None, 0.0, None])
+    for card_id, trips, last_trip in conn.execute(
+            "SELECT CardID, COUNT(*), MAX(EntryTime) FROM Trip GROUP BY CardID"):
+        activity[card_id][0] = trips
+        activity[card_id][1] = last_trip
+    for card_id, spend in conn.execute(
+            f"SELECT CardID, SUM(Amount) FROM [Transaction] "
+            f"WHERE TransactionType IN ({', '.join('?' * len(DEBIT_TYPES))}) GROUP BY CardID", DEBIT_TYPES):
+        activity[card_id][2] = spend or 0.0
+    if read_balances:
+        for card_id, balance in conn.execute("SELECT CardID, Balance FROM Card"):
+            activity[card_id][3] = balance
+    return activity
+
+
+def _file_activity(path: str, read_balances: bool = False) -> Dict[int, List[Any]]:
+    """_card_activity() of an archive or shard file, read over its own read-only connection."""
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_SECONDS)
+    try:
+        return _card_activity(conn, read_balances)
+    finally:
+        conn.close()
+
+
+def _archive_versions(archive_dir: str) -> Dict[Tuple[int, int], Tuple[int, int, int]]:
+    """Inode, modification time and size of every archive month, to tell which changed."""
+    versions = {}
+    for partition in list_partitions(archive_dir):
+        try:
+            info = os.stat(archive_path(archive_dir, *partition))
+        except FileNotFoundError:
+            continue
+        versions[partition] = (info.st_ino, info.st_mtime_ns, info.st_size)
+    return versions
+
+
+def rebuild(db_path: str = DEFAULT_DB_PATH, archive_dir: str = DEFAULT_ARCHIVE_DIR,
+            shard_paths: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Recompute every passenger's summary from scratch.
+
+    project.db is read while the rebuild holds its write lock: a trip or
+    transaction committed between the read and the rewrite would have its
+    trigger increment overwritten. The archive months are summed before
+    taking the lock. An archive run publishes a month and deletes its hot
+    rows under project.db's write lock, so it cannot do either while the
+    rebuild holds it; any month that changed since it was summed is re-read
+    under the lock. Shards are read first, without the lock; their writes never reach
+    the project.db triggers, so with sharded storage this rebuild is what
+    keeps the summaries current.
+    :param db_path: hot database holding Passenger and the card directory
+    :param archive_dir: per-month archives whose trips and transactions still count
+    :param shard_paths: shard files holding card activity and authoritative balances
+    :return: counts and timing
+    """
+    started = datetime.now()
+    trips: Dict[int, int] = defaultdict(int)
+    last_trip: Dict[int, str] = {}
+    spend: Dict[int, float] = defaultdict(float)
+    balances: Dict[int, float] = {}
+
+    def add(activity: Dict[int, List[Any]]) -> None:
+        for card_id, (count, last, debit, balance) in activity.items():
+            trips[card_id] += count
+            spend[card_id] += debit
+            if last and (card_id not in last_trip or last > last_trip[card_id]):
+                last_trip[card_id] = last
+            if balance is not None:
+                balances[card_id] = balance
+
+    sources = 1
+    for path in shard_paths:
+        if os.path.exists(path):
+            add(_file_activity(path, read_balances=True))
+            sources += 1
+
+    versions = _archive_versions(archive_dir)
+    archived = {partition: _file_activity(archive_path(archive_dir, *partition)) for partition in versions}
+
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            add(_card_activity(conn))
+            current = _archive_versions(archive_dir)
+            for partition in current:
+                if current[partition] != versions.get(partition):
+                    archived[partition] = _file_activity(archive_path(archive_dir, *partition))
+            for partition in current:
+                add(archived[partition])
+                sources += 1
+            conn.execute(SUMMARY_TABLE)
+            summaries = {passenger_id: [0, 0, 0.0, None, 0.0]
+                         for (passenger_id,) in conn.execute("SELECT PassengerID FROM Passenger")}
+            for card_id, passenger_id, balance in conn.execute("SELECT CardID, PassengerID, Balance FROM Card"):
+                summary = summaries.get(passenger_id)
+                if summary is None:
+                    continue
+                summary[0] += 1
+                summary[1] += trips.get(card_id, 0)
+                summary[2] += spend.get(card_id, 0.0)
+                last = last_trip.get(card_id)
+                if last and (summary[3] is None or last > summary[3]):
+                    summary[3] = last
+                summary[4] += balances.get(card_id, balance or 0.0)
+            conn.execute("DELETE FROM PassengerSummary")
+            conn.executemany("""
+                INSERT INTO PassengerSummary
+                    (PassengerID, CardCount, TripCount, LifetimeSpend, LastTripTime, TotalBalance)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [(passenger_id, *summary) for passenger_id, summary in summaries.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    elapsed = round((datetime.now() - started).total_seconds(), 3)
+    logger.info(f"Rebuilt {len(summaries)} passenger summary row(s) from {sources} database(s) in {elapsed}s")
+    return {'passengers': len(summaries), 'sources': sources, 'elapsed_seconds': elapsed}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Rebuild the denormalized PassengerSummary table')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--archive-dir', default=DEFAULT_ARCHIVE_DIR, help='directory of per-month archives')
+    parser.add_argument('--shard-dir', default=None,
+                        help=f"include sharded card activity from this directory (e.g. {DEFAULT_SHARD_DIR})")
+    args = parser.parse_args()
+
+    shard_files = sorted(glob.glob(os.path.join(args.shard_dir, 'metro_shard_*.db'))) if args.shard_dir else []
+    conn = sqlite3.connect(args.db)
+    try:
+        ensure_schema(conn)
+    finally:
+        conn.close()
+    result = rebuild(args.db, args.archive_dir, shard_files)
+    print(f"{result['passengers']} passenger(s) summarised from {result['sources']} database(s) "
+          f"in {result['elapsed_seconds']}s")
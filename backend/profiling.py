@@ -0,0 +1,211 @@
+import os
+import hmac
+import time
+import random
+import pstats
+import marshal
+import cProfile
+import logging
+import threading
+from io import StringIO
+from datetime import datetime
+from collections import defaultdict
+from typing import Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_HEADER = 'X-Profile-Token'
+DEFAULT_MAX_DEPTH = 64
+# Paths below this share of a second are dropped from collapsed stacks
+MIN_STACK_SECONDS = 1e-6
+
+# Where self time is spent, by the function's file or built-in name; first match wins
+CATEGORIES = (
+    ('sqlite', ('sqlite3',)),
+    ('json', ('json', 'jsonify')),
+    ('logging', ('logging',)),
+    ('flask', ('flask', 'werkzeug', 'flask_cors')),
+    ('app', (BASE_DIR,))
+)
+
+# pstats function key: (filename, line number, function name)
+FunctionKey = Tuple[str, int, str]
+
+
+def function_label(func: FunctionKey) -> str:
+    filename, line, name = func
+    if filename == '~':
+        # Built-ins, e.g. "<method 'execute' of 'sqlite3.Connection' objects>"
+        return name
+    # Parent directory too, so flask/app.py and backend/app.py stay apart
+    short = os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename))
+    return f"{short}:{line}({name})"
+
+
+def categorize(func: FunctionKey) -> str:
+    filename, _, name = func
+    haystack = name if filename == '~' else filename
+    for category, needles in CATEGORIES:
+        if any(needle in haystack for needle in needles):
+            return category
+    return 'other'
+
+
+def collapsed_stacks(stats: Dict[FunctionKey, tuple], max_depth: int = DEFAULT_MAX_DEPTH) -> Dict[str, float]:
+    """
+    Rebuild flamegraph stacks from cProfile's caller/callee edges.
+
+    cProfile keeps one level of callers per function, not whole stacks, so
+    each function's time is split across its callers in proportion to the
+    cumulative time of each edge. Recursion is cut where a function is
+    already on the path.
+    :return: {"root;...;leaf": self seconds}
+    """
+    callees: Dict[FunctionKey, Dict[FunctionKey, tuple]] = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+    stacks: Dict[str, float] = defaultdict(float)
+
+    def walk(func: FunctionKey, path: Tuple[str, ...], on_path: frozenset, share: float) -> None:
+        _, _, self_time, cumulative, _ = stats[func]
+        path = path + (function_label(func),)
+        if self_time * share > 0:
+            stacks[';'.join(path)] += self_time * share
+        if len(path) >= max_depth:
+            return
+        for callee, edge in callees.get(func, {}).items():
+            callee_cumulative = stats[callee][3]
+            if callee in on_path or callee_cumulative <= 0:
+                continue
+            callee_share = share * min(1.0, edge[3] / callee_cumulative)
+            if callee_share * callee_cumulative >= MIN_STACK_SECONDS:
+                walk(callee, path, on_path | {callee}, callee_share)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(func, (), frozenset((func,)), 1.0)
+    return stacks
+
+
+class RequestProfiler:
+    """
+    Opt-in cProfile around single requests, aggregated per endpoint.
+
+    A request is profiled when it carries the X-Profile-Token header with
+    the configured token, or when it is picked by 1-in-sample_rate sampling.
+    Profiles are merged into one pstats.Stats per route, served as
+    top-functions reports, collapsed stacks or raw pstats dumps. Nothing is
+    profiled, and the reports are not served, unless a token is configured.
+    """
+
+    def __init__(self, token: Optional[str] = None, sample_rate: int = 0):
+        self.token = token
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._routes: Dict[str, Dict[str, Any]] = {}
+        self._random = random.Random()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def authorized(self, header_value: Optional[str]) -> bool:
+        """Check a request's X-Profile-Token header against the configured token."""
+        return self.enabled and header_value is not None and hmac.compare_digest(header_value, self.token)
+
+    def should_profile(self, header_value: Optional[str]) -> bool:
+        if not self.enabled:
+            return False
+        if self.authorized(header_value):
+            return True
+        return self.sample_rate > 0 and self._random.randrange(self.sample_rate) == 0
+
+    def start(self) -> Tuple[cProfile.Profile, float]:
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        return profile, started
+
+    def finish(self, route: str, profile: cProfile.Profile, started: float, sampled: bool) -> float:
+        """
+        Stop a request's profiler and merge it into the route's stats
+        :return: wall-clock milliseconds spent in the profiled part of the request
+        """
+        profile.disable()
+        elapsed = time.perf_counter() - started
+        stats = pstats.Stats(profile, stream=StringIO())
+        with self._lock:
+            if route in self._stats:
+                self._stats[route].add(stats)
+            else:
+                self._stats[route] = stats
+            summary = self._routes.setdefault(route, {'requests': 0, 'sampled': 0, 'total_seconds': 0.0,
+                                                      'max_seconds': 0.0, 'last_profiled': None})
+            summary['requests'] += 1
+            summary['sampled'] += int(sampled)
+            summary['total_seconds'] += elapsed
+            summary['max_seconds'] = max(summary['max_seconds'], elapsed)
+            summary['last_profiled'] = datetime.now().isoformat()
+        return elapsed * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {
+                route: dict(summary,
+                            mean_ms=round(summary['total_seconds'] * 1000 / summary['requests'], 3),
+                            total_seconds=round(summary['total_seconds'], 6),
+                            max_seconds=round(summary['max_seconds'], 6))
+                for route, summary in self._routes.items()
+            }
+        return {'sample_rate': self.sample_rate, 'routes': routes}
+
+    def _route_stats(self, route: str) -> Dict[FunctionKey, tuple]:
+        with self._lock:
+            if route not in self._stats:
+                raise KeyError(route)
+            # Copy so reports are built outside the lock while requests keep merging in
+            return dict(self._stats[route].stats)
+
+    def top_functions(self, route: str, sort: str = 'cumulative', limit: int = 30) -> Dict[str, Any]:
+        """Functions ranked by cumulative or self time, plus self time per category."""
+        stats = self._route_stats(route)
+        sort_index = {'cumulative': 3, 'tottime': 2, 'calls': 1}.get(sort)
+        if sort_index is None:
+            raise ValueError(f"Unknown sort key: {sort}")
+        categories: Dict[str, float] = defaultdict(float)
+        for func, (_, _, self_time, _, _) in stats.items():
+            categories[categorize(func)] += self_time
+        ranked = sorted(stats.items(), key=lambda item: item[1][sort_index], reverse=True)[:limit]
+        return {
+            'route': route,
+            'sort': sort,
+            'categories': {name: round(seconds, 6) for name, seconds in
+                           sorted(categories.items(), key=lambda item: item[1], reverse=True)},
+            'functions': [{
+                'function': function_label(func),
+                'category': categorize(func),
+                'calls': calls,
+                'primitive_calls': primitive_calls,
+                'tottime': round(self_time, 6),
+                'cumtime': round(cumulative, 6)
+            } for func, (primitive_calls, calls, self_time, cumulative, _) in ranked]
+        }
+
+    def collapsed(self, route: str) -> str:
+        """Collapsed stacks in microseconds, one "frame;frame;frame count" line each (flamegraph.pl, speedscope)."""
+        stacks = collapsed_stacks(self._route_stats(route))
+        lines = [f"{stack} {round(seconds * 1e6)}" for stack, seconds in sorted(stacks.items())
+                 if round(seconds * 1e6) > 0]
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, route: str) -> bytes:
+        """The route's merged stats in pstats' marshal format (loadable with pstats.Stats or snakeviz)."""
+        return marshal.dumps(self._route_stats(route))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._routes.clear()
@@ -0,0 +1,288 @@
+import sqlite3
+import os
+import sys
+import glob
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+
+from archive import DEFAULT_ARCHIVE_DIR, MAX_ATTACHED, list_partitions, archive_path
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+
+# Transaction types that take money off a card; everything else is a credit.
+# 'Adjustment' rows carry a signed amount and are written by repair_ledger().
+DEBIT_TYPES = ('Fare', 'Penalty', 'Debit')
+# Credit holding a card's opening balance, written when the card is issued. A
+# card without one (issued before it was recorded) has no ledger baseline.
+ISSUE_TYPE = 'Issue'
+ISSUE_INSERT = f"""
+    INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID)
+    VALUES ('{ISSUE_TYPE}', ?, ?, ?)
+"""
+TOLERANCE = 0.005
+FETCH_SIZE = 10000
+REPAIR_CHUNK_SIZE = 5000
+
+# Per-card ledger sum and whether it includes the opening balance, from the hot
+# table or an attached archive month; summed per CardID over idx_transaction_card
+LEDGER_QUERY = f"""
+    SELECT CardID,
+           SUM(CASE WHEN TransactionType IN ({', '.join('?' * len(DEBIT_TYPES))})
+                    THEN -Amount ELSE Amount END),
+           MAX(TransactionType = '{ISSUE_TYPE}')
+    FROM {{schema}}.[Transaction]
+    WHERE CardID BETWEEN ? AND ?
+    GROUP BY CardID
+"""
+
+BALANCE_QUERY = "SELECT CardID, Balance FROM Card WHERE CardID BETWEEN ? AND ?"
+
+# Ledger adjustment written only while the card's balance and hot ledger sum are
+# still those the mismatch was computed from: a tap, top-up or archive move since
+# then changes one of them, and the adjustment would be wrong
+GUARDED_ADJUSTMENT_INSERT = f"""
+    INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID)
+    SELECT 'Adjustment', ?, ?, CardID
+    FROM Card
+    WHERE CardID = ? AND ABS(Balance - ?) < ?
+      AND ABS((SELECT COALESCE(SUM(CASE WHEN TransactionType IN ({', '.join('?' * len(DEBIT_TYPES))})
+                                        THEN -Amount ELSE Amount END), 0)
+               FROM [Transaction] WHERE CardID = ?) - ?) < ?
+"""
+
+
+def open_readonly(db_path: str) -> sqlite3.Connection:
+    """Open a read-only connection so workers never take the write lock."""
+    return sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+
+
+def split_card_ranges(conn: sqlite3.Connection, parts: int) -> List[Tuple[int, int]]:
+    """
+    Split the CardID space into contiguous inclusive ranges
+    :param conn: Connection object
+    :param parts: number of ranges to produce
+    :return: list of (low, high) CardID ranges
+    """
+    low, high = conn.execute("SELECT MIN(CardID), MAX(CardID) FROM Card").fetchone()
+    if low is None:
+        return []
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def _ledger(conn: sqlite3.Connection, schema: str, low: int, high: int,
+            ledger: Dict[int, List[Any]]) -> None:
+    """Add one database's per-card sums and baseline flags for a CardID range into ledger."""
+    for card_id, total, has_issue in conn.execute(LEDGER_QUERY.format(schema=schema), (*DEBIT_TYPES, low, high)):
+        entry = ledger.setdefault(card_id, [0.0, False])
+        entry[0] += total or 0.0
+        entry[1] = entry[1] or bool(has_issue)
+
+
+def reconcile_range(db_path: str, card_range: Tuple[int, int],
+                    archive_paths: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Compare Card.Balance with the transaction ledger for one CardID range.
+
+    The ledger is summed per CardID over the hot table and every archived
+    month. Only cards whose ledger includes their opening 'Issue' credit
+    are compared; the others are counted as having no baseline, since a
+    ledger without the opening balance cannot say what the balance should be.
+
+    The archives are attached up front and the hot ledger, the archive sums
+    and the balances are all read in one read transaction, so a tap or an
+    archive move committing meanwhile cannot be counted twice or missed.
+    Past SQLite's attach limit the oldest months are summed beforehand; they
+    only change when a trip that started in them closes very late.
+    """
+    low, high = card_range
+    # Newest months last: they are the ones the archiver is still moving rows into
+    overflow, attached_paths = archive_paths[:-MAX_ATTACHED], archive_paths[-MAX_ATTACHED:]
+    ledger: Dict[int, List[Any]] = {}
+    for path in overflow:
+        conn = open_readonly(path)
+        try:
+            _ledger(conn, 'main', low, high, ledger)
+        finally:
+            conn.close()
+
+    conn = open_readonly(db_path)
+    try:
+        schemas = []
+        for index, path in enumerate(attached_paths):
+            schema = f"archived_{index}"
+            conn.execute("ATTACH DATABASE ? AS " + schema, (f"file:{os.path.abspath(path)}?mode=ro",))
+            schemas.append(schema)
+
+        conn.execute("BEGIN")
+        hot: Dict[int, List[Any]] = {}
+        _ledger(conn, 'main', low, high, hot)
+        for schema in schemas:
+            _ledger(conn, schema, low, high, ledger)
+        for card_id, (total, has_issue) in hot.items():
+            entry = ledger.setdefault(card_id, [0.0, False])
+            entry[0] += total
+            entry[1] = entry[1] or has_issue
+
+        cursor = conn.execute(BALANCE_QUERY, (low, high))
+        checked = no_baseline = 0
+        mismatches = []
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for card_id, balance in rows:
+                expected, has_baseline = ledger.get(card_id, (0.0, False))
+                if not has_baseline:
+                    no_baseline += 1
+                    continue
+                checked += 1
+                if abs(balance - expected) > TOLERANCE:
+                    mismatches.append({
+                        'CardID': card_id,
+                        'Balance': balance,
+                        'Expected': round(expected, 2),
+                        'Difference': round(balance - expected, 2),
+                        # What repair_ledger re-checks before adjusting
+                        'HotLedger': hot.get(card_id, (0.0,))[0]
+                    })
+        conn.rollback()
+        return {'db_path': db_path, 'range': card_range, 'checked': checked, 'no_baseline': no_baseline,
+                'mismatches': mismatches}
+    finally:
+        conn.close()
+
+
+def repair_balances(conn: sqlite3.Connection, mismatches: List[Dict[str, Any]]) -> int:
+    """Overwrite Card.Balance with the ledger balance for each mismatch (cards with a ledger baseline only)."""
+    repaired = 0
+    for start in range(0, len(mismatches), REPAIR_CHUNK_SIZE):
+        chunk = mismatches[start:start + REPAIR_CHUNK_SIZE]
+        with conn:
+            conn.executemany(
+                "UPDATE Card SET Balance = ? WHERE CardID = ? AND ABS(Balance - ?) < ?",
+                [(m['Expected'], m['CardID'], m['Balance'], TOLERANCE) for m in chunk]
+            )
+        repaired += len(chunk)
+    return repaired
+
+
+def repair_ledger(conn: sqlite3.Connection, mismatches: List[Dict[str, Any]]) -> int:
+    """
+    Write a signed 'Adjustment' transaction so the ledger matches Card.Balance.
+    Cards whose balance or hot ledger changed since reconciling are skipped;
+    the next run sees them afresh.
+    :return: number of adjustments written
+    """
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    repaired = 0
+    for start in range(0, len(mismatches), REPAIR_CHUNK_SIZE):
+        chunk = mismatches[start:start + REPAIR_CHUNK_SIZE]
+        with conn:
+            repaired += conn.executemany(
+                GUARDED_ADJUSTMENT_INSERT,
+                [(m['Difference'], now, m['CardID'], m['Balance'], TOLERANCE,
+                  *DEBIT_TYPES, m['CardID'], m['HotLedger'], TOLERANCE) for m in chunk]
+            ).rowcount
+    return repaired
+
+
+def run_reconciliation(db_path: str = DEFAULT_DB_PATH, workers: Optional[int] = None,
+                       repair: Optional[str] = None, archive_dir: str = DEFAULT_ARCHIVE_DIR,
+                       shard_paths: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Reconcile every card's balance against its transactions
+    :param db_path: database file
+    :param workers: number of worker processes (defaults to the CPU count)
+    :param repair: None to only report, 'balance' to fix Card.Balance,
+                   'ledger' to add Adjustment transactions
+    :param archive_dir: per-month archives whose transactions are part of the ledger
+    :param shard_paths: shard files to reconcile instead of db_path (each holds its cards'
+                        authoritative balances and their transactions)
+    :return: report with checked/no-baseline/mismatch/repaired counts and the mismatches
+    """
+    if repair not in (None, 'balance', 'ledger'):
+        raise ValueError(f"Unknown repair mode: {repair}")
+    workers = workers or os.cpu_count() or 1
+    archive_paths = [archive_path(archive_dir, *partition) for partition in list_partitions(archive_dir)]
+    databases = list(shard_paths) or [db_path]
+
+    started = datetime.now()
+    tasks: List[Tuple[str, Tuple[int, int]]] = []
+    for path in databases:
+        conn = open_readonly(path)
+        try:
+            # Several ranges per worker keeps the pool busy when card activity is skewed
+            tasks += [(path, card_range) for card_range in split_card_ranges(conn, workers * 4)]
+        finally:
+            conn.close()
+
+    checked = no_baseline = 0
+    mismatches: Dict[str, List[Dict[str, Any]]] = {path: [] for path in databases}
+    if workers == 1:
+        results = (reconcile_range(path, card_range, archive_paths) for path, card_range in tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(reconcile_range, [path for path, _ in tasks], [r for _, r in tasks],
+                               [archive_paths] * len(tasks))
+    for result in results:
+        checked += result['checked']
+        no_baseline += result['no_baseline']
+        mismatches[result['db_path']].extend(result['mismatches'])
+        logger.info(f"Reconciled cards {result['range'][0]}-{result['range'][1]} of {result['db_path']}: "
+                    f"{len(result['mismatches'])} mismatch(es), {result['no_baseline']} without a baseline")
+    if workers != 1:
+        executor.shutdown()
+
+    repaired = 0
+    if repair:
+        for path, found in mismatches.items():
+            conn = sqlite3.connect(path)
+            try:
+                repaired += repair_balances(conn, found) if repair == 'balance' else repair_ledger(conn, found)
+            finally:
+                conn.close()
+    mismatches = [mismatch for found in mismatches.values() for mismatch in found]
+
+    if no_baseline:
+        logger.warning(f"{no_baseline} card(s) have no opening 'Issue' transaction and were not checked")
+    report = {
+        'checked': checked,
+        'no_baseline': no_baseline,
+        'mismatch_count': len(mismatches),
+        'repaired': repaired,
+        'repair_mode': repair,
+        'elapsed_seconds': round((datetime.now() - started).total_seconds(), 3),
+        'mismatches': mismatches
+    }
+    logger.info(f"Reconciliation finished: {checked} cards checked, {no_baseline} without a baseline, "
+                f"{len(mismatches)} mismatch(es), {repaired} repaired")
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Reconcile Card.Balance against the Transaction ledger')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--repair', choices=['balance', 'ledger'], default=None,
+                        help='fix mismatches by rewriting balances or adding ledger adjustments')
+    parser.add_argument('--archive-dir', default=DEFAULT_ARCHIVE_DIR, help='directory of per-month archives')
+    parser.add_argument('--shard-dir', default=None,
+                        help='reconcile the card shards in this directory instead of the database')
+    args = parser.parse_args()
+
+    shard_files = sorted(glob.glob(os.path.join(args.shard_dir, 'metro_shard_*.db'))) if args.shard_dir else []
+    report = run_reconciliation(args.db, args.workers, args.repair, args.archive_dir, shard_files)
+    for mismatch in report['mismatches']:
+        print(f"Card {mismatch['CardID']}: balance {mismatch['Balance']:.2f}, "
+              f"ledger {mismatch['Expected']:.2f}, difference {mismatch['Difference']:.2f}")
+    if report['no_baseline']:
+        print(f"{report['no_baseline']} card(s) skipped: no opening 'Issue' transaction on the ledger")
+    sys.exit(1 if report['mismatch_count'] and not report['repaired'] else 0)
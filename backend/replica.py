@@ -0,0 +1,176 @@
+import sqlite3
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+MEMORY = ':memory:'
+
+
+class ReplicaManager:
+    """
+    Keeps a periodically refreshed, read-only copy of the database.
+
+    Refreshes use the sqlite3 online backup API in page steps. The source
+    connection holds one read transaction for the whole copy, so every
+    step reads the same WAL snapshot: writers are never blocked, and a
+    write landing mid-copy cannot restart the backup.
+    The copy is built next to the live replica and swapped in when
+    complete, so readers never see a half-copied database.
+
+    A client that wrote passes the time of its last write to usable(), so
+    its reads skip snapshots taken before that write and it always reads its
+    own writes; everyone else keeps reading the snapshot within max_staleness.
+    """
+
+    def __init__(self, source_path: str, replica_path: str = MEMORY, refresh_interval: float = 30.0,
+                 pages_per_step: int = 256, step_sleep: float = 0.005):
+        self.source_path = source_path
+        self.replica_path = replica_path
+        self.refresh_interval = refresh_interval
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # For in-memory replicas a holder connection keeps the shared-cache database alive
+        self._holder: Optional[sqlite3.Connection] = None
+        self._generation = 0
+        self._uri: Optional[str] = None
+
+        self.last_refresh: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.refresh_count = 0
+        self.page_count = 0
+
+    @property
+    def in_memory(self) -> bool:
+        return self.replica_path == MEMORY
+
+    @property
+    def available(self) -> bool:
+        return self._uri is not None
+
+    def lag(self) -> Optional[float]:
+        """Seconds since the snapshot currently served was taken."""
+        if self.last_refresh is None:
+            return None
+        return time.time() - self.last_refresh
+
+    def usable(self, max_staleness: float, written_at: float = 0.0) -> bool:
+        """
+        True if the current snapshot may serve a read
+        :param max_staleness: oldest acceptable snapshot, in seconds
+        :param written_at: epoch time of the reading client's last write (0 if it has none);
+                           snapshots taken before it are not used for that client
+        """
+        lag = self.lag()
+        return lag is not None and lag <= max_staleness and self.last_refresh >= written_at
+
+    def refresh(self) -> None:
+        """Copy the source database into a fresh replica and swap it in."""
+        with self._refresh_lock:
+            started = time.time()
+            generation = self._generation + 1
+            if self.in_memory:
+                uri = f"file:metro_replica_{id(self)}_{generation}?mode=memory&cache=shared"
+                target = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                tmp_path = f"{self.replica_path}.{generation}.tmp"
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                target = sqlite3.connect(tmp_path)
+
+            source = sqlite3.connect(f"file:{os.path.abspath(self.source_path)}?mode=ro", uri=True,
+                                     isolation_level=None)
+            try:
+                # Pin the snapshot: the backup reuses this read transaction for every step
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                source.backup(target, pages=self.pages_per_step, sleep=self.step_sleep)
+                pages = target.execute("PRAGMA page_count").fetchone()[0]
+            except sqlite3.Error as e:
+                self.last_error = str(e)
+                logger.error(f"Replica refresh failed: {e}")
+                target.close()
+                raise
+            finally:
+                source.close()
+
+            if self.in_memory:
+                new_uri = uri
+                old_holder = self._holder
+                self._holder = target
+            else:
+                target.close()
+                os.replace(tmp_path, self.replica_path)
+                new_uri = f"file:{os.path.abspath(self.replica_path)}?mode=ro"
+                old_holder = None
+
+            with self._lock:
+                self._uri = new_uri
+                self._generation = generation
+                self.last_refresh = started
+                self.last_duration = time.time() - started
+                self.last_error = None
+                self.refresh_count += 1
+                self.page_count = pages
+            if old_holder is not None:
+                # Readers still on the previous snapshot keep it alive until they close
+                old_holder.close()
+            logger.debug(f"Replica refreshed: {pages} pages in {self.last_duration:.3f}s")
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a read-only connection to the current replica snapshot."""
+        with self._lock:
+            uri = self._uri
+        if uri is None:
+            raise RuntimeError("Replica has not been refreshed yet")
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        if self.in_memory:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing replica: {e}")
+
+    def start(self) -> None:
+        """Start the background refresh thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='replica-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background refresh thread."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        lag = self.lag()
+        return {
+            'mode': 'memory' if self.in_memory else 'file',
+            'available': self.available,
+            'lag_seconds': round(lag, 3) if lag is not None else None,
+            'last_refresh': datetime.fromtimestamp(self.last_refresh).isoformat() if self.last_refresh else None,
+            'last_refresh_seconds': round(self.last_duration, 3) if self.last_duration is not None else None,
+            'refresh_interval_seconds': self.refresh_interval,
+            'refresh_count': self.refresh_count,
+            'page_count': self.page_count,
+            'last_error': self.last_error
+        }
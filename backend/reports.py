@@ -0,0 +1,253 @@
+import sqlite3
+import os
+import argparse
+import tempfile
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Sequence, Tuple
+
+from reconciliation import open_readonly, DEBIT_TYPES
+from replica import ReplicaManager
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+# Several ranges per worker keeps the pool busy when activity is skewed across rowids
+RANGES_PER_WORKER = 4
+# Card-scoped rows live in the shard files under sharding, which these queries do not read
+SHARDED_UNSUPPORTED = "Reports read project.db only and are not available with sharded storage (METRO_SHARDS)"
+
+MERGE_FUNCTIONS = {
+    'sum': lambda a, b: (a or 0) + (b or 0),
+    'min': lambda a, b: b if a is None else a if b is None else min(a, b),
+    'max': lambda a, b: b if a is None else a if b is None else max(a, b)
+}
+
+
+class ReportDefinition:
+    """
+    A report computed as partial aggregates over rowid ranges of one table.
+
+    query must select the key fields followed by the aggregate fields, in
+    declaration order, and take (low rowid, high rowid, start, end) as its
+    last four parameters. Aggregates merge with 'sum', 'min' or 'max';
+    ratios are derived after the merge so averages stay exact.
+    """
+
+    def __init__(self, name: str, description: str, table: str, query: str, keys: Sequence[str],
+                 aggregates: Dict[str, str], ratios: Optional[Dict[str, Tuple[str, str]]] = None,
+                 order_by: Optional[str] = None, params: Sequence[Any] = ()):
+        unknown = set(aggregates.values()) - set(MERGE_FUNCTIONS)
+        if unknown:
+            raise ValueError(f"Unknown merge function(s) in report {name}: {', '.join(unknown)}")
+        self.name = name
+        self.description = description
+        self.table = table
+        self.query = query
+        self.keys = tuple(keys)
+        self.aggregates = aggregates
+        self.ratios = ratios or {}
+        self.order_by = order_by
+        self.params = tuple(params)
+
+
+REPORTS = {report.name: report for report in [
+    ReportDefinition(
+        name='trips_per_passenger',
+        description='Trips taken and fares paid per passenger',
+        table='Trip',
+        query="""
+            SELECT p.PassengerID, p.FirstName, p.LastName,
+                   COUNT(t.TripID), SUM(COALESCE(t.FareAmount, 0)), MAX(t.EntryTime)
+            FROM Trip t
+            JOIN Card c ON t.CardID = c.CardID
+            JOIN Passenger p ON c.PassengerID = p.PassengerID
+            WHERE t.rowid BETWEEN ? AND ? AND t.EntryTime >= ? AND t.EntryTime < ?
+            GROUP BY p.PassengerID
+        """,
+        keys=('PassengerID', 'FirstName', 'LastName'),
+        aggregates={'TripCount': 'sum', 'TotalFare': 'sum', 'LastTrip': 'max'},
+        ratios={'AverageFare': ('TotalFare', 'TripCount')},
+        order_by='TripCount'
+    ),
+    ReportDefinition(
+        name='revenue_per_card_type',
+        description='Fare, penalty and debit revenue per card type',
+        table='[Transaction]',
+        query=f"""
+            SELECT COALESCE(ct.TypeName, 'Unknown'),
+                   COUNT(*), SUM(tx.Amount), MIN(tx.Amount), MAX(tx.Amount)
+            FROM [Transaction] tx
+            JOIN Card c ON tx.CardID = c.CardID
+            LEFT JOIN CardType ct ON c.CardTypeID = ct.CardTypeID
+            WHERE tx.TransactionType IN ({', '.join('?' * len(DEBIT_TYPES))})
+              AND tx.rowid BETWEEN ? AND ? AND tx.TransactionDate >= ? AND tx.TransactionDate < ?
+            GROUP BY ct.TypeName
+        """,
+        params=DEBIT_TYPES,
+        keys=('TypeName',),
+        aggregates={'Transactions': 'sum', 'Revenue': 'sum', 'SmallestCharge': 'min', 'LargestCharge': 'max'},
+        ratios={'AverageCharge': ('Revenue', 'Transactions')},
+        order_by='Revenue'
+    ),
+    ReportDefinition(
+        name='trips_per_station',
+        description='Entries, open trips and fares per entry station',
+        table='Trip',
+        query="""
+            SELECT t.EntryStationID, COALESCE(s.StationName, 'Unknown'),
+                   COUNT(*), SUM(t.ExitTime IS NULL), SUM(COALESCE(t.FareAmount, 0))
+            FROM Trip t
+            LEFT JOIN Station s ON t.EntryStationID = s.StationID
+            WHERE t.rowid BETWEEN ? AND ? AND t.EntryTime >= ? AND t.EntryTime < ?
+            GROUP BY t.EntryStationID
+        """,
+        keys=('StationID', 'StationName'),
+        aggregates={'Entries': 'sum', 'OpenTrips': 'sum', 'Revenue': 'sum'},
+        ratios={'AverageFare': ('Revenue', 'Entries')},
+        order_by='Entries'
+    )
+]}
+
+
+def split_rowid_ranges(conn: sqlite3.Connection, table: str, parts: int) -> List[Tuple[int, int]]:
+    """Split a table's rowid space into contiguous inclusive ranges."""
+    low, high = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+    if low is None:
+        return []
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def _aggregate(conn: sqlite3.Connection, report: ReportDefinition, rowid_range: Tuple[int, int],
+               start: str, end: str) -> List[tuple]:
+    return conn.execute(report.query, (*report.params, *rowid_range, start, end)).fetchall()
+
+
+def aggregate_range(db_path: str, report_name: str, rowid_range: Tuple[int, int],
+                    start: str, end: str) -> List[tuple]:
+    """Compute a report's partial aggregates for one rowid range on a read-only connection."""
+    conn = open_readonly(db_path)
+    try:
+        return _aggregate(conn, REPORTS[report_name], rowid_range, start, end)
+    finally:
+        conn.close()
+
+
+def merge_partials(report: ReportDefinition, partials: Sequence[Sequence[tuple]]) -> List[Dict[str, Any]]:
+    """Merge partial aggregate rows by key and derive the ratio fields."""
+    key_count = len(report.keys)
+    merges = [MERGE_FUNCTIONS[function] for function in report.aggregates.values()]
+    merged: Dict[tuple, list] = {}
+    for rows in partials:
+        for row in rows:
+            key, values = tuple(row[:key_count]), row[key_count:]
+            current = merged.get(key)
+            if current is None:
+                merged[key] = list(values)
+            else:
+                merged[key] = [merge(a, b) for merge, a, b in zip(merges, current, values)]
+
+    results = []
+    for key, values in merged.items():
+        result = dict(zip(report.keys, key))
+        result.update(zip(report.aggregates, values))
+        for name, (numerator, denominator) in report.ratios.items():
+            result[name] = round(result[numerator] / result[denominator], 2) if result[denominator] else None
+        for name, value in result.items():
+            if isinstance(value, float):
+                result[name] = round(value, 2)
+        results.append(result)
+    if report.order_by:
+        results.sort(key=lambda row: row[report.order_by] or 0, reverse=True)
+    return results
+
+
+def month_bounds(month: str) -> Tuple[str, str]:
+    """Return [start, end) timestamps for a 'YYYY-MM' month."""
+    year, month_number = (int(part) for part in month.split('-'))
+    next_year, next_month = (year + 1, 1) if month_number == 12 else (year, month_number + 1)
+    return f"{year:04d}-{month_number:02d}-01 00:00:00", f"{next_year:04d}-{next_month:02d}-01 00:00:00"
+
+
+def run_report(report_name: str, db_path: str = DEFAULT_DB_PATH, start: str = '0000', end: str = '9999',
+               workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run a report over [start, end)
+
+    Every range reads the same snapshot. With one worker the ranges run in
+    a single read transaction; with more, the database is first copied with
+    the online backup API (as the read replica is) and the workers read the
+    copy, since separate connections would each see a different state.
+    :param report_name: key in REPORTS
+    :param db_path: database file
+    :param start: inclusive lower time bound
+    :param end: exclusive upper time bound
+    :param workers: number of worker processes (defaults to the CPU count)
+    :return: report rows plus timing and range counts
+    :raises RuntimeError: with sharded storage enabled
+    """
+    if report_name not in REPORTS:
+        raise KeyError(f"Unknown report: {report_name}")
+    if int(os.environ.get('METRO_SHARDS', '0')) > 1:
+        raise RuntimeError(SHARDED_UNSUPPORTED)
+    report = REPORTS[report_name]
+    workers = workers or os.cpu_count() or 1
+
+    started = datetime.now()
+    if workers == 1:
+        conn = open_readonly(db_path)
+        try:
+            conn.execute("BEGIN")
+            ranges = split_rowid_ranges(conn, report.table, RANGES_PER_WORKER)
+            partials = [_aggregate(conn, report, r, start, end) for r in ranges]
+        finally:
+            conn.close()
+    else:
+        with tempfile.TemporaryDirectory(prefix='metro_report_') as snapshot_dir:
+            snapshot_path = os.path.join(snapshot_dir, 'snapshot.db')
+            ReplicaManager(db_path, snapshot_path).refresh()
+            conn = open_readonly(snapshot_path)
+            try:
+                ranges = split_rowid_ranges(conn, report.table, workers * RANGES_PER_WORKER)
+            finally:
+                conn.close()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(aggregate_range, snapshot_path, report_name, r, start, end)
+                           for r in ranges]
+                partials = [future.result() for future in as_completed(futures)]
+
+    rows = merge_partials(report, partials)
+    elapsed = round((datetime.now() - started).total_seconds(), 3)
+    logger.info(f"Report {report_name}: {len(rows)} row(s) from {len(ranges)} range(s) "
+                f"on {workers} worker(s) in {elapsed}s")
+    return {
+        'report': report_name,
+        'description': report.description,
+        'from': start,
+        'to': end,
+        'workers': workers,
+        'ranges': len(ranges),
+        'elapsed_seconds': elapsed,
+        'rows': rows
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Run an aggregate report over Trip/Transaction rowid ranges')
+    parser.add_argument('report', choices=sorted(REPORTS), help='report to run')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--month', default=None, help="restrict to one month, 'YYYY-MM'")
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    bounds = month_bounds(args.month) if args.month else ('0000', '9999')
+    try:
+        result = run_report(args.report, args.db, *bounds, workers=args.workers)
+    except RuntimeError as e:
+        parser.error(str(e))
+    for row in result['rows']:
+        print(', '.join(f"{key}={value}" for key, value in row.items()))
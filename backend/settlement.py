@@ -0,0 +1,331 @@
+import sqlite3
+import os
+import glob
+import argparse
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Any, Sequence
+
+from fare_windows import FareWindowResolver
+from station_graph import StationGraph
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, '..', 'project.db')
+DEFAULT_CHUNK_SIZE = 1000
+BUSY_TIMEOUT_SECONDS = 30
+
+SETTLEMENT_TABLES = {
+    'SettlementRun': """
+    CREATE TABLE IF NOT EXISTS SettlementRun (
+        RunID INTEGER PRIMARY KEY AUTOINCREMENT,
+        StartedAt TEXT NOT NULL,
+        FinishedAt TEXT,
+        MaxTripID INTEGER NOT NULL,
+        Shards INTEGER NOT NULL,
+        Status TEXT NOT NULL CHECK (Status IN ('Running', 'Completed'))
+    )""",
+
+    'SettlementShard': """
+    CREATE TABLE IF NOT EXISTS SettlementShard (
+        RunID INTEGER NOT NULL,
+        Shard INTEGER NOT NULL,
+        LastTripID INTEGER NOT NULL DEFAULT 0,
+        Settled INTEGER NOT NULL DEFAULT 0,
+        Unrated INTEGER NOT NULL DEFAULT 0,
+        AmountSettled REAL NOT NULL DEFAULT 0.0,
+        PRIMARY KEY (RunID, Shard),
+        FOREIGN KEY (RunID) REFERENCES SettlementRun(RunID)
+    )""",
+
+    # Closed trips neither a fare rule nor the station graph could price; skipped by
+    # later runs until cleared with retry_unrated
+    'SettlementUnrated': """
+    CREATE TABLE IF NOT EXISTS SettlementUnrated (
+        TripID INTEGER PRIMARY KEY,
+        RunID INTEGER NOT NULL,
+        FOREIGN KEY (RunID) REFERENCES SettlementRun(RunID)
+    )"""
+}
+
+UNSETTLED_QUERY = """
+    SELECT t.TripID, t.CardID, t.EntryTime, t.ExitTime, t.EntryStationID, t.ExitStationID,
+           COALESCE(ct.BaseFareMultiplier, 1.0)
+    FROM Trip t
+    JOIN Card c ON t.CardID = c.CardID
+    LEFT JOIN CardType ct ON c.CardTypeID = ct.CardTypeID
+    WHERE t.FareAmount IS NULL AND t.ExitTime IS NOT NULL
+      AND t.TripID > ? AND t.TripID <= ?
+      AND t.CardID % ? = ?
+      AND NOT EXISTS (SELECT 1 FROM SettlementUnrated u WHERE u.TripID = t.TripID)
+    ORDER BY t.TripID
+    LIMIT ?
+"""
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    for create_sql in SETTLEMENT_TABLES.values():
+        conn.execute(create_sql)
+    conn.commit()
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    # isolation_level=None so each chunk can open its own BEGIN IMMEDIATE transaction
+    return sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+
+
+def inferred_fares(conn: sqlite3.Connection) -> Callable[[int, Optional[int]], Optional[float]]:
+    """
+    Distance-based fares from the station graph, for station pairs without a fare rule
+    :param conn: Connection object
+    :return: lookup of the inferred fare by (entry, exit) station, None if unknown or unreachable
+    """
+    graph = StationGraph()
+    graph.refresh(conn)
+    matrix = graph.fare_matrix()
+    index = {station_id: i for i, station_id in enumerate(matrix['stationIds'])}
+    fares = matrix['fares']
+
+    def lookup(entry_station_id: int, exit_station_id: Optional[int]) -> Optional[float]:
+        if entry_station_id not in index or exit_station_id not in index:
+            return None
+        return fares[index[entry_station_id]][index[exit_station_id]]
+    return lookup
+
+
+def settle_chunk(conn: sqlite3.Connection, resolver: FareWindowResolver, run_id: int, shard: int,
+                 shards: int, max_trip_id: int, chunk_size: int,
+                 inferred: Optional[Callable[[int, Optional[int]], Optional[float]]] = None
+                 ) -> Optional[Dict[str, Any]]:
+    """
+    Rate and settle the next chunk of a shard in one write transaction.
+
+    Trips without a fare rule are charged the inferred distance fare; those
+    that cannot be priced either are recorded in SettlementUnrated. The
+    shard checkpoint is advanced in the same transaction as the Trip, Card
+    and Transaction writes, so a crash either keeps or loses the whole
+    chunk and a resumed run never charges a trip twice.
+    :return: chunk counts, or None when the shard is exhausted
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_trip_id = conn.execute(
+            "SELECT LastTripID FROM SettlementShard WHERE RunID = ? AND Shard = ?", (run_id, shard)
+        ).fetchone()[0]
+        rows = conn.execute(UNSETTLED_QUERY, (last_trip_id, max_trip_id, shards, shard, chunk_size)).fetchall()
+        if not rows:
+            conn.execute("COMMIT")
+            return None
+
+        rated = resolver.resolve(
+            [row[2] for row in rows],
+            [(row[4], row[5]) for row in rows],
+            [row[6] for row in rows]
+        )
+        trip_updates, transactions, unrated_trips = [], [], []
+        debits: Dict[int, float] = defaultdict(float)
+        inferred_count = 0
+        for row, fare in zip(rows, rated):
+            trip_id, card_id, exit_time = row[0], row[1], row[3]
+            amount = fare['FareAmount']
+            if amount is None and inferred is not None:
+                base = inferred(row[4], row[5])
+                if base is not None:
+                    amount = round(base * row[6], 2)
+                    inferred_count += 1
+            if amount is None:
+                unrated_trips.append((trip_id, run_id))
+                continue
+            trip_updates.append((amount, trip_id))
+            transactions.append(('Fare', amount, exit_time, card_id))
+            debits[card_id] += amount
+
+        conn.executemany("UPDATE Trip SET FareAmount = ? WHERE TripID = ?", trip_updates)
+        conn.executemany("UPDATE Card SET Balance = Balance - ? WHERE CardID = ?",
+                         [(round(amount, 2), card_id) for card_id, amount in debits.items()])
+        conn.executemany("""
+            INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID)
+            VALUES (?, ?, ?, ?)
+        """, transactions)
+        conn.executemany("INSERT OR IGNORE INTO SettlementUnrated (TripID, RunID) VALUES (?, ?)", unrated_trips)
+
+        amount = round(sum(debits.values()), 2)
+        unrated = len(unrated_trips)
+        conn.execute("""
+            UPDATE SettlementShard
+            SET LastTripID = ?, Settled = Settled + ?, Unrated = Unrated + ?, AmountSettled = AmountSettled + ?
+            WHERE RunID = ? AND Shard = ?
+        """, (rows[-1][0], len(trip_updates), unrated, amount, run_id, shard))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return {'settled': len(trip_updates), 'inferred': inferred_count, 'unrated': unrated, 'amount': amount,
+            'last_trip_id': rows[-1][0]}
+
+
+def settle_shard(conn: sqlite3.Connection, resolver: FareWindowResolver,
+                 inferred: Callable[[int, Optional[int]], Optional[float]], run_id: int, shard: int,
+                 shards: int, max_trip_id: int, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Settle every unsettled trip of one CardID shard of a run, chunk by chunk."""
+    totals = {'shard': shard, 'settled': 0, 'inferred': 0, 'unrated': 0, 'amount': 0.0, 'chunks': 0}
+    while True:
+        chunk = settle_chunk(conn, resolver, run_id, shard, shards, max_trip_id, chunk_size, inferred)
+        if chunk is None:
+            break
+        totals['chunks'] += 1
+        for key in ('settled', 'inferred', 'unrated'):
+            totals[key] += chunk[key]
+        totals['amount'] = round(totals['amount'] + chunk['amount'], 2)
+        logger.info(f"Shard {shard}: settled {chunk['settled']} trip(s) up to TripID {chunk['last_trip_id']}")
+    return totals
+
+
+def start_or_resume_run(conn: sqlite3.Connection, shards: int = 1) -> Dict[str, Any]:
+    """Return the unfinished run to resume, or register a new one bounded by the current max TripID."""
+    row = conn.execute("""
+        SELECT RunID, MaxTripID, Shards FROM SettlementRun
+        WHERE Status = 'Running' ORDER BY RunID DESC LIMIT 1
+    """).fetchone()
+    if row:
+        logger.info(f"Resuming settlement run {row[0]} ({row[2]} shards, up to TripID {row[1]})")
+        return {'run_id': row[0], 'max_trip_id': row[1], 'shards': row[2], 'resumed': True}
+
+    max_trip_id = conn.execute("SELECT COALESCE(MAX(TripID), 0) FROM Trip").fetchone()[0]
+    with conn:
+        run_id = conn.execute("""
+            INSERT INTO SettlementRun (StartedAt, MaxTripID, Shards, Status)
+            VALUES (?, ?, ?, 'Running')
+        """, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), max_trip_id, shards)).lastrowid
+        conn.executemany("INSERT INTO SettlementShard (RunID, Shard) VALUES (?, ?)",
+                         [(run_id, shard) for shard in range(shards)])
+    return {'run_id': run_id, 'max_trip_id': max_trip_id, 'shards': shards, 'resumed': False}
+
+
+def settle_database(db_path: str, config_path: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    retry_unrated: bool = False) -> Dict[str, Any]:
+    """
+    Run (or resume) settlement over one database file.
+
+    Chunks are settled one after another: every chunk writes under BEGIN
+    IMMEDIATE, so parallel workers on the same file would only queue on
+    the write lock. Runs left by older versions with several CardID
+    shards are resumed shard by shard.
+    :param db_path: project.db or one card shard
+    :param config_path: database holding the peak windows (defaults to db_path)
+    :param chunk_size: trips per write transaction
+    :param retry_unrated: forget trips earlier runs could not price, so they are rated again
+    :return: run summary for this database
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_SECONDS)
+    try:
+        ensure_schema(conn)
+        if retry_unrated:
+            with conn:
+                cleared = conn.execute("DELETE FROM SettlementUnrated").rowcount
+            logger.info(f"Cleared {cleared} unrated trip(s) in {db_path} for re-rating")
+        run = start_or_resume_run(conn)
+    finally:
+        conn.close()
+
+    resolver = FareWindowResolver()
+    config = sqlite3.connect(config_path or db_path, timeout=BUSY_TIMEOUT_SECONDS)
+    try:
+        resolver.ensure_schema(config)
+        resolver.load_config(config)
+    finally:
+        config.close()
+
+    run_id = run['run_id']
+    conn = connect(db_path)
+    try:
+        resolver.load_fares(conn)
+        inferred = inferred_fares(conn)
+        for shard in range(run['shards']):
+            settle_shard(conn, resolver, inferred, run_id, shard, run['shards'], run['max_trip_id'], chunk_size)
+        conn.execute("UPDATE SettlementRun SET Status = 'Completed', FinishedAt = ? WHERE RunID = ?",
+                     (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), run_id))
+        # Totals include chunks committed before a crash of a resumed run
+        settled, unrated, amount = conn.execute("""
+            SELECT SUM(Settled), SUM(Unrated), SUM(AmountSettled) FROM SettlementShard WHERE RunID = ?
+        """, (run_id,)).fetchone()
+    finally:
+        conn.close()
+
+    summary = {
+        'db_path': db_path,
+        'run_id': run_id,
+        'resumed': run['resumed'],
+        'settled': settled or 0,
+        'unrated': unrated or 0,
+        'amount': round(amount or 0.0, 2)
+    }
+    logger.info(f"Settlement run {run_id} of {db_path} completed: {summary['settled']} trip(s) settled, "
+                f"{summary['unrated']} unrated, {summary['amount']:.2f} debited")
+    return summary
+
+
+def run_settlement(db_path: str = DEFAULT_DB_PATH, workers: Optional[int] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   shard_paths: Sequence[str] = (), retry_unrated: bool = False) -> Dict[str, Any]:
+    """
+    Settle every closed trip without a fare
+    :param db_path: database file (and the peak-window configuration when shards are settled)
+    :param workers: worker processes for the shard fan-out (defaults to one per shard file)
+    :param chunk_size: trips per write transaction
+    :param progress: optional callback receiving each finished database's summary
+    :param shard_paths: card shard files to settle instead of db_path, one process each
+    :param retry_unrated: re-rate trips earlier runs recorded as unrated
+    :return: run summary
+    """
+    databases = list(shard_paths) or [db_path]
+    results: List[Dict[str, Any]] = []
+    if len(databases) == 1:
+        results.append(settle_database(databases[0], db_path, chunk_size, retry_unrated))
+        if progress:
+            progress(results[-1])
+    else:
+        # Each shard file has its own write lock, so here processes do run in parallel
+        with ProcessPoolExecutor(max_workers=workers or len(databases)) as executor:
+            futures = [executor.submit(settle_database, path, db_path, chunk_size, retry_unrated)
+                       for path in databases]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if progress:
+                    progress(results[-1])
+
+    summary = {
+        'databases': len(databases),
+        'runs': {result['db_path']: result['run_id'] for result in results},
+        'resumed': any(result['resumed'] for result in results),
+        'settled': sum(result['settled'] for result in results),
+        'unrated': sum(result['unrated'] for result in results),
+        'amount': round(sum(result['amount'] for result in results), 2)
+    }
+    logger.info(f"Settlement completed: {summary['settled']} trip(s) settled, "
+                f"{summary['unrated']} unrated, {summary['amount']:.2f} debited")
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Settle fares for closed trips and debit card balances')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--shard-dir', default=None,
+                        help='settle the card shards in this directory instead of the database')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes for the shard fan-out (default: one per shard)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='trips per transaction')
+    parser.add_argument('--retry-unrated', action='store_true',
+                        help='re-rate trips earlier runs could not price (e.g. after adding fare rules)')
+    args = parser.parse_args()
+
+    shard_files = sorted(glob.glob(os.path.join(args.shard_dir, 'metro_shard_*.db'))) if args.shard_dir else []
+    run_settlement(args.db, args.workers, args.chunk_size,
+                   progress=lambda result: print(f"{result['db_path']} done: {result['settled']} settled, "
+                                                 f"{result['unrated']} unrated, {result['amount']:.2f} debited"),
+                   shard_paths=shard_files, retry_unrated=args.retry_unrated)
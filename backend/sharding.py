@@ -0,0 +1,256 @@
+import sqlite3
+import os
+import zlib
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import Dict, List, Optional, Sequence, Any
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SHARD_DIR = os.path.join(BASE_DIR, '..', 'shards')
+BUSY_TIMEOUT_SECONDS = 5
+
+# Card-scoped tables live in exactly one shard, chosen by CardID
+SHARDED_TABLES = ('Card', 'Trip', 'Transaction')
+# Small, rarely written tables copied into every shard so shard queries can join locally
+REFERENCE_TABLES = ('CardType', 'Passenger', 'Station', 'FareRule', 'StationLink')
+
+# Each shard numbers its trips and transactions from its own block so IDs stay
+# unique across shards; block 0 is left to rows migrated from project.db
+ID_BLOCK = 10 ** 12
+
+
+def shard_for(card_id: int, shards: int) -> int:
+    """Return the shard holding a card; crc32 spreads sequential IDs evenly."""
+    return zlib.crc32(int(card_id).to_bytes(8, 'little')) % shards
+
+
+class ShardedStore:
+    """
+    Optional hash-sharded storage for Card, Trip and [Transaction].
+
+    Each shard is a separate SQLite file with its own write lock, so writes
+    for cards on different shards no longer queue behind one another.
+    Card rows in project.db remain the card directory (ID allocation,
+    card number uniqueness, passenger lookups); the shard copy holds the
+    authoritative balance. Reads spanning cards are scattered to every
+    shard on a thread pool and merged on the list's order column.
+    """
+
+    def __init__(self, db_path: str, shards: int, shard_dir: str = DEFAULT_SHARD_DIR,
+                 max_workers: Optional[int] = None):
+        if shards < 2:
+            raise ValueError(f"Sharded storage needs at least 2 shards, got {shards}")
+        self.db_path = db_path
+        self.shards = shards
+        self.shard_dir = shard_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or shards, thread_name_prefix='shard')
+
+    def shard_path(self, shard: int) -> str:
+        return os.path.join(self.shard_dir, f"metro_shard_{shard:02d}.db")
+
+    def shard_for(self, card_id: int) -> int:
+        return shard_for(card_id, self.shards)
+
+    def connect(self, shard: int) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.shard_path(shard), timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect_for_card(self, card_id: int) -> sqlite3.Connection:
+        return self.connect(self.shard_for(card_id))
+
+    def _attach_main(self, conn: sqlite3.Connection) -> None:
+        conn.execute("ATTACH DATABASE ? AS src", (f"file:{os.path.abspath(self.db_path)}?mode=ro",))
+
+    # ==================== Setup ====================
+
+    def ensure_schema(self) -> None:
+        """Create every shard with the tables and indexes of project.db (triggers excluded)."""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        main = sqlite3.connect(self.db_path)
+        try:
+            tables = SHARDED_TABLES + REFERENCE_TABLES
+            placeholders = ', '.join('?' * len(tables))
+            schema = main.execute(f"""
+                SELECT type, name, sql FROM sqlite_master
+                WHERE tbl_name IN ({placeholders}) AND type IN ('table', 'index') AND sql IS NOT NULL
+                ORDER BY type DESC
+            """, tables).fetchall()
+        finally:
+            main.close()
+
+        for shard in range(self.shards):
+            conn = self.connect(shard)
+            try:
+                with conn:
+                    # sqlite_master keeps the statement without IF NOT EXISTS
+                    for kind, _, create_sql in schema:
+                        prefix = f"CREATE {kind.upper()} "
+                        conn.execute(create_sql.replace(prefix, prefix + "IF NOT EXISTS ", 1))
+                    # Indexes since dropped from project.db go from the shard too
+                    kept = {name for kind, name, _ in schema if kind == 'index'}
+                    for (name,) in conn.execute(f"""
+                        SELECT name FROM sqlite_master
+                        WHERE tbl_name IN ({placeholders}) AND type = 'index' AND sql IS NOT NULL
+                    """, tables).fetchall():
+                        if name not in kept:
+                            conn.execute(f"DROP INDEX IF EXISTS [{name}]")
+                    # Start this shard's TripID/TransactionID block
+                    for table in ('Trip', 'Transaction'):
+                        conn.execute("""
+                            INSERT INTO sqlite_sequence (name, seq)
+                            SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                        """, (table, (shard + 1) * ID_BLOCK, table))
+            finally:
+                conn.close()
+
+    def replicate_reference(self, tables: Sequence[str] = REFERENCE_TABLES) -> None:
+        """Copy reference tables from project.db into every shard."""
+        for shard in range(self.shards):
+            conn = self.connect(shard)
+            try:
+                self._attach_main(conn)
+                with conn:
+                    for table in tables:
+                        conn.execute(f"DELETE FROM main.{table}")
+                        conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+                conn.execute("DETACH DATABASE src")
+            finally:
+                conn.close()
+
+    def upsert_reference(self, table: str, key: str, low: int, high: Optional[int] = None) -> None:
+        """
+        Copy a key range of one reference table from project.db into every shard,
+        e.g. the rows a request just added, without rewriting the whole table
+        :param table: reference table
+        :param key: its integer primary key column
+        :param low: first key to copy
+        :param high: last key to copy (None for no upper bound)
+        """
+        if table not in REFERENCE_TABLES:
+            raise ValueError(f"{table} is not a reference table")
+        for shard in range(self.shards):
+            conn = self.connect(shard)
+            try:
+                self._attach_main(conn)
+                with conn:
+                    conn.execute(f"""
+                        INSERT OR REPLACE INTO main.{table}
+                        SELECT * FROM src.{table} WHERE {key} >= ? AND (? IS NULL OR {key} <= ?)
+                    """, (low, high, high))
+                conn.execute("DETACH DATABASE src")
+            finally:
+                conn.close()
+
+    def migrate(self) -> Dict[str, int]:
+        """
+        Move card-scoped rows from project.db into their shards.
+
+        Cards are copied (project.db keeps them as the directory); trips and
+        transactions are removed from project.db once every shard holds them.
+        Copies use INSERT OR IGNORE on the primary key, so an interrupted
+        migration is finished by the next run.
+        :return: number of trips and transactions moved
+        """
+        main = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS)
+        try:
+            # Bound the move so rows written during the migration are left for the next run
+            trips, max_trip_id, transactions, max_transaction_id = main.execute("""
+                SELECT (SELECT COUNT(*) FROM Trip), (SELECT COALESCE(MAX(TripID), 0) FROM Trip),
+                       (SELECT COUNT(*) FROM [Transaction]),
+                       (SELECT COALESCE(MAX(TransactionID), 0) FROM [Transaction])
+            """).fetchone()
+        finally:
+            main.close()
+        bounds = {'Card': ('CardID', None), 'Trip': ('TripID', max_trip_id),
+                  'Transaction': ('TransactionID', max_transaction_id)}
+
+        for shard in range(self.shards):
+            conn = self.connect(shard)
+            try:
+                conn.create_function('metro_shard', 1, lambda card_id: self.shard_for(card_id or 0),
+                                     deterministic=True)
+                self._attach_main(conn)
+                with conn:
+                    for table in SHARDED_TABLES:
+                        key, bound = bounds[table]
+                        conn.execute(f"""
+                            INSERT OR IGNORE INTO main.[{table}]
+                            SELECT * FROM src.[{table}] WHERE metro_shard(CardID) = ? AND (? IS NULL OR {key} <= ?)
+                        """, (shard, bound, bound))
+                conn.execute("DETACH DATABASE src")
+            finally:
+                conn.close()
+
+        if trips or transactions:
+            main = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS)
+            try:
+                with main:
+                    main.execute("DELETE FROM Trip WHERE TripID <= ?", (max_trip_id,))
+                    main.execute("DELETE FROM [Transaction] WHERE TransactionID <= ?", (max_transaction_id,))
+            finally:
+                main.close()
+            logger.info(f"Moved {trips} trip(s) and {transactions} transaction(s) into {self.shards} shards")
+        return {'trips': trips, 'transactions': transactions}
+
+    # ==================== Writes ====================
+
+    def execute(self, card_id: int, query: str, params: Sequence[Any] = ()) -> int:
+        """Run a write on the card's shard and return lastrowid."""
+        conn = self.connect_for_card(card_id)
+        try:
+            with conn:
+                return conn.execute(query, params).lastrowid
+        finally:
+            conn.close()
+
+    # ==================== Scatter-gather reads ====================
+
+    def _read_shard(self, shard: int, query: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+        conn = self.connect(shard)
+        try:
+            return [dict(row) for row in conn.execute(query, params)]
+        finally:
+            conn.close()
+
+    def scatter(self, query: str, params: Sequence[Any] = (), order_fields: Sequence[str] = (),
+                descending: bool = False, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Run query on every shard in parallel
+        :param query: SELECT to run unchanged on each shard (ordered by order_fields when given)
+        :param order_fields: result columns the per-shard results are merge-sorted on
+        :param descending: merge newest/highest first
+        :param limit: return at most this many rows (each shard is limited before the merge)
+        :return: merged rows
+        """
+        if limit is not None:
+            query += f"\nLIMIT {int(limit)}"
+        results = list(self._executor.map(lambda shard: self._read_shard(shard, query, params), range(self.shards)))
+        if not order_fields:
+            rows = [row for rows in results for row in rows]
+        else:
+            key = lambda row: tuple(row[field] for field in order_fields)
+            rows = list(heapq.merge(*results, key=key, reverse=descending))
+        return rows if limit is None else rows[:limit]
+
+    def count(self, query: str, params: Sequence[Any] = ()) -> int:
+        """Sum a COUNT(*) AS total query over every shard."""
+        return sum(row['total'] for row in self.scatter(query, params))
+
+    def status(self) -> Dict[str, Any]:
+        shards = []
+        for shard in range(self.shards):
+            path = self.shard_path(shard)
+            shards.append({
+                'shard': shard,
+                'path': os.path.abspath(path),
+                'size_bytes': os.path.getsize(path) if os.path.exists(path) else 0
+            })
+        return {'shards': self.shards, 'files': shards}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
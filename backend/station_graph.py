@@ -0,0 +1,232 @@
+import sqlite3
+import math
+import logging
+import threading
+from typing import Dict, List, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+INF = math.inf
+# Used when no FareRule overlaps a linked path to derive a per-km rate from
+DEFAULT_RATE_PER_KM = 8.0
+MINIMUM_FARE = 10.0
+
+# Bumped by triggers on every write to the tables the cached matrices are built from,
+# so any edit (including a swap that keeps counts and sums) triggers a rebuild
+GRAPH_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS StationGraphVersion (
+    Source TEXT PRIMARY KEY,
+    Version INTEGER NOT NULL DEFAULT 0
+)"""
+
+# Source table -> version row it bumps
+VERSIONED_TABLES = {'Station': 'graph', 'StationLink': 'graph', 'FareRule': 'fares'}
+
+VERSION_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS trg_graph_version_{table}_{operation_name}
+    AFTER {operation} ON {table}
+    BEGIN
+        UPDATE StationGraphVersion SET Version = Version + 1 WHERE Source = '{source}';
+    END"""
+
+VERSION_QUERY = "SELECT Source, Version FROM StationGraphVersion"
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the version table and the triggers that bump it."""
+    conn.execute(GRAPH_VERSION_TABLE)
+    conn.executemany("INSERT OR IGNORE INTO StationGraphVersion (Source) VALUES (?)",
+                     [(source,) for source in set(VERSIONED_TABLES.values())])
+    for table, source in VERSIONED_TABLES.items():
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(VERSION_TRIGGER.format(table=table, operation=operation,
+                                                operation_name=operation.lower(), source=source))
+    conn.commit()
+
+
+def floyd_warshall(dist: List[List[float]], nxt: List[List[int]]) -> None:
+    """
+    All-pairs shortest paths in place.
+
+    Each relaxation step updates a whole row with one list comprehension
+    instead of an inner Python loop per cell.
+    """
+    n = len(dist)
+    for k in range(n):
+        row_k = dist[k]
+        for i in range(n):
+            d_ik = dist[i][k]
+            if d_ik == INF or i == k:
+                continue
+            row_i = dist[i]
+            via_k = [d_ik + d_kj for d_kj in row_k]
+            improved = [j for j in range(n) if via_k[j] < row_i[j]]
+            if improved:
+                next_ik = nxt[i][k]
+                next_i = nxt[i]
+                for j in improved:
+                    row_i[j] = via_k[j]
+                    next_i[j] = next_ik
+
+
+class StationGraph:
+    """
+    Station adjacency model with a cached all-pairs distance/hop matrix.
+
+    The dense matrices are rebuilt only when the Station or StationLink
+    tables change, detected through the trigger-maintained version row.
+    Without the version table (ensure_schema not run) every refresh rebuilds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._graph_version: Optional[int] = None
+        self._fare_version: Optional[int] = None
+        self._index: Dict[int, int] = {}
+        self._stations: List[Dict[str, Any]] = []
+        self._dist: List[List[float]] = []
+        self._next: List[List[int]] = []
+        self._hops: List[List[int]] = []
+        self._rules: Dict[Tuple[int, int], Dict[str, float]] = {}
+        self.rate_per_km = DEFAULT_RATE_PER_KM
+        self.rebuild_count = 0
+
+    def _rebuild_graph(self, conn: sqlite3.Connection) -> None:
+        """Recompute the distance, next-hop and hop-count matrices (caller holds the lock)."""
+        stations = [
+            {'StationID': row[0], 'StationName': row[1], 'LineColor': row[2]}
+            for row in conn.execute("SELECT StationID, StationName, LineColor FROM Station ORDER BY StationID")
+        ]
+        index = {station['StationID']: i for i, station in enumerate(stations)}
+        n = len(stations)
+        dist = [[INF] * n for _ in range(n)]
+        nxt = [[-1] * n for _ in range(n)]
+        for i in range(n):
+            dist[i][i] = 0.0
+            nxt[i][i] = i
+
+        for from_id, to_id, distance in conn.execute(
+                "SELECT FromStationID, ToStationID, DistanceKm FROM StationLink"):
+            if from_id not in index or to_id not in index:
+                continue
+            a, b = index[from_id], index[to_id]
+            # Links are bidirectional; keep the shortest if duplicated
+            if distance < dist[a][b]:
+                dist[a][b] = dist[b][a] = distance
+                nxt[a][b], nxt[b][a] = b, a
+
+        floyd_warshall(dist, nxt)
+
+        hops = [[-1] * n for _ in range(n)]
+        for i in range(n):
+            for j in range(n):
+                if nxt[i][j] == -1:
+                    continue
+                count, node = 0, i
+                while node != j:
+                    node = nxt[node][j]
+                    count += 1
+                hops[i][j] = count
+
+        self._stations, self._index = stations, index
+        self._dist, self._next, self._hops = dist, nxt, hops
+        self.rebuild_count += 1
+        logger.info(f"Rebuilt station graph: {n} stations")
+
+    def _rebuild_fares(self, conn: sqlite3.Connection) -> None:
+        """Load explicit fare rules and derive the per-km rate from them (caller holds the lock)."""
+        rules: Dict[Tuple[int, int], Dict[str, float]] = {}
+        for start, end, fare_type, amount in conn.execute(
+                "SELECT StartStationID, EndStationID, FareType, FareAmount FROM FareRule"):
+            rules.setdefault((start, end), {})[fare_type or 'Anytime'] = amount
+
+        rates = []
+        for (start, end), fares in rules.items():
+            distance = self._distance(start, end)
+            if distance and distance != INF:
+                rates.extend(amount / distance for amount in fares.values())
+        rates.sort()
+        self.rate_per_km = rates[len(rates) // 2] if rates else DEFAULT_RATE_PER_KM
+        self._rules = rules
+
+    def refresh(self, conn: sqlite3.Connection) -> bool:
+        """
+        Rebuild the cached matrices if stations, links or fare rules changed
+        :param conn: Connection object
+        :return: True if the graph was rebuilt
+        """
+        try:
+            versions = dict(conn.execute(VERSION_QUERY).fetchall())
+        except sqlite3.OperationalError:
+            versions = {}
+        graph_version, fare_version = versions.get('graph'), versions.get('fares')
+        with self._lock:
+            rebuilt = graph_version is None or graph_version != self._graph_version
+            if rebuilt:
+                self._rebuild_graph(conn)
+                self._graph_version = graph_version
+            if rebuilt or fare_version is None or fare_version != self._fare_version:
+                self._rebuild_fares(conn)
+                self._fare_version = fare_version
+        return rebuilt
+
+    def _distance(self, from_id: int, to_id: int) -> Optional[float]:
+        if from_id not in self._index or to_id not in self._index:
+            return None
+        return self._dist[self._index[from_id]][self._index[to_id]]
+
+    def distance(self, from_id: int, to_id: int) -> Optional[float]:
+        """Shortest network distance in km, or None if either station is unknown or unreachable."""
+        with self._lock:
+            distance = self._distance(from_id, to_id)
+        return None if distance is None or distance == INF else distance
+
+    def _inferred_fare(self, distance: float) -> float:
+        return round(max(MINIMUM_FARE, distance * self.rate_per_km), 2)
+
+    def plan(self, from_id: int, to_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Plan the shortest route between two stations
+        :return: route details, or None if either station is unknown
+        """
+        with self._lock:
+            if from_id not in self._index or to_id not in self._index:
+                return None
+            a, b = self._index[from_id], self._index[to_id]
+            distance = self._dist[a][b]
+            if distance == INF:
+                return {'from': from_id, 'to': to_id, 'reachable': False}
+
+            path, node = [self._stations[a]], a
+            while node != b:
+                node = self._next[node][b]
+                path.append(self._stations[node])
+
+            # An explicit rule in either direction wins over the distance-based fare
+            rules = self._rules.get((from_id, to_id)) or self._rules.get((to_id, from_id))
+            if rules:
+                fares, source = dict(rules), 'rule'
+            else:
+                fares, source = {'Anytime': self._inferred_fare(distance)}, 'distance'
+
+            return {
+                'from': from_id,
+                'to': to_id,
+                'reachable': True,
+                'hops': self._hops[a][b],
+                'distanceKm': round(distance, 3),
+                'path': path,
+                'fares': fares,
+                'fareSource': source,
+                'ratePerKm': round(self.rate_per_km, 4)
+            }
+
+    def fare_matrix(self) -> Dict[str, Any]:
+        """Return the dense hop and inferred-fare matrices for every station pair."""
+        with self._lock:
+            ids = [station['StationID'] for station in self._stations]
+            fares = [
+                [None if d == INF else (0.0 if d == 0 else self._inferred_fare(d)) for d in row]
+                for row in self._dist
+            ]
+            return {'stationIds': ids, 'hops': [list(row) for row in self._hops], 'fares': fares}
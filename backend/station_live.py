@@ -0,0 +1,227 @@
+import sqlite3
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+OPEN_BY_STATION_QUERY = """
+    SELECT EntryStationID AS StationID, COUNT(*) AS OpenTrips FROM Trip INDEXED BY idx_trip_open
+    WHERE ExitTime IS NULL
+    GROUP BY EntryStationID
+"""
+
+ENTRY, EXIT = 0, 1
+
+
+class StationLiveCounters:
+    """
+    In-memory per-station occupancy and flow counters fed by the trip write path.
+
+    Open-trip counts go up on every accepted gate entry and down at the entry
+    station when an exit closes its trip, and are reset from the database by a
+    reconcile thread, which also corrects whatever the write path does not see
+    (sweeper closes, out-of-band writes). Entry and exit taps
+    go into a ring of time buckets covering the sliding window, with running
+    per-station totals, so a read costs O(stations) however busy the window was.
+    """
+
+    def __init__(self, db_path: str, window_seconds: int = 300, bucket_seconds: int = 5,
+                 reconcile_interval: float = 60.0, open_counts: Optional[Callable[[], Dict[int, int]]] = None):
+        self.db_path = db_path
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.reconcile_interval = reconcile_interval
+        self._load_open_counts = open_counts or self._db_open_counts
+
+        self._bucket_count = max(1, window_seconds // bucket_seconds)
+        self._buckets: List[Optional[Tuple[int, Dict[int, List[int]]]]] = [None] * self._bucket_count
+        self._totals: Dict[int, List[int]] = defaultdict(lambda: [0, 0])
+        self._expired_through = self._bucket_now() - self._bucket_count
+        self._started = time.time()
+
+        self._open: Dict[int, int] = defaultdict(int)
+        self._names: Dict[int, str] = {}
+        self._version = 0
+        self._cond = threading.Condition()
+        self._reconcile_now = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_reconciled: Optional[str] = None
+        self.last_drift = 0
+
+    def _bucket_now(self) -> int:
+        return int(time.time() // self.bucket_seconds)
+
+    def _expire(self, current: int) -> None:
+        """Subtract buckets that left the window from the running totals (caller holds the lock)."""
+        cutoff = current - self._bucket_count
+        # After a long idle gap one pass over the ring is enough; a slot may hold an older index than
+        # the one visited, so anything at or before the cutoff goes
+        for index in range(max(self._expired_through + 1, cutoff - self._bucket_count + 1), cutoff + 1):
+            slot = self._buckets[index % self._bucket_count]
+            if slot is not None and slot[0] <= cutoff:
+                for station_id, (entries, exits) in slot[1].items():
+                    totals = self._totals[station_id]
+                    totals[ENTRY] -= entries
+                    totals[EXIT] -= exits
+                self._buckets[index % self._bucket_count] = None
+        self._expired_through = max(self._expired_through, cutoff)
+
+    # ==================== Write path ====================
+
+    def record_tap(self, station_id: int, direction: str, opened: bool = False,
+                   closed_station: Optional[int] = None) -> None:
+        """
+        Count an accepted gate tap
+        :param station_id: station of the tap
+        :param direction: 'entry' or 'exit'
+        :param opened: the tap left an open trip (an entry without an exit time)
+        :param closed_station: entry station of the open trip the tap closed, if any
+        """
+        index = EXIT if direction == 'exit' else ENTRY
+        current = self._bucket_now()
+        with self._cond:
+            self._expire(current)
+            slot = self._buckets[current % self._bucket_count]
+            if slot is None or slot[0] != current:
+                slot = (current, defaultdict(lambda: [0, 0]))
+                self._buckets[current % self._bucket_count] = slot
+            slot[1][station_id][index] += 1
+            self._totals[station_id][index] += 1
+            if opened:
+                self._open[station_id] += 1
+            if closed_station is not None:
+                self._close(closed_station)
+            self._version += 1
+            self._cond.notify_all()
+
+    def record_close(self, station_id: int) -> None:
+        """
+        Count an open trip closed after its exit tap was counted (a journaled exit once it is applied)
+        :param station_id: entry station of the closed trip
+        """
+        with self._cond:
+            self._close(station_id)
+            self._version += 1
+            self._cond.notify_all()
+
+    def _close(self, station_id: int) -> None:
+        """Take one open trip off a station (caller holds the lock); the next reconcile fixes any drift."""
+        if self._open.get(station_id, 0) > 0:
+            self._open[station_id] -= 1
+
+    # ==================== Reconcile ====================
+
+    def _db_open_counts(self) -> Dict[int, int]:
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            return {station_id: count for station_id, count in conn.execute(OPEN_BY_STATION_QUERY)}
+        finally:
+            conn.close()
+
+    def reconcile(self) -> int:
+        """
+        Reset open-trip counts and station names from the database
+        :return: total absolute drift that was corrected
+        """
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            names = {station_id: name for station_id, name in
+                     conn.execute("SELECT StationID, StationName FROM Station")}
+        finally:
+            conn.close()
+        counts = self._load_open_counts()
+        with self._cond:
+            stations = set(counts) | set(self._open)
+            drift = sum(abs(counts.get(station_id, 0) - self._open.get(station_id, 0)) for station_id in stations)
+            self._open = defaultdict(int, counts)
+            self._names = names
+            self._version += 1
+            self._cond.notify_all()
+        self.last_reconciled = datetime.now().isoformat()
+        self.last_drift = drift
+        if drift:
+            logger.info(f"Station live counters reconciled; corrected drift of {drift} open trip(s)")
+        return drift
+
+    def request_reconcile(self) -> None:
+        """Ask the reconcile thread for an early pass, e.g. after the sweeper closed trips."""
+        self._reconcile_now.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._reconcile_now.wait(self.reconcile_interval)
+            self._reconcile_now.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.reconcile()
+            except sqlite3.Error as e:
+                logger.error(f"Error reconciling station live counters: {e}")
+
+    def start(self) -> None:
+        """Load the initial counts and start the reconcile thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self.reconcile()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='station-live', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._reconcile_now.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    # ==================== Reads ====================
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Open trips and windowed entry/exit counts and rates per station."""
+        with self._cond:
+            self._expire(self._bucket_now())
+            station_ids = sorted(set(self._names) | set(self._open) | set(self._totals))
+            rows = [(station_id, self._names.get(station_id), self._open.get(station_id, 0),
+                     *self._totals.get(station_id, (0, 0))) for station_id in station_ids]
+            version = self._version
+        # Until a full window has passed the rates cover only the time since start
+        minutes = min(self.window_seconds, max(time.time() - self._started, self.bucket_seconds)) / 60
+        stations = [{
+            'StationID': station_id,
+            'StationName': name,
+            'OpenTrips': open_trips,
+            'Entries': entries,
+            'Exits': exits,
+            'EntriesPerMinute': round(entries / minutes, 2),
+            'ExitsPerMinute': round(exits / minutes, 2)
+        } for station_id, name, open_trips, entries, exits in rows]
+        return {
+            'stations': stations,
+            'totalOpen': sum(station['OpenTrips'] for station in stations),
+            'windowSeconds': self.window_seconds,
+            'version': version,
+            'lastReconciled': self.last_reconciled,
+            'lastDrift': self.last_drift,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def stream(self, interval: float = 1.0, heartbeat: float = 15.0) -> Iterator[str]:
+        """Yield a snapshot event whenever the counters change (at most every interval), else every heartbeat."""
+        yield "retry: 3000\n\n"
+        version = None
+        while not self._stop.is_set():
+            with self._cond:
+                if self._version == version:
+                    self._cond.wait(heartbeat)
+            snapshot = self.snapshot()
+            version = snapshot['version']
+            yield f"id: {version}\nevent: stations\ndata: {json.dumps(snapshot)}\n\n"
+            self._stop.wait(interval)
@@ -0,0 +1,171 @@
+import sqlite3
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+ACCEPT = 'accept'
+DUPLICATE = 'duplicate'
+PASSBACK = 'passback'
+
+# Placeholder stored for a tap that was admitted but whose trip is not written yet
+PENDING = -1
+# Sentinel for _decide: the card's open trip has not been read from the database
+_NOT_LOOKED_UP = object()
+
+OPEN_TRIP_QUERY = """
+    SELECT TripID FROM Trip
+    WHERE CardID = ? AND ExitTime IS NULL
+    ORDER BY EntryTime DESC
+    LIMIT 1
+"""
+
+
+class TapFilter:
+    """
+    Debounces repeated taps and enforces anti-passback in front of trip writes.
+
+    Recent taps are kept in a TTL/LRU map keyed by (CardID, StationID,
+    direction); a repeat within the window is a duplicate. Open-trip state
+    per card is cached the same way and falls back to the idx_trip_open
+    partial index on a miss.
+    """
+
+    def __init__(self, window_seconds: float = 10.0, max_entries: int = 100000,
+                 open_ttl_seconds: float = 300.0):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.open_ttl_seconds = open_ttl_seconds
+        self._lock = threading.Lock()
+        self._recent: 'OrderedDict[Tuple[int, int, str], Tuple[float, int]]' = OrderedDict()
+        self._open: 'OrderedDict[int, Tuple[float, Optional[int]]]' = OrderedDict()
+        self._stats = {
+            'taps': 0,
+            'accepted': 0,
+            'duplicates': 0,
+            'passback_rejections': 0,
+            'open_cache_hits': 0,
+            'open_cache_misses': 0
+        }
+
+    def _evict(self, cache: OrderedDict, now: float, ttl: float) -> None:
+        """Drop expired entries from the old end and trim to max_entries (caller holds the lock)."""
+        while cache:
+            stamp = next(iter(cache.values()))[0]
+            if now - stamp <= ttl and len(cache) <= self.max_entries:
+                break
+            cache.popitem(last=False)
+
+    def _decide(self, key: Tuple[int, int, str], now: float,
+                looked_up: Any = _NOT_LOOKED_UP) -> Optional[Tuple[str, Optional[int]]]:
+        """
+        Admit or reject a tap from the cached state (caller holds the lock)
+        :param looked_up: the card's open TripID read from the partial index, if already read
+        :return: the decision, or None when the card's open trip must be looked up first
+        """
+        card_id, _, direction = key
+        recent = self._recent.get(key)
+        if recent is not None:
+            self._stats['duplicates'] += 1
+            return DUPLICATE, (recent[1] if recent[1] != PENDING else None)
+
+        if direction == 'entry':
+            cached = self._open.get(card_id)
+            # An entry cached while the lookup ran is newer than the lookup
+            if cached is not None and now - cached[0] <= self.open_ttl_seconds:
+                if looked_up is _NOT_LOOKED_UP:
+                    self._stats['open_cache_hits'] += 1
+                self._open.move_to_end(card_id)
+                open_trip = cached[1]
+            elif looked_up is _NOT_LOOKED_UP:
+                self._stats['open_cache_misses'] += 1
+                return None
+            else:
+                open_trip = looked_up
+            if open_trip is not None:
+                self._open[card_id] = (now, open_trip)
+                self._open.move_to_end(card_id)
+                self._stats['passback_rejections'] += 1
+                return PASSBACK, open_trip
+            # Mark the trip open now, so an entry at another gate racing this one is a passback
+            self._open[card_id] = (now, PENDING)
+            self._open.move_to_end(card_id)
+
+        # Reserve the key so a concurrent retry is caught before the insert lands
+        self._recent[key] = (now, PENDING)
+        self._stats['accepted'] += 1
+        return ACCEPT, None
+
+    def admit(self, conn: sqlite3.Connection, card_id: int, station_id: int,
+              direction: str) -> Tuple[str, Optional[int]]:
+        """
+        Decide whether a tap should be written
+        :param conn: Connection object used for cold open-trip lookups
+        :param card_id: tapping card
+        :param station_id: station of the tap
+        :param direction: 'entry' or 'exit'
+        :return: (ACCEPT, None), (DUPLICATE, original TripID) or (PASSBACK, open TripID)
+        """
+        key = (card_id, station_id, direction)
+        now = time.monotonic()
+        with self._lock:
+            self._stats['taps'] += 1
+            self._evict(self._recent, now, self.window_seconds)
+            self._evict(self._open, now, self.open_ttl_seconds)
+            decision = self._decide(key, now)
+        if decision is not None:
+            return decision
+
+        # Cold lookup outside the lock so other cards' taps do not wait on the query;
+        # the state is re-checked afterwards in case a tap for this card got in first
+        row = conn.execute(OPEN_TRIP_QUERY, (card_id,)).fetchone()
+        with self._lock:
+            return self._decide(key, now, row[0] if row else None)
+
+    def confirm(self, card_id: int, station_id: int, direction: str, trip_id: int) -> None:
+        """Record the TripID written for an admitted tap."""
+        key = (card_id, station_id, direction)
+        with self._lock:
+            stamp = self._recent.get(key, (time.monotonic(), PENDING))[0]
+            self._recent[key] = (stamp, trip_id)
+            # An entry opens a trip; an exit closes the card's open trip
+            self._open[card_id] = (time.monotonic(), trip_id if direction == 'entry' else None)
+            self._open.move_to_end(card_id)
+
+    def resolve_pending(self, card_id: int, station_id: int, direction: str, trip_id: int) -> None:
+        """Replace the placeholder of a tap confirmed before its trip was written (journaled taps)."""
+        key = (card_id, station_id, direction)
+        with self._lock:
+            recent = self._recent.get(key)
+            if recent is not None and recent[1] == PENDING:
+                self._recent[key] = (recent[0], trip_id)
+            cached = self._open.get(card_id)
+            if direction == 'entry' and cached is not None and cached[1] == PENDING:
+                self._open[card_id] = (cached[0], trip_id)
+
+    def release(self, card_id: int, station_id: int, direction: str) -> None:
+        """Forget an admitted tap whose write failed so a retry is not treated as a duplicate or passback."""
+        with self._lock:
+            self._recent.pop((card_id, station_id, direction), None)
+            cached = self._open.get(card_id)
+            if direction == 'entry' and cached is not None and cached[1] == PENDING:
+                del self._open[card_id]
+
+    def mark_closed(self, card_id: int) -> None:
+        """Note that one of a card's trips was closed; its next entry re-checks the partial index."""
+        with self._lock:
+            self._open.pop(card_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['recent_entries'] = len(self._recent)
+            stats['open_cache_entries'] = len(self._open)
+        lookups = stats['open_cache_hits'] + stats['open_cache_misses']
+        stats['duplicate_rate'] = round(stats['duplicates'] / stats['taps'], 4) if stats['taps'] else 0.0
+        stats['open_cache_hit_rate'] = round(stats['open_cache_hits'] / lookups, 4) if lookups else 0.0
+        stats['window_seconds'] = self.window_seconds
+        return stats
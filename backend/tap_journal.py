@@ -0,0 +1,374 @@
+import sqlite3
+import os
+import json
+import mmap
+import time
+import fcntl
+import zlib
+import struct
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MTJRNL01'
+HEADER_SIZE = 16
+# Record: payload length, crc32 of seq + payload, seq; a zero length ends the log
+RECORD_HEADER = struct.Struct('<IIQ')
+DEFAULT_SIZE_BYTES = 64 * 1024 * 1024
+BUSY_TIMEOUT_SECONDS = 1
+
+JOURNAL_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS TapJournalState (
+    Journal TEXT PRIMARY KEY,
+    AppliedSeq INTEGER NOT NULL DEFAULT 0
+)"""
+
+INSERT_TRIP = """
+    INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# An exit tap closes the card's open trip, found through the idx_trip_open partial index
+CLOSE_TRIP = """
+    UPDATE Trip SET ExitTime = ?, ExitStationID = ?, FareAmount = COALESCE(?, FareAmount)
+    WHERE TripID = (
+        SELECT TripID FROM Trip
+        WHERE CardID = ? AND ExitTime IS NULL
+        ORDER BY EntryTime DESC
+        LIMIT 1
+    )
+    RETURNING TripID, EntryStationID, EntryTime
+"""
+
+# Journaled tap: (seq, appended at (epoch seconds), trip values in INSERT_TRIP order)
+JournalRecord = Tuple[int, float, list]
+# (EntryStationID, EntryTime) of the open trip an exit tap closed
+ClosedEntry = Tuple[int, str]
+
+
+def write_tap(conn: sqlite3.Connection, values: list) -> Tuple[int, Optional[ClosedEntry]]:
+    """
+    Write one gate tap to Trip inside the caller's transaction.
+
+    An entry tap inserts an open trip. An exit tap closes the card's open
+    trip; an exit with no open trip is recorded as a complete trip of its own.
+    :param conn: Connection object
+    :param values: trip values in INSERT_TRIP order
+    :return: (TripID written, entry station and time of the trip the exit closed or None)
+    """
+    entry_time, exit_time, fare_amount, card_id, entry_station_id, exit_station_id = values
+    if exit_station_id:
+        closed = conn.execute(CLOSE_TRIP, (exit_time, exit_station_id, fare_amount, card_id)).fetchall()
+        if closed:
+            trip_id, entry_station_id, entry_time = closed[0]
+            return trip_id, (entry_station_id, entry_time)
+    return conn.execute(INSERT_TRIP, values).lastrowid, None
+
+
+class JournalFull(Exception):
+    """Raised when the journal has no room left; the caller should write directly."""
+
+
+class JournalTimeout(TimeoutError):
+    """
+    Raised when a tap was queued but its flush did not finish in time. The
+    tap stays in the journal and is applied once flushed, so the caller must
+    not write it again.
+    """
+
+    def __init__(self, message: str, seq: int):
+        super().__init__(message)
+        self.seq = seq
+
+
+class JournalLocked(OSError):
+    """Raised when another process already has the journal file open."""
+
+
+class TapJournal:
+    """
+    Append-only, memory-mapped journal in front of Trip writes.
+
+    Gate taps are copied into the mapped file and acknowledged once an
+    msync covering them completes; a flusher thread batches the msync for
+    every tap appended since the last one (group commit). A drainer thread
+    applies durable taps to Trip in large transactions and advances
+    TapJournalState.AppliedSeq in the same transaction, so replaying the
+    journal after a crash skips exactly the taps already applied.
+    """
+
+    def __init__(self, path: str, db_path: str, size_bytes: int = DEFAULT_SIZE_BYTES,
+                 flush_interval: float = 0.005, drain_interval: float = 0.2, batch_size: int = 5000,
+                 on_applied: Optional[Callable[[List[Tuple[list, int, Optional[ClosedEntry]]]], None]] = None):
+        self.path = path
+        self.db_path = db_path
+        self.size_bytes = size_bytes
+        self.flush_interval = flush_interval
+        self.drain_interval = drain_interval
+        self.batch_size = batch_size
+        self.on_applied = on_applied
+        self.name = os.path.basename(path)
+
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._pending: deque = deque()
+        self._mm: Optional[mmap.mmap] = None
+        self._file = None
+        self._offset = HEADER_SIZE
+        self._written_seq = 0
+        self._durable_seq = 0
+        self._applied_seq = 0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.total_applied = 0
+
+    # ==================== Open / replay ====================
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None,
+                               check_same_thread=False)
+
+    def _load_applied_seq(self) -> int:
+        conn = self._connect()
+        try:
+            conn.execute(JOURNAL_STATE_TABLE)
+            conn.execute("INSERT OR IGNORE INTO TapJournalState (Journal) VALUES (?)", (self.name,))
+            return conn.execute("SELECT AppliedSeq FROM TapJournalState WHERE Journal = ?",
+                                (self.name,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def _scan(self) -> List[JournalRecord]:
+        """Read the valid record prefix; stops at the terminator, a torn record or a stale generation."""
+        records, offset, last_seq = [], HEADER_SIZE, 0
+        mm = self._mm
+        while offset + RECORD_HEADER.size <= self.size_bytes:
+            length, crc, seq = RECORD_HEADER.unpack_from(mm, offset)
+            end = offset + RECORD_HEADER.size + length
+            if length == 0 or end > self.size_bytes or seq <= last_seq:
+                break
+            payload = mm[offset + RECORD_HEADER.size:end]
+            if zlib.crc32(struct.pack('<Q', seq) + payload) != crc:
+                break
+            appended_at, values = json.loads(payload)
+            records.append((seq, appended_at, values))
+            last_seq, offset = seq, end
+        self._offset = offset
+        return records
+
+    def open(self) -> int:
+        """
+        Map the journal file and queue every durable tap not yet applied.
+
+        The file is held under an exclusive flock until stop(): two processes
+        appending to and draining one journal would overwrite each other's
+        records and apply taps twice.
+        :return: number of taps queued for replay
+        """
+        new_file = not os.path.exists(self.path)
+        self._file = open(self.path, 'a+b')
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            self._file.close()
+            self._file = None
+            raise JournalLocked(f"Tap journal {self.path} is in use by another process") from e
+        try:
+            self._applied_seq = self._load_applied_seq()
+        except sqlite3.Error:
+            self._file.close()
+            self._file = None
+            raise
+        if os.path.getsize(self.path) < self.size_bytes:
+            self._file.truncate(self.size_bytes)
+        self._mm = mmap.mmap(self._file.fileno(), self.size_bytes)
+        if new_file or self._mm[:len(MAGIC)] != MAGIC:
+            self._mm[:HEADER_SIZE] = MAGIC.ljust(HEADER_SIZE, b'\0')
+            RECORD_HEADER.pack_into(self._mm, HEADER_SIZE, 0, 0, 0)
+            self._mm.flush()
+            os.fsync(self._file.fileno())
+
+        records = self._scan()
+        replay = [record for record in records if record[0] > self._applied_seq]
+        self._pending.extend(replay)
+        self._written_seq = self._durable_seq = max(records[-1][0] if records else 0, self._applied_seq)
+        if replay:
+            logger.info(f"Tap journal: replaying {len(replay)} tap(s) after seq {self._applied_seq}")
+        return len(replay)
+
+    # ==================== Append ====================
+
+    def append(self, values: list, timeout: float = 2.0) -> int:
+        """
+        Append a tap and wait until it is durable
+        :param values: trip values in INSERT_TRIP order
+        :return: journal sequence number of the tap
+        :raises JournalFull: no room left; nothing was queued
+        :raises JournalTimeout: queued, but not flushed within timeout
+        """
+        appended_at = time.time()
+        payload = json.dumps([appended_at, values], separators=(',', ':')).encode()
+        with self._lock:
+            end = self._offset + RECORD_HEADER.size + len(payload)
+            # Keep room for the terminator that follows the last record
+            if end + RECORD_HEADER.size > self.size_bytes:
+                raise JournalFull(f"Tap journal is full ({self._offset} bytes used)")
+            seq = self._written_seq + 1
+            self._mm[self._offset + RECORD_HEADER.size:end] = payload
+            RECORD_HEADER.pack_into(self._mm, end, 0, 0, 0)
+            RECORD_HEADER.pack_into(self._mm, self._offset, len(payload),
+                                    zlib.crc32(struct.pack('<Q', seq) + payload), seq)
+            self._offset = end
+            self._written_seq = seq
+            self._pending.append((seq, appended_at, values))
+            deadline = time.monotonic() + timeout
+            while self._durable_seq < seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise JournalTimeout(f"Tap {seq} was not flushed within {timeout}s", seq)
+                self._flushed.wait(remaining)
+        return seq
+
+    def _flush_loop(self) -> None:
+        while not self._stop.is_set():
+            time.sleep(self.flush_interval)
+            with self._lock:
+                target = self._written_seq
+            if target == self._durable_seq:
+                continue
+            try:
+                # msync outside the lock so appends continue while the flush is in progress
+                self._mm.flush()
+            except (OSError, ValueError) as e:
+                logger.error(f"Error flushing tap journal: {e}")
+                continue
+            with self._lock:
+                self._durable_seq = max(self._durable_seq, target)
+                self._flushed.notify_all()
+
+    # ==================== Drain ====================
+
+    def _apply_batch(self, conn: sqlite3.Connection,
+                     batch: List[JournalRecord]) -> List[Tuple[list, int, Optional[ClosedEntry]]]:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # AppliedSeq is re-read inside the write transaction; records at or below it were applied already
+            applied_seq = conn.execute("SELECT AppliedSeq FROM TapJournalState WHERE Journal = ?",
+                                       (self.name,)).fetchone()[0]
+            applied = []
+            for seq, _, values in batch:
+                if seq > applied_seq:
+                    applied.append((values, *write_tap(conn, values)))
+            conn.execute("UPDATE TapJournalState SET AppliedSeq = ? WHERE Journal = ?", (batch[-1][0], self.name))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return applied
+
+    def drain_once(self, conn: sqlite3.Connection) -> int:
+        """Apply every durable pending tap, batch_size per transaction."""
+        drained = 0
+        while True:
+            with self._lock:
+                durable = self._durable_seq
+                batch = []
+                for record in self._pending:
+                    if record[0] > durable or len(batch) >= self.batch_size:
+                        break
+                    batch.append(record)
+            if not batch:
+                break
+            applied = self._apply_batch(conn, batch)
+            with self._lock:
+                for _ in batch:
+                    self._pending.popleft()
+                self._applied_seq = batch[-1][0]
+            drained += len(batch)
+            self.total_applied += len(applied)
+            if self.on_applied and applied:
+                self.on_applied(applied)
+        self._maybe_rewind()
+        return drained
+
+    def _maybe_rewind(self) -> None:
+        """Restart writing at the front of the file once everything in it has been applied."""
+        with self._lock:
+            if self._pending or self._offset < self.size_bytes // 2 or self._durable_seq != self._written_seq:
+                return
+            # Older records left behind carry lower seqs, which ends a scan
+            RECORD_HEADER.pack_into(self._mm, HEADER_SIZE, 0, 0, 0)
+            self._mm.flush()
+            self._offset = HEADER_SIZE
+        logger.info("Tap journal fully applied; rewound to the start of the file")
+
+    def _drain_loop(self) -> None:
+        conn = self._connect()
+        try:
+            while not self._stop.wait(self.drain_interval):
+                try:
+                    self.drain_once(conn)
+                except sqlite3.Error as e:
+                    # Typically the write lock is busy; taps stay queued and durable
+                    logger.warning(f"Tap journal drain deferred: {e}")
+        finally:
+            conn.close()
+
+    # ==================== Lifecycle ====================
+
+    def start(self) -> None:
+        """Open the journal (replaying unapplied taps) and start the flusher and drainer threads."""
+        if self._threads:
+            return
+        self.open()
+        self._stop.clear()
+        for target, name in ((self._flush_loop, 'tap-journal-flush'), (self._drain_loop, 'tap-journal-drain')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the threads, apply what is left and unmap the file."""
+        if not self._threads:
+            return
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        conn = self._connect()
+        try:
+            self._mm.flush()
+            self._durable_seq = self._written_seq
+            self.drain_once(conn)
+        except sqlite3.Error as e:
+            logger.error(f"Tap journal left {len(self._pending)} tap(s) for replay: {e}")
+        finally:
+            conn.close()
+            self._mm.close()
+            self._file.close()
+
+    def pending_open_trips(self) -> Dict[int, int]:
+        """Entry taps without an exit time per entry station, journaled but not applied yet."""
+        counts: Dict[int, int] = {}
+        with self._lock:
+            for _, _, values in self._pending:
+                if values[1] is None:
+                    counts[values[4]] = counts.get(values[4], 0) + 1
+        return counts
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            oldest = self._pending[0][1] if self._pending else None
+            return {
+                'depth': len(self._pending),
+                'written_seq': self._written_seq,
+                'durable_seq': self._durable_seq,
+                'applied_seq': self._applied_seq,
+                'drain_lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+                'bytes_used': self._offset,
+                'size_bytes': self.size_bytes,
+                'total_applied': self.total_applied
+            }
@@ -0,0 +1,43 @@
+import os
+import sys
+import importlib
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The backend modules import each other as top-level modules; create_database lives one level up
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(1, os.path.dirname(BACKEND_DIR))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh project database with the schema and sample data."""
+    from create_database import create_connection, create_tables_if_not_exist, insert_sample_data
+
+    path = str(tmp_path / 'project.db')
+    conn = create_connection(path)
+    try:
+        create_tables_if_not_exist(conn)
+        insert_sample_data(conn)
+    finally:
+        conn.close()
+    return path
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The Flask app module, bound to a fresh database in a temporary directory."""
+    os.environ['METRO_DB_PATH'] = str(tmp_path_factory.mktemp('metro') / 'project.db')
+    try:
+        yield importlib.import_module('app')
+    finally:
+        del os.environ['METRO_DB_PATH']
+
+
+@pytest.fixture
+def client(app_module):
+    """A test client with the tap filter's debounce and open-trip caches cleared."""
+    app_module.tap_filter._recent.clear()
+    app_module.tap_filter._open.clear()
+    return app_module.app.test_client()
@@ -0,0 +1,97 @@
+from anomaly import (AnomalyDetector, TripScanner, CardState, DOUBLE_ENTRY, EXIT_WITHOUT_ENTRY,
+                     IMPOSSIBLE_TRANSIT, DISTANT_REUSE)
+
+CARD = 7
+
+
+def scanner():
+    # 10 km between any two stations: at 90 km/h no journey takes under 400 seconds
+    return TripScanner(lambda from_id, to_id: 10.0, max_speed_kmh=90.0)
+
+
+def alert_types(alerts):
+    return [(alert_type, trip_id, related) for alert_type, _, trip_id, related, *_ in alerts]
+
+
+def test_exit_closing_the_pending_entry_raises_nothing():
+    state = CardState()
+    rules = scanner()
+    assert rules.scan(CARD, [(1, '2024-01-01 08:00:00', None, 1, None)], state) == []
+    assert rules.scan(CARD, [(1, '2024-01-01 08:00:00', '2024-01-01 08:30:00', 1, 2)], state) == []
+    assert state.pending is None
+    assert state.last == (1, state.last[1], 2)
+    # The next journey starts outside the network
+    assert rules.scan(CARD, [(2, '2024-01-01 09:00:00', None, 2, None)], state) == []
+
+
+def test_complete_journeys_from_the_table_are_not_exits_without_entry():
+    rows = [
+        (1, '2024-01-01 08:00:00', '2024-01-01 08:30:00', 1, 2),
+        (2, '2024-01-01 09:00:00', '2024-01-01 09:30:00', 2, 3),
+    ]
+    assert scanner().scan(CARD, rows, CardState()) == []
+
+
+def test_journey_started_while_another_is_open_is_a_double_entry():
+    rows = [
+        (1, '2024-01-01 08:00:00', None, 1, None),
+        (2, '2024-01-01 08:20:00', '2024-01-01 08:50:00', 1, 3),
+    ]
+    assert alert_types(scanner().scan(CARD, rows, CardState())) == [(DOUBLE_ENTRY, 2, 1)]
+
+
+def test_entry_after_the_sweeper_closed_the_open_trip_is_not_a_double_entry():
+    rows = [
+        (1, '2024-01-01 08:00:00', '2024-01-01 12:00:00', 1, None),
+        (2, '2024-01-01 13:00:00', None, 1, None),
+    ]
+    assert scanner().scan(CARD, rows, CardState()) == []
+
+
+def test_exit_reported_unmatched_is_an_exit_without_entry():
+    row = (5, '2024-01-01 08:00:00', '2024-01-01 08:30:00', 1, 2)
+    assert alert_types(scanner().scan(CARD, [row], CardState(), unmatched_exits=(5,))) == [
+        (EXIT_WITHOUT_ENTRY, 5, None)
+    ]
+
+
+def test_late_exit_after_a_sweep_relates_to_the_swept_trip():
+    rows = [
+        (1, '2024-01-01 08:00:00', '2024-01-01 12:00:00', 1, None),
+        (2, '2024-01-01 12:00:00', '2024-01-01 12:30:00', 1, 4),
+    ]
+    alerts = scanner().scan(CARD, rows, CardState(), unmatched_exits=(2,))
+    assert alert_types(alerts) == [(EXIT_WITHOUT_ENTRY, 2, 1)]
+
+
+def test_journey_faster_than_the_network_allows_is_impossible_transit():
+    state = CardState()
+    rules = scanner()
+    rules.scan(CARD, [(1, '2024-01-01 08:00:00', None, 1, None)], state)
+    alerts = rules.scan(CARD, [(1, '2024-01-01 08:00:00', '2024-01-01 08:01:00', 1, 2)], state)
+    assert alert_types(alerts) == [(IMPOSSIBLE_TRANSIT, 1, None)]
+
+
+def test_entry_too_soon_after_exiting_elsewhere_is_distant_reuse():
+    rows = [
+        (1, '2024-01-01 08:00:00', '2024-01-01 08:30:00', 1, 2),
+        (2, '2024-01-01 08:31:00', None, 3, None),
+    ]
+    assert alert_types(scanner().scan(CARD, rows, CardState())) == [(DISTANT_REUSE, 2, 1)]
+
+
+def test_replaying_without_emit_rebuilds_the_pending_entry():
+    state = CardState()
+    scanner().scan(CARD, [(1, '2024-01-01 08:00:00', None, 1, None)], state, emit=False)
+    assert state.pending[0] == 1
+    alerts = scanner().scan(CARD, [(2, '2024-01-01 08:10:00', None, 1, None)], state)
+    assert alert_types(alerts) == [(DOUBLE_ENTRY, 2, 1)]
+
+
+def test_detector_checks_a_closing_exit_against_the_stored_entry(db_path):
+    detector = AnomalyDetector(db_path, scanner())
+    detector.observe(1, CARD, '2024-01-01 08:00:00', None, 1, None)
+    detector.observe(1, CARD, '2024-01-01 08:00:00', '2024-01-01 08:30:00', 1, 2)
+    detector.observe(2, CARD, '2024-01-01 09:00:00', '2024-01-01 09:30:00', 2, 3, unmatched_exit=True)
+    items = [detector._queue.get_nowait() for _ in range(3)]
+    assert alert_types(detector.process(items)) == [(EXIT_WITHOUT_ENTRY, 2, None)]
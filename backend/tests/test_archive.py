@@ -0,0 +1,134 @@
+import os
+import sqlite3
+
+import archive
+from archive import archive_closed_months, archive_month, archive_path, working_path
+from sharding import ShardedStore
+
+
+def test_closed_months_of_every_shard_go_into_one_archive(db_path, tmp_path):
+    store = ShardedStore(db_path, 2, str(tmp_path / 'shards'))
+    store.ensure_schema()
+    store.replicate_reference()
+    store.migrate()
+    shard_paths = [store.shard_path(shard) for shard in range(2)]
+    store.close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        card_ids = [row[0] for row in conn.execute("SELECT CardID FROM Card ORDER BY CardID")]
+    finally:
+        conn.close()
+    written = 0
+    for card_id in card_ids:
+        store_conn = store.connect_for_card(card_id)
+        try:
+            with store_conn:
+                store_conn.execute("""
+                    INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+                    VALUES ('2020-01-15 08:00:00', '2020-01-15 08:30:00', 2.5, ?, 1, 2)
+                """, (card_id,))
+            written += 1
+        finally:
+            store_conn.close()
+    assert len({store.shard_for(card_id) for card_id in card_ids}) == 2
+
+    archive_dir = str(tmp_path / 'archive')
+    results = archive_closed_months(db_path, 3, archive_dir, shard_paths)
+    assert sum(result['trips'] for result in results) == written
+    assert {result['database'] for result in results} == set(shard_paths)
+
+    archived = sqlite3.connect(archive_path(archive_dir, 2020, 1))
+    try:
+        assert archived.execute("SELECT COUNT(*) FROM Trip").fetchone()[0] == written
+    finally:
+        archived.close()
+    assert os.stat(archive_path(archive_dir, 2020, 1)).st_mode & 0o222 == 0
+    for path in shard_paths:
+        conn = sqlite3.connect(path)
+        try:
+            assert conn.execute("SELECT COUNT(*) FROM Trip WHERE EntryTime < '2020-02'").fetchone()[0] == 0
+        finally:
+            conn.close()
+
+
+def test_late_rows_replace_a_sealed_month_instead_of_writing_it(db_path, tmp_path):
+    archive_dir = str(tmp_path / 'archive')
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+                VALUES ('2020-01-15 08:00:00', '2020-01-15 08:30:00', 2.5, 1, 1, 2)
+            """)
+        assert archive_month(db_path, 2020, 1, archive_dir)['trips'] == 1
+        path = archive_path(archive_dir, 2020, 1)
+        sealed = os.stat(path)
+        # A reader holding the sealed month keeps seeing it unchanged
+        reader = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+
+        # A trip that entered in January closes late and its month is archived again
+        with conn:
+            conn.execute("""
+                INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+                VALUES ('2020-01-31 23:50:00', '2020-02-01 00:20:00', 2.5, 2, 1, 2)
+            """)
+        archive_month(db_path, 2020, 1, archive_dir)
+        assert conn.execute("SELECT COUNT(*) FROM Trip WHERE EntryTime < '2020-02'").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+    try:
+        assert reader.execute("SELECT COUNT(*) FROM Trip").fetchone()[0] == 1
+    finally:
+        reader.close()
+    published = os.stat(path)
+    assert published.st_ino != sealed.st_ino
+    assert published.st_mode & 0o222 == 0
+    assert not os.path.exists(working_path(path))
+    archived = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+    try:
+        assert archived.execute("SELECT COUNT(*) FROM Trip").fetchone()[0] == 2
+    finally:
+        archived.close()
+
+
+def test_trip_changed_after_it_was_copied_stays_hot_until_the_next_run(db_path, tmp_path, monkeypatch):
+    archive_dir = str(tmp_path / 'archive')
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            trip_id = conn.execute("""
+                INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+                VALUES ('2020-01-15 08:00:00', '2020-01-15 08:30:00', NULL, 1, 1, 2)
+            """).lastrowid
+    finally:
+        conn.close()
+
+    copy_month = archive._copy_month
+
+    def settle_after_copying(*args):
+        counts = copy_month(*args)
+        settled = sqlite3.connect(db_path)
+        try:
+            with settled:
+                settled.execute("UPDATE Trip SET FareAmount = 2.5 WHERE TripID = ?", (trip_id,))
+        finally:
+            settled.close()
+        return counts
+
+    monkeypatch.setattr(archive, '_copy_month', settle_after_copying)
+    archive_month(db_path, 2020, 1, archive_dir)
+    monkeypatch.undo()
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT FareAmount FROM Trip WHERE TripID = ?", (trip_id,)).fetchone() == (2.5,)
+        archive_month(db_path, 2020, 1, archive_dir)
+        assert conn.execute("SELECT COUNT(*) FROM Trip WHERE TripID = ?", (trip_id,)).fetchone() == (0,)
+    finally:
+        conn.close()
+    archived = sqlite3.connect(archive_path(archive_dir, 2020, 1))
+    try:
+        assert archived.execute("SELECT FareAmount FROM Trip WHERE TripID = ?", (trip_id,)).fetchone() == (2.5,)
+    finally:
+        archived.close()
@@ -0,0 +1,44 @@
+import sqlite3
+
+from card_history import CardHistory, decode_cursor
+
+CARD = 1
+SAME_TIME = '2024-03-01 08:00:00'
+
+
+def test_pages_through_rows_sharing_a_timestamp_without_gaps_or_repeats(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        trip_ids = [conn.execute("""
+            INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+            VALUES (?, ?, 2.5, ?, 1, 2)
+        """, (SAME_TIME, SAME_TIME, CARD)).lastrowid for _ in range(3)]
+        transaction_ids = [conn.execute("""
+            INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID)
+            VALUES ('Fare', 2.5, ?, ?)
+        """, (SAME_TIME, CARD)).lastrowid for _ in range(3)]
+        # Older rows that must follow every row at SAME_TIME
+        conn.execute("""
+            INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+            VALUES ('2024-02-01 08:00:00', '2024-02-01 08:30:00', 2.5, ?, 1, 2)
+        """, (CARD,))
+
+    history = CardHistory(str(tmp_path / 'archive'))
+    seen, cursor = [], None
+    try:
+        while True:
+            page = history.page(conn, CARD, cursor, limit=2)
+            seen += [(item['type'], item['id'], item['time']) for item in page['items']]
+            if page['nextCursor'] is None:
+                break
+            cursor = decode_cursor(page['nextCursor'])
+    finally:
+        conn.close()
+
+    same_time = [(kind, item_id) for kind, item_id, time in seen if time == SAME_TIME]
+    # At one time trips come first, each stream newest id first
+    assert same_time == ([('trip', trip_id) for trip_id in reversed(trip_ids)]
+                         + [('transaction', transaction_id) for transaction_id in reversed(transaction_ids)])
+    assert len(seen) == len(set(seen))
+    assert [time for _, _, time in seen] == sorted((time for _, _, time in seen), reverse=True)
+    assert any(time == '2024-02-01 08:00:00' for _, _, time in seen)
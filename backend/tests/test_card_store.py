@@ -0,0 +1,39 @@
+from card_store import CardStateStore
+
+
+def make_snapshot(tmp_path):
+    store = CardStateStore(capacity=4)
+    for card_id in range(10):
+        store.upsert(card_id, f"MC{card_id:04d}", card_id * 1.5, multiplier=0.5)
+    path = str(tmp_path / 'cards.snapshot')
+    store.save_snapshot(path)
+    return path
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = make_snapshot(tmp_path)
+    store = CardStateStore()
+    assert store.load_snapshot(path)
+    assert len(store) == 10
+    assert store.get_by_number('MC0009') == {
+        'CardID': 9, 'CardNumber': 'MC0009', 'Balance': 13.5, 'Status': 'Active', 'BaseFareMultiplier': 0.5
+    }
+
+
+def test_truncated_snapshot_is_ignored(tmp_path):
+    path = make_snapshot(tmp_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    for size in (len(data) - 1, len(data) - 40, 30):
+        with open(path, 'wb') as f:
+            f.write(data[:size])
+        store = CardStateStore()
+        assert not store.load_snapshot(path)
+        assert len(store) == 0
+
+
+def test_padded_snapshot_is_ignored(tmp_path):
+    path = make_snapshot(tmp_path)
+    with open(path, 'ab') as f:
+        f.write(b'\0')
+    assert not CardStateStore().load_snapshot(path)
@@ -0,0 +1,110 @@
+import sqlite3
+
+from change_feed import ChangeFeed
+
+
+def make_feed(db_path, **options):
+    feed = ChangeFeed(db_path, **options)
+    conn = sqlite3.connect(db_path)
+    try:
+        feed.ensure_schema(conn)
+        # Start from the head, as the poller does
+        feed._last_seq = conn.execute("SELECT COALESCE(MAX(Seq), 0) FROM ChangeLog").fetchone()[0]
+    finally:
+        conn.close()
+    return feed
+
+
+def set_balances(db_path, *balances, card_id=1):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            for balance in balances:
+                conn.execute("UPDATE Card SET Balance = ? WHERE CardID = ?", (balance, card_id))
+    finally:
+        conn.close()
+
+
+def poll(feed, db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return feed.poll_once(conn)
+    finally:
+        conn.close()
+
+
+def test_cursor_returns_each_change_after_it_once_and_in_order(db_path):
+    feed = make_feed(db_path)
+    head = feed.last_seq
+    set_balances(db_path, 10.0, 20.0, 30.0)
+    assert poll(feed, db_path) == 3
+
+    first = feed.changes_since(head, limit=2)
+    assert [change['data']['Balance'] for change in first['changes']] == [10.0, 20.0]
+    assert first['lastSeq'] == first['changes'][-1]['seq']
+    rest = feed.changes_since(first['lastSeq'])
+    assert [change['data']['Balance'] for change in rest['changes']] == [30.0]
+    assert all(change['table'] == 'Card' and change['op'] == 'UPDATE' for change in first['changes'] + rest['changes'])
+    # At the head the cursor stays where it is
+    assert feed.changes_since(rest['lastSeq']) == {'changes': [], 'lastSeq': rest['lastSeq'], 'reset': False}
+
+
+def test_cursor_older_than_the_buffer_is_served_from_the_table(db_path):
+    feed = make_feed(db_path, buffer_size=2)
+    head = feed.last_seq
+    set_balances(db_path, 1.0, 2.0, 3.0, 4.0)
+    poll(feed, db_path)
+    assert len(feed._buffer) == 2
+    changes = feed.changes_since(head)['changes']
+    assert [change['data']['Balance'] for change in changes] == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_wait_returns_buffered_changes_at_once_and_times_out_at_the_head(db_path):
+    feed = make_feed(db_path)
+    head = feed.last_seq
+    assert feed.wait(head, timeout=0.05)['changes'] == []
+    set_balances(db_path, 5.0)
+    poll(feed, db_path)
+    assert [change['data']['Balance'] for change in feed.wait(head, timeout=5)['changes']] == [5.0]
+
+
+def test_compaction_keeps_the_latest_change_per_row(db_path):
+    feed = make_feed(db_path, compact_after_hours=1.0)
+    head = feed.last_seq
+    set_balances(db_path, 1.0, 2.0, card_id=1)
+    set_balances(db_path, 7.0, card_id=2)
+    set_balances(db_path, 3.0, card_id=1)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("UPDATE ChangeLog SET ChangedAt = datetime('now', 'localtime', '-2 hours') WHERE Seq > ?",
+                         (head,))
+        assert feed.compact(conn) == {'expired': 0, 'superseded': 2}
+    finally:
+        conn.close()
+
+    # Reading past the gaps still yields each row's latest state
+    changes = feed.changes_since(head)
+    assert changes['reset'] is False
+    assert [(change['id'], change['data']['Balance']) for change in changes['changes']] == [(2, 7.0), (1, 3.0)]
+
+
+def test_cursor_behind_retention_must_resynchronise(db_path):
+    feed = make_feed(db_path, retention_hours=1.0)
+    head = feed.last_seq
+    set_balances(db_path, 1.0, 2.0)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("UPDATE ChangeLog SET ChangedAt = datetime('now', 'localtime', '-2 hours') WHERE Seq > ?",
+                         (head,))
+        set_balances(db_path, 3.0)
+        expired_through = conn.execute("SELECT MAX(Seq) FROM ChangeLog").fetchone()[0] - 1
+        assert feed.compact(conn)['expired'] == 2
+    finally:
+        conn.close()
+
+    assert feed.changes_since(head)['reset'] is True
+    current = feed.changes_since(expired_through)
+    assert current['reset'] is False
+    assert [change['data']['Balance'] for change in current['changes']] == [3.0]
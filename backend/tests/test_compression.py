@@ -0,0 +1,94 @@
+import gzip
+import zlib
+
+import pytest
+from flask import Response
+from werkzeug.http import parse_accept_header
+
+from compression import GzipCompressor, GZIP_WBITS
+
+BODY = '{"rows": [' + ','.join('{"StationID": %d, "Entries": 0}' % n for n in range(200)) + ']}'
+
+
+def compress(response, accept='gzip, deflate', compressor=None):
+    return (compressor or GzipCompressor()).compress_response(response, parse_accept_header(accept), '/test')
+
+
+def test_buffered_body_is_gzipped_for_a_client_that_accepts_it():
+    compressor = GzipCompressor()
+    response = compress(Response(BODY, mimetype='application/json'), compressor=compressor)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.get_data()).decode() == BODY
+    stats = compressor.stats()['routes']['/test']
+    assert stats['bytes_in'] == len(BODY) and stats['bytes_out'] == len(response.get_data())
+
+
+@pytest.mark.parametrize('accept', ['', 'identity', 'gzip;q=0, deflate', 'br'])
+def test_body_is_left_alone_unless_gzip_is_acceptable(accept):
+    response = compress(Response(BODY, mimetype='application/json'), accept)
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data().decode() == BODY
+    # Caches must still key on the header
+    assert 'Accept-Encoding' in response.vary
+
+
+@pytest.mark.parametrize('response', [
+    Response('{"small": true}', mimetype='application/json'),
+    Response(b'\x89PNG' * 1000, mimetype='image/png'),
+    Response(BODY, status=206, mimetype='application/json'),
+    Response(BODY, mimetype='application/json', headers={'Content-Encoding': 'br'}),
+])
+def test_small_binary_partial_or_encoded_bodies_are_not_compressed(response):
+    original = response.get_data()
+    compress(response)
+    assert response.get_data() == original
+    assert response.headers.get('Content-Encoding') != 'gzip'
+
+
+def test_streamed_chunks_are_flushed_as_they_are_produced():
+    compressor = GzipCompressor()
+    events = [f"id: {n}\nevent: change\ndata: {{}}\n\n" for n in range(3)]
+    closed = []
+
+    def generate():
+        try:
+            yield from events
+        finally:
+            closed.append(True)
+
+    response = compress(Response(generate(), mimetype='text/event-stream'), compressor=compressor)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+
+    decoder = zlib.decompressobj(GZIP_WBITS)
+    body = iter(response.response)
+    for event in events:
+        # Each chunk decodes to its whole event before the next one is produced
+        assert decoder.decompress(next(body)).decode() == event
+    decoder.decompress(next(body))
+    assert decoder.eof
+    with pytest.raises(StopIteration):
+        next(body)
+    assert closed == [True]
+    assert compressor.stats()['routes']['/test']['bytes_in'] == sum(len(event) for event in events)
+
+
+def test_abandoned_stream_closes_its_source_and_is_recorded():
+    compressor = GzipCompressor()
+    closed = []
+
+    def generate():
+        try:
+            while True:
+                yield 'data: {}\n\n'
+        finally:
+            closed.append(True)
+
+    response = compress(Response(generate(), mimetype='text/event-stream'), compressor=compressor)
+    body = response.response
+    next(body)
+    # The client went away: the server closes the response iterable
+    body.close()
+    assert closed == [True]
+    assert compressor.stats()['routes']['/test']['responses'] == 1
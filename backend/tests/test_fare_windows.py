@@ -0,0 +1,43 @@
+import pytest
+
+from fare_windows import FareWindowResolver, PEAK, OFF_PEAK, ANYTIME
+
+# Monday 08:00 is peak under the default windows, Monday 12:00 off-peak
+PEAK_TIME, OFF_PEAK_TIME = '2024-01-01 08:00:00', '2024-01-01 12:00:00'
+
+
+def resolver_with(fares):
+    resolver = FareWindowResolver()
+    resolver._fares = fares
+    return resolver
+
+
+def test_time_specific_fare_then_anytime():
+    resolver = resolver_with({(1, 2): {PEAK: 30.0, ANYTIME: 20.0}})
+    peak, off_peak = resolver.resolve([PEAK_TIME, OFF_PEAK_TIME], [(1, 2), (2, 1)], [1.0, 0.5])
+    assert peak == {'FareType': PEAK, 'FareAmount': 30.0}
+    assert off_peak == {'FareType': OFF_PEAK, 'FareAmount': 10.0}
+
+
+def test_rule_for_the_other_fare_type_does_not_apply():
+    resolver = resolver_with({(1, 2): {PEAK: 30.0}, (3, 4): {OFF_PEAK: 15.0}})
+    results = resolver.resolve([OFF_PEAK_TIME, PEAK_TIME, PEAK_TIME], [(1, 2), (3, 4), (5, 6)])
+    assert [result['FareAmount'] for result in results] == [None, None, None]
+
+
+@pytest.mark.parametrize('card_type_id', ['abc', 1.5, True, 999])
+def test_resolve_endpoint_rejects_bad_card_type(client, card_type_id):
+    response = client.post('/fares/resolve', json={'trips': [
+        {'entryTime': PEAK_TIME, 'entryStationId': 1, 'exitStationId': 2, 'cardTypeId': card_type_id}
+    ]})
+    assert response.status_code == 400
+
+
+def test_resolve_endpoint_applies_card_type_multiplier(client):
+    trips = [{'entryTime': PEAK_TIME, 'entryStationId': 1, 'exitStationId': 2, 'cardTypeId': card_type_id}
+             for card_type_id in (None, 2)]
+    response = client.post('/fares/resolve', json={'trips': trips})
+    assert response.status_code == 200
+    regular, student = response.get_json()
+    if regular['FareAmount'] is not None:
+        assert student['FareAmount'] == round(regular['FareAmount'] * 0.5, 2)
@@ -0,0 +1,28 @@
+import sqlite3
+
+from idempotency import IdempotencyStore, fingerprint
+from maintenance import MaintenanceScheduler
+
+
+def test_maintenance_pass_purges_expired_keys(db_path):
+    store = IdempotencyStore(db_path, ttl_seconds=60)
+    conn = sqlite3.connect(db_path)
+    store.ensure_schema(conn)
+    conn.close()
+    for key in ('old', 'new'):
+        assert store.begin('/trips', key, fingerprint(b'{}')) is None
+        store.complete('/trips', key, fingerprint(b'{}'), 201, b'{"id": 1}')
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("UPDATE IdempotencyKey SET CreatedAt = CreatedAt - 120 WHERE IdemKey = 'old'")
+    conn.close()
+    store._cache[('/trips', 'old')] = (0.0, store._cache[('/trips', 'old')][1])
+
+    maintenance = MaintenanceScheduler(db_path)
+    maintenance.add_task('idempotency_purge', store.purge_expired)
+    assert maintenance.run_once()['idempotency_purge'] == 1
+
+    conn = sqlite3.connect(db_path)
+    assert [row[0] for row in conn.execute("SELECT IdemKey FROM IdempotencyKey")] == ['new']
+    conn.close()
+    assert store.stats()['cached_keys'] == 1
@@ -0,0 +1,35 @@
+import sqlite3
+
+from archive import PartitionRouter, archive_month
+
+SAME_SECOND = '2020-01-15 08:00:00'
+
+
+def add_trips(db_path, entry_times):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            card_id = conn.execute("SELECT MIN(CardID) FROM Card").fetchone()[0]
+            return [conn.execute("""
+                INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+                VALUES (?, ?, 10.0, ?, 1, 2)
+            """, (entry_time, entry_time, card_id)).lastrowid for entry_time in entry_times]
+    finally:
+        conn.close()
+
+
+def test_unbounded_trip_list_includes_archives_in_stable_order(app_module, client, db_path, tmp_path, monkeypatch):
+    archived = add_trips(db_path, [SAME_SECOND] * 3)
+    hot = add_trips(db_path, ['2020-02-01 09:00:00'])
+    archive_dir = str(tmp_path / 'archive')
+    assert archive_month(db_path, 2020, 1, archive_dir)['trips'] == 3
+    monkeypatch.setattr(app_module, 'archive_router', PartitionRouter(db_path, archive_dir))
+
+    trips = client.get('/trips?fields=TripID').get_json()
+    assert [trip['TripID'] for trip in trips] == hot + sorted(archived, reverse=True)
+    assert all(set(trip) == {'TripID'} for trip in trips)
+    assert client.get('/trips?count=1').get_json()['total'] == 4
+
+    # Paging through trips that share an EntryTime neither repeats nor skips one
+    pages = [client.get(f'/trips?fields=TripID&limit=1&offset={offset}').get_json() for offset in range(4)]
+    assert [page[0]['TripID'] for page in pages] == [trip['TripID'] for trip in trips]
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from loadgen import LoadGenerator, Metrics, classify
+
+
+def make_generator(statuses):
+    """A generator over one card whose calls answer from ``statuses`` by operation."""
+    generator = LoadGenerator('http://localhost:0', 1.0, [1.0] * 24, datetime(2024, 5, 1, 8), speed=1e6,
+                              duration=1.0, concurrency=1, readers=0, top_up_rate=0.0, report_every=1.0,
+                              timeout=1.0, seed=1)
+    generator.card_ids, generator.station_ids = [7], [1, 2]
+    generator.fares = {(1, 2): 2.5}
+    generator.calls = []
+
+    async def call(operation, method, path, payload=None, conflict_expected=False):
+        generator.calls.append((operation, conflict_expected))
+        return statuses[operation].pop(0)
+
+    generator.call = call
+    return generator
+
+
+@pytest.mark.parametrize('status, body, conflict_expected, outcome', [
+    (201, b'{}', False, 'ok'),
+    (503, b'', False, 'lock_timeout'),
+    (500, b'database is locked', False, 'lock_timeout'),
+    (409, b'{"error": "Card already has an open trip"}', True, 'rejected'),
+    (409, b'{"error": "Card already has an open trip"}', False, 'unexpected_conflict'),
+    (400, b'{"error": "Invalid card"}', False, 'error'),
+])
+def test_classify(status, body, conflict_expected, outcome):
+    assert classify(status, body, conflict_expected) == outcome
+
+
+def test_passback_is_expected_until_the_generator_has_tapped_the_card_out():
+    generator = make_generator({'tap_in': [409, 201, 201], 'tap_out': [201, 201]})
+    # The card may have been left open before the run
+    asyncio.run(generator.ride())
+    assert generator.calls == [('tap_in', True)]
+
+    asyncio.run(generator.ride())
+    assert generator.calls[1:] == [('tap_in', True), ('tap_out', False)]
+    # Once tapped out, a refusal would be a real failure
+    asyncio.run(generator.ride())
+    assert generator.calls[3] == ('tap_in', False)
+    assert generator._riding[7] == 0
+
+
+def test_passback_is_expected_while_another_ride_holds_the_card():
+    generator = make_generator({'tap_in': [201, 409], 'tap_out': [201]})
+    generator._tapped_out.add(7)
+
+    async def overlapping():
+        first = asyncio.ensure_future(generator.ride())
+        await asyncio.sleep(0)
+        await generator.ride()
+        await first
+
+    asyncio.run(overlapping())
+    assert generator.calls == [('tap_in', False), ('tap_in', True), ('tap_out', False)]
+
+
+def test_metrics_count_outcomes_per_interval_and_in_total():
+    metrics = Metrics()
+    metrics.record('tap_in', 0.02, 'ok')
+    metrics.record('tap_in', 0.01, 'rejected')
+    metrics.record('tap_in', 0.03, 'unexpected_conflict')
+    latencies, outcomes = metrics.take_interval()
+    assert latencies == [0.01, 0.02, 0.03]
+    assert outcomes == {'ok': 1, 'rejected': 1, 'unexpected_conflict': 1}
+
+    metrics.record('tap_out', 0.04, 'ok')
+    assert metrics.take_interval() == ([0.04], {'ok': 1})
+    assert dict(metrics.outcomes['tap_in']) == {'ok': 1, 'rejected': 1, 'unexpected_conflict': 1}
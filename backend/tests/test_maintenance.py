@@ -0,0 +1,76 @@
+import time
+from datetime import datetime
+
+from maintenance import MaintenanceScheduler
+
+
+def at(clock):
+    hour, minute = (int(part) for part in clock.split(':'))
+    return datetime(2024, 5, 1, hour, minute)
+
+
+def test_in_window_includes_the_start_and_excludes_the_end(db_path):
+    scheduler = MaintenanceScheduler(db_path, window=('02:00', '05:00'))
+    assert [scheduler.in_window(at(clock)) for clock in ('01:59', '02:00', '04:59', '05:00', '23:00')] == [
+        False, True, True, False, False
+    ]
+
+
+def test_in_window_wraps_past_midnight(db_path):
+    scheduler = MaintenanceScheduler(db_path, window=('22:00', '03:00'))
+    assert [scheduler.in_window(at(clock)) for clock in ('21:59', '22:00', '23:59', '00:00', '02:59', '03:00',
+                                                         '12:00')] == [
+        False, True, True, True, True, False, False
+    ]
+
+
+def test_tasks_are_gated_by_every_seconds(db_path):
+    scheduler = MaintenanceScheduler(db_path)
+    calls = {'often': 0, 'rarely': 0}
+    scheduler.add_task('often', lambda: calls.__setitem__('often', calls['often'] + 1))
+    scheduler.add_task('rarely', lambda: calls.__setitem__('rarely', calls['rarely'] + 1), every_seconds=0.2)
+
+    for _ in range(3):
+        scheduler.run_once()
+    assert calls == {'often': 3, 'rarely': 1}
+    time.sleep(0.25)
+    scheduler.run_once()
+    assert calls == {'often': 4, 'rarely': 2}
+
+
+def test_failing_task_is_retried_and_does_not_stop_the_pass(db_path):
+    scheduler = MaintenanceScheduler(db_path)
+    failures = []
+
+    def broken():
+        failures.append(True)
+        raise KeyError('missing')
+
+    scheduler.add_task('broken', broken, every_seconds=3600)
+    scheduler.add_task('fine', lambda: 'ok')
+    done = scheduler.run_once()
+    assert done['fine'] == 'ok'
+    assert 'broken' not in done and scheduler.last_run['broken'] is None
+    # A failed run does not count toward every_seconds
+    scheduler.run_once()
+    assert len(failures) == 2
+
+
+def test_thread_survives_a_failing_pass(db_path, monkeypatch):
+    scheduler = MaintenanceScheduler(db_path, interval_seconds=0.01)
+    passes = []
+
+    def run_once():
+        passes.append(True)
+        if len(passes) == 1:
+            raise RuntimeError('boom')
+
+    monkeypatch.setattr(scheduler, 'run_once', run_once)
+    scheduler.start()
+    try:
+        deadline = time.monotonic() + 2
+        while len(passes) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        scheduler.stop()
+    assert len(passes) >= 2
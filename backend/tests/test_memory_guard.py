@@ -0,0 +1,60 @@
+import tracemalloc
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from memory_guard import MemoryGuard
+
+
+def test_row_limit_divides_the_budget_by_the_projection():
+    guard = MemoryGuard(budget_bytes=10000, bytes_per_field=100)
+    assert guard.row_limit(5) == 20
+    assert guard.row_limit(0) == 100
+    # Never less than one row, however small the budget
+    assert MemoryGuard(budget_bytes=1).row_limit(50) == 1
+
+
+@pytest.fixture
+def tight_budget(app_module, monkeypatch):
+    """A one-row memory budget for list responses."""
+    guard = app_module.memory_guard
+    monkeypatch.setattr(guard, 'budget_bytes', 1)
+    monkeypatch.setattr(guard, '_routes', {})
+    return guard
+
+
+def test_oversized_list_is_rejected_with_a_pagination_hint(app_module, client, tight_budget, monkeypatch):
+    monkeypatch.setattr(tight_budget, 'oversize', 'reject')
+    response = client.get('/passengers?fields=PassengerID,Email&offset=0')
+    assert response.status_code == 413
+    hint = response.get_json()
+    assert hint['maxLimit'] == 1
+    next_url = urlparse(hint['next'])
+    assert next_url.path == '/passengers'
+    assert parse_qs(next_url.query) == {'fields': ['PassengerID,Email'], 'limit': ['1'], 'offset': ['0']}
+    assert parse_qs(urlparse(hint['stream']).query)['stream'] == ['true']
+    assert tight_budget.stats()['routes']['/passengers']['rejected'] == 1
+
+    # The hinted page fits the budget
+    assert client.get(hint['next']).status_code == 200
+
+
+def test_oversized_list_is_streamed_in_full(app_module, client, tight_budget):
+    everything = app_module.execute_query("SELECT PassengerID FROM Passenger ORDER BY PassengerID")
+    response = client.get('/passengers?fields=PassengerID')
+    assert response.headers['X-Result-Streamed'] == 'true'
+    assert sorted(row['PassengerID'] for row in response.get_json()) == [row['PassengerID'] for row in everything]
+    assert tight_budget.stats()['routes']['/passengers']['streamed'] == 1
+
+
+def test_streamed_response_is_traced_once_its_body_is_sent(app_module, client, tight_budget, monkeypatch):
+    monkeypatch.setattr(tight_budget, 'trace', True)
+    tracemalloc.start()
+    try:
+        response = client.get('/passengers?fields=PassengerID&stream=true')
+        assert '/passengers' not in tight_budget.stats()['routes']
+        response.get_data()
+        response.close()
+    finally:
+        tracemalloc.stop()
+    assert tight_budget.stats()['routes']['/passengers']['requests'] == 1
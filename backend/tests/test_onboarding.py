@@ -0,0 +1,93 @@
+import io
+import sqlite3
+
+from onboarding import OnboardingImport, read_rows
+
+
+def person(number, **overrides):
+    row = {'firstName': 'Test', 'lastName': f"Rider{number}", 'email': f"rider{number}@example.com",
+           'cardNumber': f"ONB{number:05d}", 'balance': '10', 'cardType': 'regular'}
+    row.update(overrides)
+    return row
+
+
+def count(db_path, query, params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(query, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_invalid_and_duplicate_rows_are_reported_and_the_rest_imported(db_path):
+    existing_email = count(db_path, "SELECT Email FROM Passenger LIMIT 1")
+    ndjson = '\n'.join([
+        '{"firstName": "Ada", "lastName": "Lovelace", "email": "ADA@example.com", "cardNumber": "ONB1", '
+        '"balance": 5, "cardType": "regular"}',
+        '{not json',
+        f'{{"firstName": "Dup", "lastName": "Email", "email": "{existing_email}", "cardNumber": "ONB2"}}',
+        '{"firstName": "Dup", "lastName": "Batch", "email": "ada@example.com", "cardNumber": "ONB3"}',
+        '{"firstName": "", "lastName": "Nameless", "email": "bad-email", "cardNumber": "ONB1"}',
+        '{"firstName": "Odd", "lastName": "Card", "email": "odd@example.com", "cardNumber": "ONB4", '
+        '"cardType": "platinum", "status": "Lost", "balance": -1}',
+        '',
+        '{"firstName": "Grace", "lastName": "Hopper", "email": "grace@example.com", "cardNumber": "ONB5"}'
+    ])
+    report = OnboardingImport(db_path, chunk_size=10).run(read_rows(io.StringIO(ndjson), 'ndjson'))
+
+    assert (report['rows'], report['imported'], report['failed']) == (7, 2, 5)
+    errors = {error['row']: error['errors'] for error in report['errors']}
+    assert errors[2] == ['Malformed JSON line']
+    assert errors[3] == [f"Email already exists: {existing_email}"]
+    assert errors[4] == ['Email already exists: ada@example.com']
+    assert errors[5] == ['firstName and lastName are required', 'Invalid email',
+                         'Card number already exists: ONB1']
+    assert errors[6] == ['Unknown card type: platinum', 'Invalid status: Lost', 'balance must not be negative']
+    # Emails are stored normalised, and each card's opening balance is on the ledger
+    assert count(db_path, "SELECT COUNT(*) FROM Passenger WHERE Email IN ('ada@example.com', 'grace@example.com')") == 2
+    assert count(db_path, """
+        SELECT SUM(t.Amount) FROM [Transaction] t JOIN Card c ON c.CardID = t.CardID
+        WHERE c.CardNumber IN ('ONB1', 'ONB5') AND t.TransactionType = 'Issue'
+    """) == 5.0
+
+
+def test_csv_rows_are_read_with_the_header():
+    rows = list(read_rows(io.StringIO("firstName,lastName,email\nAda,Lovelace,ada@example.com\n"), 'csv'))
+    assert rows == [{'firstName': 'Ada', 'lastName': 'Lovelace', 'email': 'ada@example.com'}]
+
+
+def test_chunk_hitting_a_concurrent_write_is_rolled_back_whole(db_path):
+    passengers = count(db_path, "SELECT COUNT(*) FROM Passenger")
+    chunks = []
+
+    def take_a_card_number(created):
+        chunks.append([card_number for _, card_number, *_ in created])
+        if len(chunks) == 1:
+            # Another writer issues a card number the next chunk uses, after the preload
+            conn = sqlite3.connect(db_path)
+            try:
+                with conn:
+                    conn.execute("""
+                        INSERT INTO Card (CardNumber, Balance, IssueDate, Status, PassengerID, CardTypeID)
+                        VALUES (?, 0, '2024-01-01 00:00:00', 'Active', 1, 1)
+                    """, (person(4)['cardNumber'],))
+            finally:
+                conn.close()
+
+    importer = OnboardingImport(db_path, chunk_size=2, on_chunk=take_a_card_number)
+    report = importer.run(person(number) for number in range(1, 7))
+
+    assert chunks == [['ONB00001', 'ONB00002'], ['ONB00005', 'ONB00006']]
+    assert (report['imported'], report['failed']) == (4, 2)
+    assert [error['row'] for error in report['errors']] == [3, 4]
+    assert all(error['errors'][0].startswith('Chunk rolled back') for error in report['errors'])
+    # Row 3 was valid, but nothing of its chunk was written
+    assert count(db_path, "SELECT COUNT(*) FROM Passenger WHERE Email = 'rider3@example.com'") == 0
+    assert count(db_path, "SELECT COUNT(*) FROM Passenger") == passengers + 4
+
+
+def test_dry_run_validates_without_writing(db_path):
+    passengers = count(db_path, "SELECT COUNT(*) FROM Passenger")
+    report = OnboardingImport(db_path, dry_run=True).run([person(1), person(2, email='nope')])
+    assert (report['imported'], report['failed'], report['dry_run']) == (1, 1, True)
+    assert count(db_path, "SELECT COUNT(*) FROM Passenger") == passengers
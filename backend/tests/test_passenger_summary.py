@@ -0,0 +1,108 @@
+import sqlite3
+
+import passenger_summary
+from archive import archive_month
+from maintenance import MaintenanceScheduler
+from passenger_summary import ensure_schema, rebuild, SUMMARY_SELECT
+from sharding import ShardedStore
+from tap_journal import write_tap
+
+
+def summary(db_path, passenger_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(SUMMARY_SELECT, (passenger_id,)).fetchone()
+        return row[3:]
+    finally:
+        conn.close()
+
+
+def test_entry_and_exit_count_one_trip_and_match_a_rebuild(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn, db_path)
+        card_id, passenger_id = conn.execute(
+            "SELECT CardID, PassengerID FROM Card WHERE PassengerID IS NOT NULL ORDER BY CardID LIMIT 1").fetchone()
+        trips_before = summary(db_path, passenger_id)[1]
+        with conn:
+            write_tap(conn, ['2024-05-01 08:00:00', None, None, card_id, 1, None])
+        with conn:
+            write_tap(conn, ['2024-05-01 08:00:00', '2024-05-01 08:30:00', 2.5, card_id, 1, 2])
+    finally:
+        conn.close()
+
+    maintained = summary(db_path, passenger_id)
+    assert maintained[1] == trips_before + 1
+    assert maintained[3] == '2024-05-01 08:00:00'
+    rebuild(db_path, archive_dir=db_path + '.archive')
+    assert summary(db_path, passenger_id) == maintained
+
+
+def test_scheduled_rebuild_picks_up_shard_trips(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn, db_path)
+        card_id, passenger_id = conn.execute(
+            "SELECT CardID, PassengerID FROM Card WHERE PassengerID IS NOT NULL ORDER BY CardID LIMIT 1").fetchone()
+    finally:
+        conn.close()
+    store = ShardedStore(db_path, 2, str(tmp_path / 'shards'))
+    store.ensure_schema()
+    store.replicate_reference()
+    store.migrate()
+    shard_paths = [store.shard_path(shard) for shard in range(2)]
+    store.close()
+    trips_before = summary(db_path, passenger_id)[1]
+
+    def ride():
+        shard = store.connect_for_card(card_id)
+        try:
+            with shard:
+                write_tap(shard, ['2024-05-01 08:00:00', '2024-05-01 08:30:00', 2.5, card_id, 1, 2])
+        finally:
+            shard.close()
+
+    maintenance = MaintenanceScheduler(db_path)
+    maintenance.add_task('passenger_summary_rebuild',
+                         lambda: rebuild(db_path, str(tmp_path / 'archive'), shard_paths), every_seconds=3600)
+    ride()
+    assert summary(db_path, passenger_id)[1] == trips_before
+    assert 'passenger_summary_rebuild' in maintenance.run_once()
+    assert summary(db_path, passenger_id)[1] == trips_before + 1
+    # Not due again within every_seconds
+    ride()
+    assert 'passenger_summary_rebuild' not in maintenance.run_once()
+    assert summary(db_path, passenger_id)[1] == trips_before + 1
+
+
+def test_month_archived_while_the_archives_are_summed_is_counted_once(db_path, tmp_path, monkeypatch):
+    archive_dir = str(tmp_path / 'archive')
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn, db_path)
+        card_id, passenger_id = conn.execute(
+            "SELECT CardID, PassengerID FROM Card WHERE PassengerID IS NOT NULL ORDER BY CardID LIMIT 1").fetchone()
+        with conn:
+            for month in (1, 2):
+                write_tap(conn, [f"2024-0{month}-10 08:00:00", f"2024-0{month}-10 08:30:00", 2.5, card_id, 1, 2])
+    finally:
+        conn.close()
+    trips = summary(db_path, passenger_id)[1]
+    archive_month(db_path, 2024, 1, archive_dir)
+
+    summed = []
+    original = passenger_summary._file_activity
+
+    def archive_during_the_sum(path, read_balances=False):
+        activity = original(path, read_balances)
+        if not summed:
+            # Runs without the rebuild holding project.db's write lock, which archive_month needs
+            archive_month(db_path, 2024, 2, archive_dir)
+        summed.append(path)
+        return activity
+
+    monkeypatch.setattr(passenger_summary, '_file_activity', archive_during_the_sum)
+    rebuild(db_path, archive_dir)
+    # January was summed before the lock; February appeared afterwards and was read under it
+    assert len(summed) == 2
+    assert summary(db_path, passenger_id)[1] == trips
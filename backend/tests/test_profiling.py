@@ -0,0 +1,82 @@
+import pytest
+
+from profiling import PROFILE_HEADER, RequestProfiler, collapsed_stacks
+
+MAIN = ('/srv/backend/app.py', 10, 'main')
+LOOKUP = ('/srv/backend/app.py', 20, 'lookup')
+EXECUTE = ('~', 0, "<method 'execute' of 'sqlite3.Connection' objects>")
+
+
+def test_profiling_needs_the_token_or_a_sample():
+    assert not RequestProfiler(token=None, sample_rate=1).should_profile(None)
+
+    profiler = RequestProfiler(token='secret')
+    assert profiler.authorized('secret')
+    assert not profiler.authorized('wrong') and not profiler.authorized(None)
+    assert profiler.should_profile('secret') and not profiler.should_profile(None)
+    # Every request is sampled at a rate of one
+    assert RequestProfiler(token='secret', sample_rate=1).should_profile(None)
+
+
+def test_collapsed_stacks_split_self_time_across_callers():
+    stats = {
+        MAIN: (1, 1, 1.0, 4.0, {}),
+        LOOKUP: (1, 1, 1.0, 3.0, {MAIN: (1, 1, 1.0, 3.0)}),
+        # Half of execute's time is spent under lookup, half directly under main
+        EXECUTE: (2, 2, 2.0, 2.0, {LOOKUP: (1, 1, 1.0, 1.0), MAIN: (1, 1, 1.0, 1.0)}),
+    }
+    main, lookup, execute = 'backend/app.py:10(main)', 'backend/app.py:20(lookup)', EXECUTE[2]
+    assert dict(collapsed_stacks(stats)) == pytest.approx({
+        main: 1.0,
+        f"{main};{lookup}": 1.0,
+        f"{main};{lookup};{execute}": 1.0,
+        f"{main};{execute}": 1.0,
+    })
+
+
+def test_collapsed_stacks_cut_recursion_and_depth():
+    stats = {
+        MAIN: (1, 1, 1.0, 3.0, {}),
+        LOOKUP: (1, 3, 2.0, 2.0, {MAIN: (1, 1, 2.0, 2.0), LOOKUP: (0, 2, 1.0, 1.0)}),
+    }
+    assert set(collapsed_stacks(stats)) == {'backend/app.py:10(main)',
+                                            'backend/app.py:10(main);backend/app.py:20(lookup)'}
+    assert set(collapsed_stacks(stats, max_depth=1)) == {'backend/app.py:10(main)'}
+
+
+@pytest.fixture
+def profiler(app_module, monkeypatch):
+    """The app's profiler with a token configured and no profiles recorded."""
+    profiler = app_module.profiler
+    monkeypatch.setattr(profiler, 'token', 'secret')
+    profiler.reset()
+    yield profiler
+    profiler.reset()
+
+
+def test_reports_are_hidden_without_the_token(client, profiler):
+    assert client.get('/debug/profiles').status_code == 404
+    assert client.get('/debug/profiles', headers={PROFILE_HEADER: 'wrong'}).status_code == 404
+    assert client.delete('/debug/profiles').status_code == 404
+
+
+def test_token_request_is_profiled_and_reported(client, profiler):
+    headers = {PROFILE_HEADER: 'secret'}
+    # Requests without the token are neither profiled nor timed
+    assert 'Server-Timing' not in client.get('/stations').headers
+    response = client.get('/stations', headers=headers)
+    assert response.headers['Server-Timing'].startswith('app;dur=')
+
+    summary = client.get('/debug/profiles', headers=headers).get_json()
+    assert summary['routes']['/stations']['requests'] == 1
+    assert summary['routes']['/stations']['sampled'] == 0
+
+    collapsed = client.get('/debug/profiles?route=/stations&format=collapsed', headers=headers)
+    assert collapsed.mimetype == 'text/plain'
+    lines = collapsed.get_data(as_text=True).splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('sqlite3' in line for line in lines)
+
+    assert client.get('/debug/profiles?route=/nowhere', headers=headers).status_code == 404
+    assert client.delete('/debug/profiles', headers=headers).status_code == 200
+    assert client.get('/debug/profiles', headers=headers).get_json()['routes'] == {}
@@ -0,0 +1,106 @@
+import sqlite3
+
+import pytest
+
+from archive import MAX_ATTACHED, archive_month
+from reconciliation import run_reconciliation, repair_ledger
+
+
+def balances(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT CardID, Balance FROM Card"))
+    finally:
+        conn.close()
+
+
+def execute(db_path, query, params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            return conn.execute(query, params).lastrowid
+    finally:
+        conn.close()
+
+
+def test_opening_balances_reconcile(db_path, tmp_path):
+    before = balances(db_path)
+    report = run_reconciliation(db_path, workers=1, repair='balance', archive_dir=str(tmp_path / 'archive'))
+    assert report['checked'] == len(before)
+    assert report['mismatch_count'] == 0
+    assert balances(db_path) == before
+
+
+def test_card_without_baseline_is_never_repaired(db_path, tmp_path):
+    card_id = execute(db_path, """
+        INSERT INTO Card (CardNumber, Balance, Status, PassengerID, CardTypeID, IssueDate)
+        VALUES ('LEGACY1', 75.0, 'Active', 1, 1, '2024-01-01 00:00:00')
+    """)
+    report = run_reconciliation(db_path, workers=1, repair='balance', archive_dir=str(tmp_path / 'archive'))
+    assert report['no_baseline'] == 1
+    assert report['repaired'] == 0
+    assert balances(db_path)[card_id] == 75.0
+
+
+@pytest.mark.parametrize('repair', ['balance', 'ledger'])
+def test_mismatch_is_repaired(db_path, tmp_path, repair):
+    execute(db_path, "INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID) "
+                     "VALUES ('Fare', 2.5, '2026-01-05 08:00:00', 1)")
+    archive_dir = str(tmp_path / 'archive')
+    report = run_reconciliation(db_path, workers=1, archive_dir=archive_dir)
+    assert [(m['CardID'], m['Expected'], m['Difference']) for m in report['mismatches']] == [(1, 97.5, 2.5)]
+
+    report = run_reconciliation(db_path, workers=1, repair=repair, archive_dir=archive_dir)
+    assert report['repaired'] == 1
+    assert run_reconciliation(db_path, workers=1, archive_dir=archive_dir)['mismatch_count'] == 0
+    assert balances(db_path)[1] == (97.5 if repair == 'balance' else 100.0)
+
+
+def test_archived_transactions_count(db_path, tmp_path):
+    # The opening credits move to an archive month; the hot ledger alone has no baseline
+    execute(db_path, "UPDATE [Transaction] SET TransactionDate = '2025-01-10 09:00:00'")
+    execute(db_path, "INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID) "
+                     "VALUES ('Fare', 2.5, '2026-01-05 08:00:00', 1)")
+    execute(db_path, "UPDATE Card SET Balance = Balance - 2.5 WHERE CardID = 1")
+    archive_dir = str(tmp_path / 'archive')
+    assert archive_month(db_path, 2025, 1, archive_dir)['transactions'] == 3
+
+    report = run_reconciliation(db_path, workers=1, repair='balance', archive_dir=archive_dir)
+    assert report['checked'] == 3
+    assert report['mismatch_count'] == 0
+    assert balances(db_path)[1] == 97.5
+
+    report = run_reconciliation(db_path, workers=1, repair='balance', archive_dir=str(tmp_path / 'empty'))
+    assert report['no_baseline'] == 3
+    assert report['repaired'] == 0
+
+
+def test_ledger_repair_skips_a_card_that_changed_since_reconciling(db_path, tmp_path):
+    execute(db_path, "INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID) "
+                     "VALUES ('Fare', 2.5, '2026-01-05 08:00:00', 1)")
+    report = run_reconciliation(db_path, workers=1, archive_dir=str(tmp_path / 'archive'))
+    # The fare's balance update lands after the mismatch was found
+    execute(db_path, "UPDATE Card SET Balance = Balance - 2.5 WHERE CardID = 1")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert repair_ledger(conn, report['mismatches']) == 0
+    finally:
+        conn.close()
+    assert run_reconciliation(db_path, workers=1, archive_dir=str(tmp_path / 'archive'))['mismatch_count'] == 0
+
+
+def test_archives_beyond_the_attach_limit_are_counted(db_path, tmp_path):
+    archive_dir = str(tmp_path / 'archive')
+    # The opening credits in the oldest month, then one fare in each of the next MAX_ATTACHED months
+    execute(db_path, "UPDATE [Transaction] SET TransactionDate = '2024-01-10 09:00:00'")
+    for month in range(2, MAX_ATTACHED + 2):
+        execute(db_path, "INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID) "
+                         "VALUES ('Fare', 1.0, ?, 1)", (f"2024-{month:02d}-10 09:00:00",))
+    execute(db_path, "UPDATE Card SET Balance = Balance - ? WHERE CardID = 1", (MAX_ATTACHED,))
+    for month in range(1, MAX_ATTACHED + 2):
+        archive_month(db_path, 2024, month, archive_dir)
+
+    report = run_reconciliation(db_path, workers=1, archive_dir=archive_dir)
+    assert report['no_baseline'] == 0
+    assert report['mismatch_count'] == 0
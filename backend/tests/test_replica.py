@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+import time
+
+from replica import ReplicaManager
+from test_trips import idle_card
+
+
+def test_refresh_completes_under_concurrent_writes(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+    stop = threading.Event()
+
+    def write_continuously():
+        writer = sqlite3.connect(db_path)
+        try:
+            while not stop.is_set():
+                with writer:
+                    writer.execute("UPDATE Card SET Balance = Balance + 1 WHERE CardID = 1")
+        finally:
+            writer.close()
+
+    thread = threading.Thread(target=write_continuously)
+    thread.start()
+    replica = ReplicaManager(db_path, pages_per_step=1, step_sleep=0.001)
+    try:
+        replica.refresh()
+    finally:
+        stop.set()
+        thread.join()
+
+    copy = replica.connect()
+    try:
+        assert copy.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+        assert copy.execute("SELECT COUNT(*) FROM Card").fetchone()[0] > 0
+    finally:
+        copy.close()
+
+
+def test_snapshot_older_than_the_clients_write_is_not_usable_for_that_client(db_path):
+    replica = ReplicaManager(db_path)
+    assert not replica.usable(60)
+    replica.refresh()
+    assert replica.usable(60)
+    written_at = time.time()
+    assert not replica.usable(60, written_at)
+    # Clients that did not write keep reading the snapshot
+    assert replica.usable(60)
+    replica.refresh()
+    assert replica.usable(60, written_at)
+
+
+def test_write_sends_its_time_back_and_only_that_client_bypasses_the_replica(app_module, client, monkeypatch):
+    app_module.replica.refresh()
+    used = []
+    monkeypatch.setattr(app_module.replica, 'connect', lambda: used.append(True) or sqlite3.connect(':memory:'))
+    with app_module.app.test_request_context('/trips'):
+        app_module.g.max_staleness = 60
+        app_module.get_db_connection().close()
+    assert used == [True]
+
+    response = client.post('/trips', json={'cardId': idle_card(app_module.DB_PATH), 'entryStationId': 1})
+    assert response.status_code == 201
+    written_at = float(response.headers[app_module.LAST_WRITE_HEADER])
+    assert not app_module.replica.usable(60, written_at)
+    with app_module.app.test_request_context('/trips', headers={app_module.LAST_WRITE_HEADER: str(written_at)}):
+        app_module.g.max_staleness = 60
+        app_module.get_db_connection().close()
+    with app_module.app.test_request_context('/trips'):
+        app_module.g.max_staleness = 60
+        app_module.get_db_connection().close()
+    assert used == [True, True]
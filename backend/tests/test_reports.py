@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+from reports import REPORTS, merge_partials, run_report, split_rowid_ranges
+from tap_journal import write_tap
+
+
+def add_trips(db_path, count):
+    conn = sqlite3.connect(db_path)
+    try:
+        card_ids = [card_id for (card_id,) in conn.execute("SELECT CardID FROM Card ORDER BY CardID")]
+        with conn:
+            for number in range(count):
+                day = f"2024-05-{number % 28 + 1:02d}"
+                card_id, fare = card_ids[number % len(card_ids)], 1.0 + number % 3
+                write_tap(conn, [f"{day} 08:00:00", f"{day} 08:30:00", fare, card_id, number % 3 + 1, 1])
+                conn.execute("INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID) "
+                             "VALUES ('Fare', ?, ?, ?)", (fare, f"{day} 08:30:00", card_id))
+    finally:
+        conn.close()
+
+
+def test_merge_partials_merges_each_aggregate_by_key_and_derives_ratios():
+    report = REPORTS['revenue_per_card_type']
+    merged = merge_partials(report, [
+        [('Adult', 2, 5.0, 2.0, 3.0), ('Student', 1, 1.5, 1.5, 1.5)],
+        [('Adult', 1, 4.0, 4.0, 4.0)],
+        []
+    ])
+    assert merged == [
+        {'TypeName': 'Adult', 'Transactions': 3, 'Revenue': 9.0, 'SmallestCharge': 2.0, 'LargestCharge': 4.0,
+         'AverageCharge': 3.0},
+        {'TypeName': 'Student', 'Transactions': 1, 'Revenue': 1.5, 'SmallestCharge': 1.5, 'LargestCharge': 1.5,
+         'AverageCharge': 1.5}
+    ]
+
+
+def test_rowid_ranges_cover_the_table_without_overlap(db_path):
+    add_trips(db_path, 23)
+    conn = sqlite3.connect(db_path)
+    try:
+        rowids = [rowid for (rowid,) in conn.execute("SELECT rowid FROM Trip ORDER BY rowid")]
+        ranges = split_rowid_ranges(conn, 'Trip', 4)
+    finally:
+        conn.close()
+    assert len(ranges) == 4
+    assert ranges[0][0] == rowids[0] and ranges[-1][1] == rowids[-1]
+    assert all(high + 1 == next_low for (_, high), (next_low, _) in zip(ranges, ranges[1:]))
+
+
+@pytest.mark.parametrize('report_name', sorted(REPORTS))
+def test_split_report_matches_a_single_query(db_path, report_name):
+    add_trips(db_path, 40)
+    report = REPORTS[report_name]
+    conn = sqlite3.connect(db_path)
+    try:
+        whole = conn.execute(report.query, (*report.params, 0, 2 ** 62, '0000', '9999')).fetchall()
+    finally:
+        conn.close()
+
+    # Rows tied on the order column may come back in any order
+    expected = sorted(merge_partials(report, [whole]), key=repr)
+    assert sorted(run_report(report_name, db_path, workers=1)['rows'], key=repr) == expected
+    result = run_report(report_name, db_path, workers=2)
+    assert result['ranges'] > 1
+    assert sorted(result['rows'], key=repr) == expected
+
+
+def test_reports_are_refused_with_sharded_storage(db_path, monkeypatch):
+    monkeypatch.setenv('METRO_SHARDS', '2')
+    with pytest.raises(RuntimeError):
+        run_report('trips_per_station', db_path, workers=1)
@@ -0,0 +1,48 @@
+import sqlite3
+
+from settlement import run_settlement
+from station_graph import MINIMUM_FARE
+
+
+def add_closed_trips(db_path, pairs):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("INSERT INTO FareRule (StartStationID, EndStationID, FareType, FareAmount) "
+                         "VALUES (1, 2, 'Anytime', 25.0)")
+            card_id, multiplier = conn.execute("""
+                SELECT c.CardID, COALESCE(ct.BaseFareMultiplier, 1.0) FROM Card c
+                LEFT JOIN CardType ct ON c.CardTypeID = ct.CardTypeID ORDER BY c.CardID LIMIT 1
+            """).fetchone()
+            trip_ids = [conn.execute("""
+                INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+                VALUES ('2024-01-01 12:00:00', '2024-01-01 12:20:00', NULL, ?, ?, ?)
+            """, (card_id, entry, exit_)).lastrowid for entry, exit_ in pairs]
+        return trip_ids, multiplier
+    finally:
+        conn.close()
+
+
+def fares(db_path, trip_ids):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [conn.execute("SELECT FareAmount FROM Trip WHERE TripID = ?", (trip_id,)).fetchone()[0]
+                for trip_id in trip_ids]
+    finally:
+        conn.close()
+
+
+def test_rule_then_inferred_fare_then_unrated(db_path):
+    # A rule for 1 -> 2, the graph for 2 -> 3, and an exit station the graph does not know
+    (ruled, inferred, unknown), multiplier = add_closed_trips(db_path, [(1, 2), (2, 3), (1, 999)])
+
+    summary = run_settlement(db_path)
+    assert (summary['settled'], summary['unrated']) == (2, 1)
+    # Only one rule exists, so the graph's per-km rate comes from it: 25.0 over the 2.0 km link
+    rate = 25.0 / 2.0
+    assert fares(db_path, [ruled, inferred, unknown]) == [
+        round(25.0 * multiplier, 2), round(max(MINIMUM_FARE, 3.5 * rate) * multiplier, 2), None
+    ]
+
+    # The unrated trip is not rescanned by the next run, until retried
+    assert (run_settlement(db_path)['unrated'], run_settlement(db_path, retry_unrated=True)['unrated']) == (0, 1)
@@ -0,0 +1,152 @@
+import sqlite3
+
+import pytest
+
+from card_store import CardStateStore
+from sharding import ShardedStore
+from tap_journal import write_tap
+
+
+def rows(path, query, params=()):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+
+def make_store(db_path, tmp_path):
+    store = ShardedStore(db_path, 2, str(tmp_path / 'shards'))
+    store.ensure_schema()
+    store.replicate_reference()
+    return store
+
+
+def test_migrate_moves_each_row_once_and_can_be_rerun(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        card_ids = [card_id for (card_id,) in conn.execute("SELECT CardID FROM Card")]
+        with conn:
+            for card_id in card_ids:
+                write_tap(conn, ['2024-05-01 08:00:00', '2024-05-01 08:30:00', 2.5, card_id, 1, 2])
+        transactions = conn.execute("SELECT COUNT(*) FROM [Transaction]").fetchone()[0]
+    finally:
+        conn.close()
+    store = make_store(db_path, tmp_path)
+
+    assert store.migrate() == {'trips': len(card_ids), 'transactions': transactions}
+    assert store.migrate() == {'trips': 0, 'transactions': 0}
+    assert rows(db_path, "SELECT COUNT(*) FROM Trip")[0][0] == 0
+    # Cards stay in project.db as the directory
+    assert rows(db_path, "SELECT COUNT(*) FROM Card")[0][0] == len(card_ids)
+    for shard in range(2):
+        path = store.shard_path(shard)
+        assert all(store.shard_for(card_id) == shard for (card_id,) in rows(path, "SELECT CardID FROM Trip"))
+    assert sum(rows(store.shard_path(shard), "SELECT COUNT(*) FROM Trip")[0][0] for shard in range(2)) == len(card_ids)
+    store.close()
+
+
+def test_scatter_merges_shards_in_order_and_limits(db_path, tmp_path):
+    store = make_store(db_path, tmp_path)
+    store.migrate()
+    card_ids = [card_id for (card_id,) in rows(db_path, "SELECT CardID FROM Card")]
+    assert len({store.shard_for(card_id) for card_id in card_ids}) == 2
+    for hour, card_id in enumerate(card_ids * 2):
+        store.execute(card_id, "INSERT INTO Trip (EntryTime, CardID, EntryStationID) VALUES (?, ?, 1)",
+                      (f"2024-05-01 {hour:02d}:00:00", card_id))
+
+    query = "SELECT TripID, EntryTime FROM Trip ORDER BY EntryTime DESC, TripID DESC"
+    merged = store.scatter(query, order_fields=('EntryTime', 'TripID'), descending=True)
+    assert [row['EntryTime'] for row in merged] == [f"2024-05-01 {hour:02d}:00:00"
+                                                     for hour in reversed(range(len(card_ids) * 2))]
+    # Trip IDs come from each shard's own block
+    assert len({row['TripID'] for row in merged}) == len(merged)
+    limited = store.scatter(query, order_fields=('EntryTime', 'TripID'), descending=True, limit=3)
+    assert limited == merged[:3]
+    assert store.count("SELECT COUNT(*) AS total FROM Trip") == len(merged)
+    store.close()
+
+
+def test_upsert_reference_copies_only_the_requested_rows(db_path, tmp_path):
+    store = make_store(db_path, tmp_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            passenger_id = conn.execute("""
+                INSERT INTO Passenger (FirstName, LastName, Email, RegistrationDate)
+                VALUES ('Ada', 'Lovelace', 'ada@example.com', '2024-05-01 08:00:00')
+            """).lastrowid
+    finally:
+        conn.close()
+    # A row only the shard has must survive: the table is not rewritten
+    store.execute(1, "UPDATE Passenger SET LastName = 'Kept' WHERE PassengerID = 1")
+
+    store.upsert_reference('Passenger', 'PassengerID', passenger_id, passenger_id)
+    shard = store.shard_path(store.shard_for(1))
+    assert rows(shard, "SELECT Email FROM Passenger WHERE PassengerID = ?", (passenger_id,)) == [('ada@example.com',)]
+    assert rows(shard, "SELECT LastName FROM Passenger WHERE PassengerID = 1") == [('Kept',)]
+    with pytest.raises(ValueError):
+        store.upsert_reference('Card', 'CardID', 1)
+    store.close()
+
+
+def test_card_store_reconciles_from_the_shard_balances(db_path, tmp_path):
+    store = make_store(db_path, tmp_path)
+    store.migrate()
+    store.execute(1, "UPDATE Card SET Balance = 12.5 WHERE CardID = 1")
+
+    card_store = CardStateStore()
+    conns = [store.connect(shard) for shard in range(2)]
+    try:
+        loaded, _ = card_store.reconcile(*conns)
+    finally:
+        for conn in conns:
+            conn.close()
+    assert loaded == rows(db_path, "SELECT COUNT(*) FROM Card")[0][0]
+    assert card_store.get(1)['Balance'] == 12.5
+    store.close()
+
+
+@pytest.fixture
+def sharded(app_module, tmp_path, monkeypatch):
+    """The app with two card shards and no tap journal; project.db's existing rows stay unmigrated."""
+    store = make_store(app_module.DB_PATH, tmp_path)
+    monkeypatch.setattr(app_module, 'shard_store', store)
+    monkeypatch.setattr(app_module, 'SHARD_COUNT', 2)
+    monkeypatch.setattr(app_module, 'tap_journal', None)
+    yield store
+    store.close()
+
+
+def test_card_trip_and_top_up_are_written_to_the_cards_shard(app_module, client, sharded):
+    response = client.post('/api/cards', json={'cardNumber': 'SHARD0001', 'balance': 20.0,
+                                               'passengerId': 1, 'cardTypeId': 1})
+    assert response.status_code == 201
+    card_id = response.get_json()['id']
+    shard = sharded.shard_path(sharded.shard_for(card_id))
+    assert rows(shard, "SELECT Balance FROM Card WHERE CardID = ?", (card_id,)) == [(20.0,)]
+    assert rows(shard, "SELECT TransactionType, Amount FROM [Transaction] WHERE CardID = ?",
+                (card_id,)) == [('Issue', 20.0)]
+
+    assert client.post('/trips', json={'cardId': card_id, 'entryStationId': 1}).status_code == 201
+    assert client.post('/trips', json={'cardId': card_id, 'entryStationId': 1,
+                                       'exitStationId': 2}).status_code == 201
+    assert rows(shard, "SELECT EntryStationID, ExitStationID FROM Trip WHERE CardID = ?", (card_id,)) == [(1, 2)]
+
+    response = client.post(f'/api/cards/{card_id}/top-up', json={'amount': 5})
+    assert response.status_code == 200
+    assert response.get_json()['balance'] == 25.0
+    assert rows(shard, "SELECT Balance FROM Card WHERE CardID = ?", (card_id,)) == [(25.0,)]
+    # project.db holds the directory entry only: no trips, no ledger rows
+    assert rows(app_module.DB_PATH, "SELECT COUNT(*) FROM Trip WHERE CardID = ?", (card_id,)) == [(0,)]
+    assert rows(app_module.DB_PATH, "SELECT COUNT(*) FROM [Transaction] WHERE CardID = ?", (card_id,)) == [(0,)]
+
+
+def test_new_passenger_is_copied_into_every_shard(app_module, client, sharded):
+    response = client.post('/api/passengers', json={'firstName': 'Grace', 'lastName': 'Hopper',
+                                                    'email': 'grace.sharded@example.com'})
+    assert response.status_code == 201
+    passenger_id = response.get_json()['id']
+    for shard in range(2):
+        assert rows(sharded.shard_path(shard), "SELECT Email FROM Passenger WHERE PassengerID = ?",
+                    (passenger_id,)) == [('grace.sharded@example.com',)]
@@ -0,0 +1,35 @@
+import sqlite3
+
+from station_graph import StationGraph, ensure_schema
+
+
+def test_swapped_distances_rebuild_the_graph(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn)
+        graph = StationGraph()
+        assert graph.refresh(conn)
+        assert not graph.refresh(conn)
+
+        links = "SELECT FromStationID, ToStationID, DistanceKm FROM StationLink ORDER BY DistanceKm {} LIMIT 1"
+        (a, b, d1), = conn.execute(links.format('ASC')).fetchall()
+        (c, e, d2), = conn.execute(links.format('DESC')).fetchall()
+        assert d1 != d2
+        # Swapping two distances keeps every count and sum the old signature was built from
+        with conn:
+            conn.execute("UPDATE StationLink SET DistanceKm = ? WHERE FromStationID = ? AND ToStationID = ?", (d2, a, b))
+            conn.execute("UPDATE StationLink SET DistanceKm = ? WHERE FromStationID = ? AND ToStationID = ?", (d1, c, e))
+        assert graph.refresh(conn)
+        assert graph.rebuild_count == 2
+    finally:
+        conn.close()
+
+
+def test_refresh_without_version_table_always_rebuilds(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        graph = StationGraph()
+        assert graph.refresh(conn)
+        assert graph.refresh(conn)
+    finally:
+        conn.close()
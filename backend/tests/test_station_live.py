@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from station_live import StationLiveCounters
+
+
+@pytest.fixture
+def counters(db_path):
+    """Counters on a settable bucket clock, starting with no open trips."""
+    counters = StationLiveCounters(db_path, window_seconds=30, bucket_seconds=5, open_counts=dict)
+    counters.clock = 1000
+    counters._bucket_now = lambda: counters.clock
+    counters._expired_through = counters.clock - counters._bucket_count
+    return counters
+
+
+def station(counters, station_id):
+    return next(row for row in counters.snapshot()['stations'] if row['StationID'] == station_id)
+
+
+def test_exit_closes_the_trip_at_its_entry_station(counters):
+    counters.record_tap(1, 'entry', opened=True)
+    counters.record_tap(1, 'entry', opened=True)
+    counters.record_tap(2, 'exit', closed_station=1)
+    assert (station(counters, 1)['OpenTrips'], station(counters, 1)['Entries']) == (1, 2)
+    assert (station(counters, 2)['OpenTrips'], station(counters, 2)['Exits']) == (0, 1)
+
+    counters.record_close(1)
+    # Closes the write path could not match never take a count below zero
+    counters.record_close(1)
+    counters.record_tap(3, 'exit', closed_station=3)
+    snapshot = counters.snapshot()
+    assert snapshot['totalOpen'] == 0
+    assert station(counters, 3)['Exits'] == 1
+
+
+def test_taps_leave_the_window_bucket_by_bucket(counters):
+    counters.record_tap(1, 'entry', opened=True)
+    counters.clock += 3
+    counters.record_tap(1, 'entry', opened=True)
+    counters.clock += 3
+    # The first bucket has left the six-bucket window; open trips are not windowed
+    assert (station(counters, 1)['Entries'], station(counters, 1)['OpenTrips']) == (1, 2)
+    counters.clock += 100
+    assert station(counters, 1)['Entries'] == 0
+    counters.record_tap(1, 'exit')
+    assert (station(counters, 1)['Entries'], station(counters, 1)['Exits']) == (0, 1)
+
+
+def test_reconcile_resets_open_counts_and_reports_the_drift(counters, monkeypatch):
+    counters.record_tap(1, 'entry', opened=True)
+    counters.record_tap(2, 'entry', opened=True)
+    monkeypatch.setattr(counters, '_load_open_counts', lambda: {1: 3})
+    # Station 1 was one short, station 2's trip was closed out of band
+    assert counters.reconcile() == 3
+    assert counters.last_drift == 3
+    assert (station(counters, 1)['OpenTrips'], station(counters, 2)['OpenTrips']) == (3, 0)
+    assert station(counters, 1)['StationName'] is not None
+
+
+def test_stream_sends_a_snapshot_per_change_and_ends_on_stop(counters):
+    events = counters.stream(interval=0, heartbeat=5)
+    assert next(events) == "retry: 3000\n\n"
+    first = next(events)
+    assert first.startswith('id: 0\nevent: stations\n')
+    threading.Timer(0.05, counters.record_tap, (1, 'entry'), {'opened': True}).start()
+    # Waits for the change rather than the heartbeat
+    assert next(events).startswith('id: 1\n')
+    counters.stop()
+    with pytest.raises(StopIteration):
+        next(events)
@@ -0,0 +1,61 @@
+import sqlite3
+
+from tap_filter import TapFilter, ACCEPT, DUPLICATE, PASSBACK, PENDING
+
+CARD = 1
+
+
+class LookupConnection:
+    """Wraps a connection to run a callback when the filter reads the open-trip index."""
+
+    def __init__(self, conn, on_lookup):
+        self.conn = conn
+        self.on_lookup = on_lookup
+
+    def execute(self, query, params=()):
+        self.on_lookup()
+        return self.conn.execute(query, params)
+
+
+def test_admitted_entry_is_a_passback_for_a_second_gate_before_it_is_written(db_path):
+    tap_filter = TapFilter()
+    conn = sqlite3.connect(db_path)
+    try:
+        assert tap_filter.admit(conn, CARD, 1, 'entry') == (ACCEPT, None)
+        assert tap_filter.admit(conn, CARD, 2, 'entry') == (PASSBACK, PENDING)
+        assert tap_filter.admit(conn, CARD, 1, 'entry') == (DUPLICATE, None)
+    finally:
+        conn.close()
+
+
+def test_released_entry_can_be_retried_at_any_gate(db_path):
+    tap_filter = TapFilter()
+    conn = sqlite3.connect(db_path)
+    try:
+        assert tap_filter.admit(conn, CARD, 1, 'entry') == (ACCEPT, None)
+        tap_filter.release(CARD, 1, 'entry')
+        assert tap_filter.admit(conn, CARD, 2, 'entry') == (ACCEPT, None)
+    finally:
+        conn.close()
+
+
+def test_cold_lookup_runs_outside_the_lock_and_is_rechecked(db_path):
+    tap_filter = TapFilter()
+    conn = sqlite3.connect(db_path)
+    racing = []
+
+    def entry_at_another_gate():
+        assert not tap_filter._lock.locked()
+        if not racing:
+            # Another gate's entry for the same card is admitted while this lookup runs
+            racing.append(tap_filter.admit(conn, CARD, 2, 'entry'))
+
+    try:
+        decision = tap_filter.admit(LookupConnection(conn, entry_at_another_gate), CARD, 1, 'entry')
+    finally:
+        conn.close()
+    assert racing == [(ACCEPT, None)]
+    assert decision == (PASSBACK, PENDING)
+    stats = tap_filter.stats()
+    assert stats['accepted'] == 1
+    assert stats['passback_rejections'] == 1
@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+from tap_journal import TapJournal, JournalFull, JournalTimeout, HEADER_SIZE, RECORD_HEADER
+from test_trips import idle_card, trips_for
+
+ENTRY = ['2024-01-01 08:00:00', None, None, 1, 1, None]
+
+
+def trip_count(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM Trip WHERE EntryTime = ?", (ENTRY[0],)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def applied_seq(db_path, journal):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT AppliedSeq FROM TapJournalState WHERE Journal = ?",
+                            (journal.name,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def crash(journal):
+    """Stop the threads and drop the mapping without draining, as a killed process would."""
+    journal._stop.set()
+    for thread in journal._threads:
+        thread.join()
+    journal._threads = []
+    journal._mm.close()
+    journal._file.close()
+
+
+def test_durable_taps_are_replayed_after_a_restart(db_path, tmp_path):
+    path = str(tmp_path / 'taps.log')
+    journal = TapJournal(path, db_path, size_bytes=64 * 1024, drain_interval=60)
+    journal.start()
+    seq = journal.append(ENTRY)
+    crash(journal)
+    assert trip_count(db_path) == 0
+
+    restarted = TapJournal(path, db_path, size_bytes=64 * 1024, drain_interval=60)
+    assert restarted.open() == 1
+    conn = restarted._connect()
+    try:
+        assert restarted.drain_once(conn) == 1
+    finally:
+        conn.close()
+    restarted._mm.close()
+    restarted._file.close()
+    assert trip_count(db_path) == 1
+    assert applied_seq(db_path, restarted) == seq
+
+
+def test_restart_after_applying_replays_nothing(db_path, tmp_path):
+    path = str(tmp_path / 'taps.log')
+    journal = TapJournal(path, db_path, size_bytes=64 * 1024, drain_interval=60)
+    journal.start()
+    journal.append(ENTRY)
+    journal.stop()
+    assert trip_count(db_path) == 1
+
+    restarted = TapJournal(path, db_path, size_bytes=64 * 1024, drain_interval=60)
+    restarted.start()
+    restarted.stop()
+    assert trip_count(db_path) == 1
+
+
+def test_drainer_skips_records_at_or_below_applied_seq(db_path, tmp_path):
+    journal = TapJournal(str(tmp_path / 'taps.log'), db_path, size_bytes=64 * 1024, drain_interval=60)
+    journal.start()
+    journal.append(ENTRY)
+    journal.stop()
+    record = (applied_seq(db_path, journal), 0.0, ENTRY)
+
+    # A batch re-read after a crash between COMMIT and dropping it from memory
+    conn = journal._connect()
+    try:
+        assert journal._apply_batch(conn, [record]) == []
+    finally:
+        conn.close()
+    assert trip_count(db_path) == 1
+
+
+def test_flush_timeout_leaves_the_tap_queued_once(db_path, tmp_path):
+    journal = TapJournal(str(tmp_path / 'taps.log'), db_path, size_bytes=64 * 1024,
+                         flush_interval=0.5, drain_interval=60)
+    journal.start()
+    with pytest.raises(JournalTimeout) as raised:
+        journal.append(ENTRY, timeout=0.01)
+    assert raised.value.seq == 1
+    assert [record[0] for record in journal._pending] == [1]
+    journal.stop()
+    assert trip_count(db_path) == 1
+
+
+def test_full_journal_queues_nothing(db_path, tmp_path):
+    size = HEADER_SIZE + 2 * RECORD_HEADER.size + 16
+    journal = TapJournal(str(tmp_path / 'taps.log'), db_path, size_bytes=size, drain_interval=60)
+    journal.start()
+    try:
+        with pytest.raises(JournalFull):
+            journal.append(ENTRY)
+        assert not journal._pending
+    finally:
+        journal.stop()
+    assert trip_count(db_path) == 0
+
+
+def test_tap_whose_flush_times_out_is_accepted_and_written_once(app_module, client, tmp_path, monkeypatch):
+    journal = TapJournal(str(tmp_path / 'taps.log'), app_module.DB_PATH, size_bytes=64 * 1024,
+                         flush_interval=0.5, drain_interval=60, on_applied=app_module.on_taps_applied)
+    journal.start()
+    monkeypatch.setattr(app_module, 'tap_journal', journal)
+    original_append = journal.append
+    monkeypatch.setattr(journal, 'append', lambda values: original_append(values, timeout=0.01))
+    card_id = idle_card(app_module.DB_PATH)
+    before = len(trips_for(app_module.DB_PATH, card_id))
+
+    response = client.post('/trips', json={'cardId': card_id, 'entryStationId': 1})
+    journal.stop()
+    assert response.status_code == 202
+    assert response.get_json()['journalSeq'] == 1
+    assert len(trips_for(app_module.DB_PATH, card_id)) == before + 1
+
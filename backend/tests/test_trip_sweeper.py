@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from sharding import ShardedStore
+from trip_sweeper import TripSweeper
+
+STALE_ENTRY = '2000-01-01 08:00:00'
+
+
+def open_stale_trips(path):
+    """Open a stale trip for every card in the database; returns how many."""
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            return conn.execute("""
+                INSERT INTO Trip (EntryTime, ExitTime, FareAmount, CardID, EntryStationID, ExitStationID)
+                SELECT ?, NULL, NULL, CardID, 1, NULL FROM Card
+                WHERE CardID NOT IN (SELECT CardID FROM Trip WHERE ExitTime IS NULL)
+            """, (STALE_ENTRY,)).rowcount
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('shards', [0, 2])
+def test_sweep_closes_stale_trips_in_every_database(db_path, tmp_path, shards):
+    paths = [db_path]
+    if shards:
+        store = ShardedStore(db_path, shards, str(tmp_path / 'shards'))
+        store.ensure_schema()
+        store.replicate_reference()
+        store.migrate()
+        paths = [store.shard_path(shard) for shard in range(shards)]
+        store.close()
+    stale = sum(open_stale_trips(path) for path in paths)
+    assert stale
+
+    swept = []
+    sweeper = TripSweeper(db_path, penalty_fare=50.0, on_closed=swept.extend,
+                          shard_paths=paths if shards else ())
+    assert sweeper.sweep_once() == stale
+    assert len(swept) == stale
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            assert conn.execute("SELECT COUNT(*) FROM Trip WHERE ExitTime IS NULL AND EntryTime = ?",
+                                (STALE_ENTRY,)).fetchone()[0] == 0
+        finally:
+            conn.close()
@@ -0,0 +1,120 @@
+import sqlite3
+
+import pytest
+
+from tap_journal import TapJournal, JournalLocked
+
+
+def idle_card(db_path):
+    """A card with no open trip, issuing a new one once every sample card is mid-journey."""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("""
+            SELECT CardID FROM Card
+            WHERE CardID NOT IN (SELECT CardID FROM Trip WHERE ExitTime IS NULL)
+            ORDER BY CardID LIMIT 1
+        """).fetchone()
+        if row:
+            return row[0]
+        with conn:
+            return conn.execute("""
+                INSERT INTO Card (CardNumber, Balance, Status, IssueDate)
+                VALUES ('TEST' || (SELECT COUNT(*) FROM Card), 50.0, 'Active', '2024-01-01')
+            """).lastrowid
+    finally:
+        conn.close()
+
+
+def trips_for(db_path, card_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("""
+            SELECT TripID, EntryStationID, ExitStationID, ExitTime IS NULL
+            FROM Trip WHERE CardID = ? ORDER BY TripID
+        """, (card_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def tap(client, card_id, station_id, exit_tap=False):
+    body = {'cardId': card_id, 'entryStationId': station_id}
+    if exit_tap:
+        body['exitStationId'] = station_id
+    return client.post('/trips', json=body)
+
+
+def test_exit_closes_open_trip_and_next_entry_is_admitted(app_module, client):
+    card_id = idle_card(app_module.DB_PATH)
+    before = trips_for(app_module.DB_PATH, card_id)
+
+    entry = tap(client, card_id, 1)
+    assert entry.status_code == 201
+    app_module.tap_filter._recent.clear()
+    exit_ = tap(client, card_id, 2, exit_tap=True)
+    assert exit_.status_code == 201
+    assert exit_.get_json()['id'] == entry.get_json()['id']
+    app_module.tap_filter._recent.clear()
+    assert tap(client, card_id, 3).status_code == 201
+
+    trips = trips_for(app_module.DB_PATH, card_id)[len(before):]
+    assert trips == [(entry.get_json()['id'], 1, 2, 0), (trips[1][0], 3, None, 1)]
+
+
+def test_second_entry_without_exit_is_passback(app_module, client):
+    card_id = idle_card(app_module.DB_PATH)
+    assert tap(client, card_id, 1).status_code == 201
+    app_module.tap_filter._recent.clear()
+    app_module.tap_filter._open.clear()
+    assert tap(client, card_id, 2).status_code == 409
+
+
+def test_journal_exit_closes_the_journaled_entry(db_path, tmp_path):
+    card_id = idle_card(db_path)
+    before = trips_for(db_path, card_id)
+    applied = []
+    journal = TapJournal(str(tmp_path / 'taps.log'), db_path, size_bytes=1024 * 1024,
+                         drain_interval=60, on_applied=applied.extend)
+    journal.start()
+    journal.append(['2024-01-01 08:00:00', None, None, card_id, 1, None])
+    journal.append(['2024-01-01 08:30:00', '2024-01-01 08:30:00', None, card_id, 1, 4])
+    journal.stop()
+
+    trips = trips_for(db_path, card_id)[len(before):]
+    assert trips == [(trips[0][0], 1, 4, 0)]
+    assert [(trip_id, closed) for _, trip_id, closed in applied] == [
+        (trips[0][0], None), (trips[0][0], (1, '2024-01-01 08:00:00'))
+    ]
+
+
+def test_open_counts_include_a_new_entry(app_module, client):
+    before = client.get('/trips/open-counts').get_json()['total']
+    assert tap(client, idle_card(app_module.DB_PATH), 1).status_code == 201
+    assert client.get('/trips/open-counts').get_json()['total'] == before + 1
+
+
+def test_exit_takes_the_trip_off_the_entry_station_live_count(app_module, client):
+    def open_at(station_id):
+        stations = app_module.station_live.snapshot()['stations']
+        return next((s['OpenTrips'] for s in stations if s['StationID'] == station_id), 0)
+
+    card_id = idle_card(app_module.DB_PATH)
+    before = open_at(1)
+    assert tap(client, card_id, 1).status_code == 201
+    assert open_at(1) == before + 1
+    app_module.tap_filter._recent.clear()
+    assert tap(client, card_id, 2, exit_tap=True).status_code == 201
+    assert open_at(1) == before
+
+
+def test_journal_file_is_refused_to_a_second_opener(db_path, tmp_path):
+    path = str(tmp_path / 'taps.log')
+    first = TapJournal(path, db_path, size_bytes=1024 * 1024, drain_interval=60)
+    second = TapJournal(path, db_path, size_bytes=1024 * 1024, drain_interval=60)
+    first.start()
+    try:
+        with pytest.raises(JournalLocked):
+            second.start()
+    finally:
+        first.stop()
+    second.start()
+    second.stop()
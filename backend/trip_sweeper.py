@@ -0,0 +1,145 @@
+import sqlite3
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Any, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PENALTY_FARE = 100.0
+BUSY_TIMEOUT_SECONDS = 5
+
+# Pinned to the idx_trip_open partial index, which holds one row per card mid-journey;
+# the planner would otherwise scan Card first
+STALE_OPEN_TRIPS_QUERY = """
+    SELECT t.TripID, t.CardID, COALESCE(ct.BaseFareMultiplier, 1.0)
+    FROM Trip t INDEXED BY idx_trip_open
+    CROSS JOIN Card c ON t.CardID = c.CardID
+    LEFT JOIN CardType ct ON c.CardTypeID = ct.CardTypeID
+    WHERE t.ExitTime IS NULL AND t.EntryTime < ?
+    LIMIT ?
+"""
+
+
+class TripSweeper:
+    """
+    Closes trips left open longer than max_age, charging a penalty fare.
+
+    Each batch is its own short write transaction so the sweeper never
+    holds the database lock for long; a pause between batches lets tap
+    writes interleave. With sharded storage every card shard is swept in
+    turn instead of project.db.
+    """
+
+    def __init__(self, db_path: str, max_age_hours: float = 6.0, penalty_fare: Optional[float] = None,
+                 batch_size: int = 500, interval_seconds: float = 300.0, batch_pause: float = 0.05,
+                 on_closed: Optional[Callable[[List[Tuple[int, float]]], None]] = None,
+                 shard_paths: Sequence[str] = ()):
+        self.db_path = db_path
+        self.shard_paths = list(shard_paths)
+        self.max_age_hours = max_age_hours
+        self.penalty_fare = penalty_fare
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.batch_pause = batch_pause
+        self.on_closed = on_closed
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_sweep: Optional[str] = None
+        self.total_closed = 0
+
+    def _penalty(self, conn: sqlite3.Connection) -> float:
+        """The configured penalty, else the highest fare in FareRule."""
+        if self.penalty_fare is not None:
+            return self.penalty_fare
+        highest = conn.execute("SELECT MAX(FareAmount) FROM FareRule").fetchone()[0]
+        return highest if highest is not None else DEFAULT_PENALTY_FARE
+
+    def _sweep_batch(self, conn: sqlite3.Connection, cutoff: str, closed_at: str) -> List[Tuple[int, float]]:
+        """Close one batch of stale trips; returns (CardID, charged amount) per closed trip."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(STALE_OPEN_TRIPS_QUERY, (cutoff, self.batch_size)).fetchall()
+            if not rows:
+                conn.execute("COMMIT")
+                return []
+            penalty = self._penalty(conn)
+            charges = [(trip_id, card_id, round(penalty * multiplier, 2)) for trip_id, card_id, multiplier in rows]
+            conn.executemany(
+                "UPDATE Trip SET ExitTime = ?, FareAmount = ? WHERE TripID = ? AND ExitTime IS NULL",
+                [(closed_at, amount, trip_id) for trip_id, _, amount in charges]
+            )
+            conn.executemany("UPDATE Card SET Balance = Balance - ? WHERE CardID = ?",
+                             [(amount, card_id) for _, card_id, amount in charges])
+            conn.executemany("""
+                INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID)
+                VALUES ('Penalty', ?, ?, ?)
+            """, [(amount, closed_at, card_id) for _, card_id, amount in charges])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(card_id, amount) for _, card_id, amount in charges]
+
+    def sweep_once(self) -> int:
+        """
+        Close every trip that has been open longer than max_age_hours
+        :return: number of trips closed
+        """
+        now = datetime.now()
+        cutoff = (now - timedelta(hours=self.max_age_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        closed_at = now.strftime('%Y-%m-%d %H:%M:%S')
+        closed = 0
+        for path in self.shard_paths or [self.db_path]:
+            conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            try:
+                while not self._stop.is_set():
+                    charged = self._sweep_batch(conn, cutoff, closed_at)
+                    if not charged:
+                        break
+                    closed += len(charged)
+                    if self.on_closed:
+                        self.on_closed(charged)
+                    if len(charged) < self.batch_size:
+                        break
+                    time.sleep(self.batch_pause)
+            finally:
+                conn.close()
+        self.total_closed += closed
+        self.last_sweep = closed_at
+        if closed:
+            logger.info(f"Trip sweeper closed {closed} abandoned trip(s) opened before {cutoff}")
+        return closed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.sweep_once()
+            except Exception as e:
+                logger.error(f"Error sweeping open trips: {e}")
+
+    def start(self) -> None:
+        """Start the background sweep thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='trip-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background sweep thread."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'max_age_hours': self.max_age_hours,
+            'interval_seconds': self.interval_seconds,
+            'last_sweep': self.last_sweep,
+            'total_closed': self.total_closed,
+            'databases': len(self.shard_paths) or 1
+        }
@@ -110,9 +110,59 @@ def create_tables_if_not_exist(conn: sqlite3.Connection) -> None:
             FOREIGN KEY (CardID) REFERENCES Card(CardID),
             FOREIGN KEY (EntryStationID) REFERENCES Station(StationID),
             FOREIGN KEY (ExitStationID) REFERENCES Station(StationID)
+        )""",
+        
+        'StationLink': """
+        CREATE TABLE IF NOT EXISTS StationLink (
+            FromStationID INTEGER NOT NULL,
+            ToStationID INTEGER NOT NULL,
+            DistanceKm REAL NOT NULL CHECK (DistanceKm > 0),
+            PRIMARY KEY (FromStationID, ToStationID),
+            FOREIGN KEY (FromStationID) REFERENCES Station(StationID),
+            FOREIGN KEY (ToStationID) REFERENCES Station(StationID)
         )"""
     }
     
+    indexes = {
+        'idx_transaction_card': """
+        CREATE INDEX IF NOT EXISTS idx_transaction_card
+        ON [Transaction] (CardID, TransactionDate)""",
+        
+        'idx_transaction_date': """
+        CREATE INDEX IF NOT EXISTS idx_transaction_date
+        ON [Transaction] (TransactionDate)""",
+        
+        'idx_trip_entry_time': """
+        CREATE INDEX IF NOT EXISTS idx_trip_entry_time
+        ON Trip (EntryTime)""",
+        
+        'idx_trip_open': """
+        CREATE INDEX IF NOT EXISTS idx_trip_open
+        ON Trip (CardID, EntryTime)
+        WHERE ExitTime IS NULL""",
+        
+        'idx_trip_unsettled': """
+        CREATE INDEX IF NOT EXISTS idx_trip_unsettled
+        ON Trip (TripID)
+        WHERE FareAmount IS NULL AND ExitTime IS NOT NULL""",
+        
+        'idx_trip_card': """
+        CREATE INDEX IF NOT EXISTS idx_trip_card
+        ON Trip (CardID, EntryTime)""",
+
+        'idx_trip_entry_station': """
+        CREATE INDEX IF NOT EXISTS idx_trip_entry_station
+        ON Trip (EntryStationID, EntryTime)""",
+
+        'idx_trip_exit_station': """
+        CREATE INDEX IF NOT EXISTS idx_trip_exit_station
+        ON Trip (ExitStationID, EntryTime)""",
+
+        'idx_card_passenger': """
+        CREATE INDEX IF NOT EXISTS idx_card_passenger
+        ON Card (PassengerID)"""
+    }
+    
     try:
         cursor = conn.cursor()
         
@@ -125,6 +175,19 @@ def create_tables_if_not_exist(conn: sqlite3.Connection) -> None:
                 logger.error(f"Error creating table {table_name}: {e}")
                 raise
         
+        # Create indexes
+        for index_name, create_sql in indexes.items():
+            try:
+                cursor.execute(create_sql)
+                logger.info(f"Created/Verified index: {index_name}")
+            except sqlite3.Error as e:
+                logger.error(f"Error creating index {index_name}: {e}")
+                raise
+
+        # Indexes made redundant by the ones above; dropped from existing databases
+        for index_name in ('idx_trip_open_station',):
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        
         # Insert default card types if they don't exist
         default_card_types = [
             ('Regular', 1.0, 'Standard fare card'),
@@ -164,6 +227,33 @@ def create_tables_if_not_exist(conn: sqlite3.Connection) -> None:
             )
             logger.info("Inserted default stations")
         
+        # Link the default stations into a network if no links exist yet
+        default_links = [
+            ('Central Station', 'Downtown', 2.0),
+            ('Downtown', 'University', 3.5),
+            ('University', 'City Park', 2.5),
+            ('City Park', 'Terminal', 4.0),
+            ('Central Station', 'City Park', 5.0)
+        ]
+        
+        cursor.execute("SELECT COUNT(*) FROM StationLink")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("SELECT StationID, StationName FROM Station")
+            station_ids = {row[1]: row[0] for row in cursor.fetchall()}
+            links = [
+                (station_ids[start], station_ids[end], distance)
+                for start, end, distance in default_links
+                if start in station_ids and end in station_ids
+            ]
+            cursor.executemany(
+                """
+                INSERT INTO StationLink (FromStationID, ToStationID, DistanceKm)
+                VALUES (?, ?, ?)
+                """,
+                links
+            )
+            logger.info("Inserted default station links")
+        
         conn.commit()
         logger.info("Database schema initialized successfully")
         
@@ -226,6 +316,13 @@ def insert_sample_data(conn: sqlite3.Connection) -> None:
             """,
             sample_cards
         )
+        # Opening balances go on the ledger as 'Issue' credits so balances reconcile
+        cursor.execute(
+            """
+            INSERT INTO [Transaction] (TransactionType, Amount, TransactionDate, CardID)
+            SELECT 'Issue', Balance, IssueDate, CardID FROM Card
+            """
+        )
         
         conn.commit()
         logger.info("Sample data inserted successfully")